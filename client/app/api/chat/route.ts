@@ -1,4 +1,9 @@
 import { NextRequest, NextResponse } from "next/server";
+import { promisify } from "util";
+import { gzip } from "zlib";
+import { randomBytes } from "crypto";
+
+const gzipAsync = promisify(gzip);
 
 // Конфигурация для больших запросов (до 50MB)
 export const maxDuration = 300; // 5 минут
@@ -15,6 +20,46 @@ const ENDPOINTS: Record<string, string> = {
   Purple: process.env.API_ENDPOINT_PURPLE || "http://localhost:8000/purple",
 };
 
+// Тела больше этого размера сжимаются gzip перед отправкой на сервер генерации
+const COMPRESSION_MIN_SIZE = Number(process.env.COMPRESSION_MIN_SIZE || 1024);
+
+const TRACEPARENT_RE = /^00-[0-9a-f]{32}-[0-9a-f]{16}-[0-9a-f]{2}$/;
+
+// Контекст трассы W3C: продолжаем трассу браузера или начинаем новую, чтобы сервер записал спаны в ту же трассу
+function traceparentFor(request: NextRequest): string {
+  const incoming = request.headers.get("traceparent");
+  if (incoming && TRACEPARENT_RE.test(incoming)) {
+    return incoming;
+  }
+  return `00-${randomBytes(16).toString("hex")}-${randomBytes(8).toString("hex")}-01`;
+}
+
+// Идентификатор вызывающей стороны для учета токенов на сервере: заголовок клиента или CALLER_ID прокси
+function callerIdFor(request: NextRequest): string {
+  const callerId = (request.headers.get("x-caller-id") || process.env.CALLER_ID || "web").replace(/[^\x20-\x7E]/g, "");
+  return callerId.slice(0, 64) || "web";
+}
+
+// Отправляет JSON на сервер генерации; большие тела сжимаются (Content-Encoding: gzip).
+// signal — сигнал запроса браузера: если он отключился, соединение с сервером закрывается и сервер отменяет генерацию
+async function postJson(endpoint: string, payload: unknown, forwardHeaders: Record<string, string>,
+                        signal?: AbortSignal): Promise<Response> {
+  const json = JSON.stringify(payload);
+  const headers: Record<string, string> = {
+    "Content-Type": "application/json",
+    "Accept-Encoding": "gzip, br",
+    ...forwardHeaders,
+  };
+  let body: BodyInit = json;
+
+  if (Buffer.byteLength(json) >= COMPRESSION_MIN_SIZE) {
+    body = new Uint8Array(await gzipAsync(json));
+    headers["Content-Encoding"] = "gzip";
+  }
+
+  return fetch(endpoint, { method: "POST", headers, body, signal });
+}
+
 export async function POST(request: NextRequest) {
   let colorMode = "Green";
   
@@ -32,12 +77,16 @@ export async function POST(request: NextRequest) {
       );
     }
     
-    const { text, colorMode: mode, openapiSpec } = body;
+    const traceparent = traceparentFor(request);
+    const forwardHeaders = { traceparent, "X-Caller-ID": callerIdFor(request) };
+    const { text, colorMode: mode, openapiSpec, limeMode, previousCode, previousSpec, previousFingerprints, modelHint } = body;
+    // fast — малая модель, quality — большая; без подсказки сервер выбирает модель по режиму и размеру входа
+    const model_hint = modelHint === "fast" || modelHint === "quality" ? modelHint : undefined;
     colorMode = mode || "Green";
     
     // Логируем размер данных для отладки
     const dataSize = requestText.length;
-    console.log(`[DEBUG] Размер данных запроса: ${(dataSize / 1024 / 1024).toFixed(2)} MB`);
+    console.log(`[DEBUG] Размер данных запроса: ${(dataSize / 1024 / 1024).toFixed(2)} MB, trace_id: ${traceparent.split("-")[1]}`);
 
     // Режим Lime - обработка OpenAPI спецификации
     if (colorMode === "Lime") {
@@ -50,13 +99,15 @@ export async function POST(request: NextRequest) {
         );
       }
 
-      const response = await fetch(LIME_ENDPOINT, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({ openapi_spec: openapiSpec }),
-      });
+      // Инкрементальная пересборка: если есть предыдущий результат, сервер перегенерирует только изменившиеся операции
+      const response = await postJson(LIME_ENDPOINT, {
+        openapi_spec: openapiSpec,
+        mode: limeMode,
+        previous_code: previousCode,
+        previous_spec: previousSpec,
+        previous_fingerprints: previousFingerprints,
+        model_hint,
+      }, forwardHeaders, request.signal);
 
       if (!response.ok) {
         const errorText = await response.text();
@@ -66,7 +117,7 @@ export async function POST(request: NextRequest) {
       const data = await response.json();
       const responseText = data.code || data.text || data.response || "";
 
-      return NextResponse.json({ text: responseText });
+      return NextResponse.json({ text: responseText, fingerprints: data.fingerprints, diff: data.diff, coverage: data.coverage, files: data.files });
     }
 
     // Режим Blue - оптимизация тест-кейсов
@@ -80,13 +131,7 @@ export async function POST(request: NextRequest) {
         );
       }
 
-      const response = await fetch(BLUE_ENDPOINT, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({ text }),
-      });
+      const response = await postJson(BLUE_ENDPOINT, { text, model_hint }, forwardHeaders, request.signal);
 
       if (!response.ok) {
         const errorText = await response.text();
@@ -96,7 +141,8 @@ export async function POST(request: NextRequest) {
       const data = await response.json();
       const responseText = data.code || data.text || data.response || "";
 
-      return NextResponse.json({ text: responseText });
+      // input_id/result_id позволяют следующему запросу отправить diff вместо полного кода
+      return NextResponse.json({ text: responseText, inputId: data.input_id, resultId: data.result_id });
     }
 
     // Режим Purple - проверка тест-кейсов на стандарты
@@ -110,13 +156,7 @@ export async function POST(request: NextRequest) {
         );
       }
 
-      const response = await fetch(PURPLE_ENDPOINT, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({ text }),
-      });
+      const response = await postJson(PURPLE_ENDPOINT, { text, model_hint }, forwardHeaders, request.signal);
 
       if (!response.ok) {
         const errorText = await response.text();
@@ -126,7 +166,8 @@ export async function POST(request: NextRequest) {
       const data = await response.json();
       const responseText = data.code || data.text || data.response || "";
 
-      return NextResponse.json({ text: responseText });
+      // input_id/result_id позволяют следующему запросу отправить diff вместо полного кода
+      return NextResponse.json({ text: responseText, inputId: data.input_id, resultId: data.result_id });
     }
 
     // Режим Green и другие - генерация из текста
@@ -138,13 +179,7 @@ export async function POST(request: NextRequest) {
     }
 
     // Используем новый эндпоинт для генерации Allure тестов
-    const response = await fetch(ALLURE_GENERATOR_ENDPOINT, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify({ text }),
-    });
+    const response = await postJson(ALLURE_GENERATOR_ENDPOINT, { text, model_hint }, forwardHeaders, request.signal);
 
     if (!response.ok) {
       const errorText = await response.text();
@@ -156,8 +191,12 @@ export async function POST(request: NextRequest) {
     // Новый эндпоинт возвращает { code: string }
     const responseText = data.code || data.text || data.response || "";
 
-    return NextResponse.json({ text: responseText });
+    return NextResponse.json({ text: responseText, cache: data.cache });
   } catch (error) {
+    // Браузер отключился: ответ читать некому, сервер уже отменил генерацию
+    if (request.signal.aborted) {
+      return new NextResponse(null, { status: 499 });
+    }
     console.error("Ошибка при отправке запроса:", error);
     
     // В случае ошибки возвращаем сообщение об ошибке
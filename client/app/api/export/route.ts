@@ -0,0 +1,49 @@
+import { NextRequest, NextResponse } from "next/server";
+import { promisify } from "util";
+import { gzip } from "zlib";
+
+const gzipAsync = promisify(gzip);
+
+export const maxDuration = 300;
+export const runtime = 'nodejs';
+
+// Экспорт модуля тестов в zip-архив (по одному модулю на feature/tag) на сервере генерации
+const EXPORT_ENDPOINT = process.env.API_ENDPOINT_EXPORT || "http://localhost:8000/export";
+const COMPRESSION_MIN_SIZE = Number(process.env.COMPRESSION_MIN_SIZE || 1024);
+
+export async function POST(request: NextRequest) {
+  try {
+    const { text, groupBy } = await request.json();
+    if (!text || typeof text !== "string") {
+      return NextResponse.json({ error: "Код тестов обязателен для экспорта" }, { status: 400 });
+    }
+
+    const json = JSON.stringify({ text, group_by: groupBy || "feature" });
+    const headers: Record<string, string> = { "Content-Type": "application/json" };
+    let body: BodyInit = json;
+    if (Buffer.byteLength(json) >= COMPRESSION_MIN_SIZE) {
+      body = new Uint8Array(await gzipAsync(json));
+      headers["Content-Encoding"] = "gzip";
+    }
+
+    const response = await fetch(EXPORT_ENDPOINT, { method: "POST", headers, body, signal: request.signal });
+    if (!response.ok || !response.body) {
+      const errorText = await response.text();
+      return NextResponse.json({ error: `API вернул ошибку: ${response.status} - ${errorText}` }, { status: response.status });
+    }
+
+    // Архив передается браузеру потоком, не собираясь в памяти прокси
+    return new NextResponse(response.body, {
+      headers: {
+        "Content-Type": "application/zip",
+        "Content-Disposition": response.headers.get("content-disposition") || 'attachment; filename="tests.zip"',
+      },
+    });
+  } catch (error) {
+    console.error("Ошибка экспорта:", error);
+    return NextResponse.json(
+      { error: error instanceof Error ? error.message : "Неизвестная ошибка" },
+      { status: 500 }
+    );
+  }
+}
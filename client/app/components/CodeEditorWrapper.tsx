@@ -86,6 +86,9 @@ const detectLanguage = (text: string): string => {
   return "plaintext";
 };
 
+// Начиная с этого числа строк Python-код предлагается скачать архивом: по модулю на feature
+const EXPORT_MIN_LINES = 1000;
+
 type CodeEditorWrapperProps = {
   value: string;
   height?: string | number;
@@ -100,6 +103,7 @@ export const CodeEditorWrapper = ({
   const [language, setLanguage] = useState<string>("plaintext");
   const [isMounted, setIsMounted] = useState(false);
   const [copied, setCopied] = useState(false);
+  const [isExporting, setIsExporting] = useState(false);
 
   useEffect(() => {
     setIsMounted(true);
@@ -174,6 +178,30 @@ export const CodeEditorWrapper = ({
     }
   };
 
+  const handleExport = async () => {
+    setIsExporting(true);
+    try {
+      const response = await fetch("/api/export", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ text: value, groupBy: "feature" }),
+      });
+      if (!response.ok) {
+        throw new Error(`Ошибка API: ${response.status}`);
+      }
+      const url = URL.createObjectURL(await response.blob());
+      const link = document.createElement("a");
+      link.href = url;
+      link.download = "tests.zip";
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error("Ошибка экспорта:", error);
+    } finally {
+      setIsExporting(false);
+    }
+  };
+
   // Вычисляем минимальную высоту на основе количества строк
   // Увеличена максимальная высота с 600 до 1000px для больших результатов
   const lineCount = value ? value.split("\n").length : 1;
@@ -202,6 +230,30 @@ export const CodeEditorWrapper = ({
         hasHeader={false}
         onCopyClick={handleCopy}
       />
+      {/* Экспорт большого набора тестов архивом */}
+      {value && language === "python" && lineCount >= EXPORT_MIN_LINES && (
+        <button
+          onClick={handleExport}
+          disabled={isExporting}
+          style={{
+            position: "absolute",
+            top: 8,
+            right: 130,
+            padding: "6px 12px",
+            background: "rgba(0, 0, 0, 0.6)",
+            color: "#fff",
+            border: "none",
+            borderRadius: 6,
+            fontSize: 12,
+            fontWeight: 500,
+            cursor: isExporting ? "wait" : "pointer",
+            zIndex: 10,
+            backdropFilter: "blur(4px)",
+          }}
+        >
+          {isExporting ? "Экспорт..." : "Скачать .zip"}
+        </button>
+      )}
       {/* Кнопка копирования */}
       {value && (
         <button
@@ -1,6 +1,7 @@
-import { useState, useEffect, useCallback } from "react";
+import { useState, useEffect, useCallback, useRef } from "react";
 import { Chat, Message, ColorMode } from "../types/chat";
 import { saveChats, loadChats, saveMessages, loadMessages } from "../utils/storage";
+import { SESSION_WS_URL, SessionNotFoundError, SessionSocket } from "../utils/sessionSocket";
 
 export const useChat = (colorMode: ColorMode) => {
   const [chats, setChats] = useState<Chat[]>([]);
@@ -8,6 +9,13 @@ export const useChat = (colorMode: ColorMode) => {
   const [inputValue, setInputValue] = useState("");
   const [messages, setMessages] = useState<Message[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  // Серверные сессии чатов: уточнения в том же чате отправляют только новый текст
+  const sessionSocketRef = useRef<SessionSocket | null>(null);
+  const chatSessionsRef = useRef<Map<number, string>>(new Map());
+
+  useEffect(() => {
+    return () => sessionSocketRef.current?.close();
+  }, []);
 
   // Загрузка чатов при монтировании или смене режима
   useEffect(() => {
@@ -106,7 +114,34 @@ export const useChat = (colorMode: ColorMode) => {
       saveMessages(colorMode, currentChatId, updatedMessages);
     }
 
-    try {
+    // Потоковый ответ сессии показывается по мере поступления
+    const showPartial = (partial: string) => {
+      const partialMessages = [...updatedMessages];
+      partialMessages[partialMessages.length - 1] = { ...newMessage, response: partial };
+      setMessages(partialMessages);
+    };
+
+    const requestOverSession = async (chatId: number): Promise<string> => {
+      if (!sessionSocketRef.current) {
+        sessionSocketRef.current = new SessionSocket();
+      }
+      const socket = sessionSocketRef.current;
+      const sessionId = chatSessionsRef.current.get(chatId);
+      if (sessionId) {
+        try {
+          return await socket.followUp(sessionId, userMessage, showPartial);
+        } catch (error) {
+          // Сессия истекла на сервере — начинаем новую с текущего сообщения
+          if (!(error instanceof SessionNotFoundError)) throw error;
+          chatSessionsRef.current.delete(chatId);
+        }
+      }
+      const started = await socket.start(colorMode, userMessage, showPartial);
+      chatSessionsRef.current.set(chatId, started.sessionId);
+      return started.text;
+    };
+
+    const requestOverHttp = async (): Promise<string> => {
       // Отправка запроса на API
       const requestBody: any = {
         colorMode: colorMode,
@@ -132,7 +167,13 @@ export const useChat = (colorMode: ColorMode) => {
       }
 
       const data = await response.json();
-      const responseText = data.text || "";
+      return data.text || "";
+    };
+
+    try {
+      const responseText = SESSION_WS_URL && currentChatId !== null
+        ? await requestOverSession(currentChatId)
+        : await requestOverHttp();
 
       // Обновляем сообщение с ответом
       const finalMessages = [...updatedMessages];
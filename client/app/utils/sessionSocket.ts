@@ -0,0 +1,97 @@
+import { ColorMode } from "../types/chat";
+
+// Адрес WebSocket сессий сервера (например, ws://localhost:8000/ws/session); без него чат работает через /api/chat
+export const SESSION_WS_URL = process.env.NEXT_PUBLIC_SESSION_WS_URL || "";
+
+type SessionEvent = {
+  type: "session" | "delta" | "done" | "error";
+  session_id?: string;
+  text?: string;
+  code?: string;
+  detail?: string;
+};
+
+export class SessionNotFoundError extends Error {}
+
+/**
+ * Одно соединение с /ws/session. Сервер хранит исходные данные и последний результат сессии,
+ * поэтому уточнения отправляются без повторной загрузки требований и предыдущего ответа.
+ */
+export class SessionSocket {
+  private socket: WebSocket | null = null;
+  private currentSession: string | null = null;
+  private queue: Promise<unknown> = Promise.resolve();
+
+  private connect(): Promise<WebSocket> {
+    if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+      return Promise.resolve(this.socket);
+    }
+    return new Promise((resolve, reject) => {
+      const socket = new WebSocket(SESSION_WS_URL);
+      socket.onopen = () => {
+        this.socket = socket;
+        // Новое соединение не привязано к сессии: перед уточнением ее нужно продолжить (resume)
+        this.currentSession = null;
+        resolve(socket);
+      };
+      socket.onerror = () => reject(new Error("Не удалось подключиться к серверу сессий"));
+      socket.onclose = () => {
+        if (this.socket === socket) this.socket = null;
+      };
+    });
+  }
+
+  private exchange(payload: object, onDelta?: (text: string) => void): Promise<SessionEvent> {
+    // Ходы выполняются по очереди: сервер обрабатывает сообщения одного соединения последовательно
+    const run = async () => {
+      const socket = await this.connect();
+      return new Promise<SessionEvent>((resolve, reject) => {
+        let streamed = "";
+        socket.onmessage = (event) => {
+          const data: SessionEvent = JSON.parse(event.data);
+          if (data.type === "session") {
+            this.currentSession = data.session_id || null;
+            if ((payload as { type: string }).type === "resume") resolve(data);
+          } else if (data.type === "delta") {
+            streamed += data.text || "";
+            onDelta?.(streamed);
+          } else if (data.type === "done") {
+            resolve({ ...data, code: data.code ?? streamed });
+          } else if (data.type === "error") {
+            reject(data.detail?.includes("Сессия не найдена")
+              ? new SessionNotFoundError(data.detail)
+              : new Error(data.detail || "Ошибка сессии"));
+          }
+        };
+        socket.onclose = () => {
+          this.socket = null;
+          reject(new Error("Соединение с сервером сессий закрыто"));
+        };
+        socket.send(JSON.stringify(payload));
+      });
+    };
+    const result = this.queue.then(run, run);
+    this.queue = result.catch(() => undefined);
+    return result;
+  }
+
+  /** Первый ход: данные отправляются целиком, возвращает id сессии и результат */
+  async start(colorMode: ColorMode, text: string, onDelta?: (text: string) => void) {
+    const done = await this.exchange({ type: "start", mode: colorMode.toLowerCase(), text }, onDelta);
+    return { sessionId: done.session_id as string, text: done.code || "" };
+  }
+
+  /** Уточнение: отправляется только новый текст; при смене сессии или переподключении — сначала resume */
+  async followUp(sessionId: string, text: string, onDelta?: (text: string) => void) {
+    if (this.currentSession !== sessionId || !this.socket) {
+      await this.exchange({ type: "resume", session_id: sessionId });
+    }
+    const done = await this.exchange({ type: "message", text }, onDelta);
+    return done.code || "";
+  }
+
+  close() {
+    this.socket?.close();
+    this.socket = null;
+  }
+}
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк компактной формы промптов Blue/Purple: входные токены на тест в исходном коде и в компактной форме.
+
+Запуск из директории server:
+    python benchmarks/compaction_bench.py [--cases 10,100,1000] [--features 3] [--repeat 5]
+
+Для синтетических отчетов Green сравниваются две раскладки модуля: вывод generate_allure_test_code (класс
+на feature/suite) и раскладка LLM-ответов с полной стопкой декораторов на каждом классе. Токены
+оцениваются как в планировщике (chunking.estimate_tokens); время — построение формы вместе с проверкой
+обратимости и восстановление кода из формы. Проверяется, что восстановленный код дает те же тесты.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("OPENAI_API_KEY", "sk-compaction-bench-0000")
+os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Замер самой формы: порог размера модуля, после которого сервер отправляет исходный код, не применяется
+os.environ.setdefault("PROMPT_COMPACTION_MAX_CHARS", str(1 << 30))
+
+from chunking import estimate_tokens  # noqa: E402
+from compaction import compact_module, parse_compact  # noqa: E402
+from main import generate_allure_test_code  # noqa: E402
+from render_bench import build_report, legacy_render  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", default="10,100,1000", help="тест-кейсов в отчете, через запятую")
+    parser.add_argument("--features", type=int, default=3, help="различных feature")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'раскладка':<18}{'кейсов':>7}{'токенов/тест':>14}{'компактно':>11}{'сжатие':>8}"
+          f"{'форма, мс':>11}{'код, мс':>9}  обратимо")
+    for cases in (int(value) for value in args.cases.split(",")):
+        report = build_report(cases, args.features)
+        for name, render in (("класс на feature", generate_allure_test_code), ("класс на кейс", legacy_render)):
+            code = render(report)
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                compact = compact_module(code)
+            compact_ms = (time.perf_counter() - started) / args.repeat * 1000
+            if compact is None:
+                print(f"{name:<18}{cases:>7}  компактная форма не построена")
+                continue
+            text = compact.render()
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                restored = compact.expand(parse_compact(text))
+            expand_ms = (time.perf_counter() - started) / args.repeat * 1000
+            again = compact_module(restored)
+            reversible = again is not None and [c.key() for c in again.classes] == [c.key() for c in compact.classes]
+            raw_tokens, compact_tokens = estimate_tokens(code) / cases, estimate_tokens(text) / cases
+            print(f"{name:<18}{cases:>7}{raw_tokens:>14.1f}{compact_tokens:>11.1f}{raw_tokens / compact_tokens:>7.1f}x"
+                  f"{compact_ms:>11.2f}{expand_ms:>9.2f}  {'да' if reversible else 'НЕТ'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк сжатия: объем и время передачи OpenAPI спецификации ~10 MB.
+
+Запуск из директории server:
+    python benchmarks/compression_bench.py [--size-mb 10]
+
+Для каждой доступной кодировки (gzip, а также br/zstd, если установлены brotli/zstandard)
+выводит размер после сжатия, время сжатия и распаковки и оценку полной задержки
+(сжатие + передача + распаковка) для нескольких пропускных способностей канала.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from starlette.applications import Starlette  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import Response  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+from compression import CompressionMiddleware, available_encodings, compress_bytes, decompress_body  # noqa: E402
+
+# Пропускная способность каналов для оценки задержки, Мбит/с
+BANDWIDTHS_MBIT = (10, 100, 1000)
+
+
+def build_spec(target_size: int) -> bytes:
+    """Строит синтетическую OpenAPI спецификацию заданного размера"""
+    paths = {}
+    schemas = {}
+    i = 0
+    spec = {"openapi": "3.0.0", "info": {"title": "Bench API", "version": "1.0.0"}, "paths": paths,
+            "components": {"schemas": schemas}}
+    size = 0
+    while size < target_size:
+        schemas[f"Item{i}"] = {
+            "type": "object",
+            "required": ["id", "name"],
+            "properties": {
+                "id": {"type": "integer", "format": "int64", "description": f"Идентификатор объекта {i}"},
+                "name": {"type": "string", "maxLength": 255, "description": "Название объекта"},
+                "tags": {"type": "array", "items": {"type": "string"}},
+                "created_at": {"type": "string", "format": "date-time"},
+            },
+        }
+        paths[f"/items{i}/{{itemId}}"] = {
+            "get": {
+                "tags": [f"items{i % 50}"],
+                "operationId": f"getItem{i}",
+                "summary": f"Получить объект {i}",
+                "parameters": [{"name": "itemId", "in": "path", "required": True, "schema": {"type": "integer"}}],
+                "responses": {
+                    "200": {"description": "OK", "content": {"application/json": {"schema": {"$ref": f"#/components/schemas/Item{i}"}}}},
+                    "404": {"description": "Не найдено"},
+                },
+            }
+        }
+        i += 1
+        if i % 200 == 0:
+            size = len(json.dumps(spec, ensure_ascii=False).encode("utf-8"))
+    return json.dumps(spec, ensure_ascii=False).encode("utf-8")
+
+
+def bench_codecs(payload: bytes) -> None:
+    print(f"Исходный размер: {len(payload) / 1024 / 1024:.2f} MB")
+    header = f"{'кодировка':<10}{'размер, MB':>12}{'сжатие':>9}{'сжатие, мс':>12}{'распак., мс':>13}"
+    header += "".join(f"{f'{bw} Мбит/с, мс':>18}" for bw in BANDWIDTHS_MBIT)
+    print(header)
+
+    rows = [("identity", payload, 0.0, 0.0)]
+    for encoding in available_encodings():
+        start = time.perf_counter()
+        compressed = compress_bytes(payload, encoding)
+        compress_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        restored = decompress_body(compressed, encoding)
+        decompress_ms = (time.perf_counter() - start) * 1000
+        assert restored == payload
+        rows.append((encoding, compressed, compress_ms, decompress_ms))
+
+    for encoding, data, compress_ms, decompress_ms in rows:
+        line = f"{encoding:<10}{len(data) / 1024 / 1024:>12.2f}{len(payload) / len(data):>8.1f}x"
+        line += f"{compress_ms:>12.1f}{decompress_ms:>13.1f}"
+        for bw in BANDWIDTHS_MBIT:
+            transfer_ms = len(data) * 8 / (bw * 1_000_000) * 1000
+            line += f"{compress_ms + transfer_ms + decompress_ms:>18.1f}"
+        print(line)
+
+
+async def bench_middleware(payload: bytes) -> None:
+    """Прогоняет ответ того же размера через CompressionMiddleware"""
+
+    async def echo(request: Request) -> Response:
+        return Response(payload, media_type="application/json")
+
+    app = CompressionMiddleware(Starlette(routes=[Route("/spec", echo)]))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print("\nCompressionMiddleware (in-process, без сети):")
+        for accept in ["identity"] + available_encodings():
+            start = time.perf_counter()
+            response = await client.get("/spec", headers={"Accept-Encoding": accept})
+            wire_size = int(response.headers.get("content-length", len(response.content)))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            print(f"  Accept-Encoding: {accept:<9} по сети {wire_size / 1024 / 1024:>7.2f} MB, {elapsed_ms:>8.1f} мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=10.0, help="размер спецификации, MB")
+    args = parser.parse_args()
+
+    payload = build_spec(int(args.size_mb * 1024 * 1024))
+    bench_codecs(payload)
+    asyncio.run(bench_middleware(payload))
+
+
+if __name__ == "__main__":
+    main()
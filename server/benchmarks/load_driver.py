@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Нагрузочный прогон сервера: /generate, /lime, /blue, /purple с заданной конкурентностью.
+
+Запуск из директории server (сервер с OPENAI_BASE_URL на benchmarks/mock_upstream.py):
+    python benchmarks/mock_upstream.py --port 8100 &
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn main:app --port 8000 &
+    python benchmarks/load_driver.py [--url http://127.0.0.1:8000] [--concurrency 32] [--duration 60]
+                                     [--mix generate=4,lime=2,blue=2,purple=2] [--spec-kb 64] [--json result.json]
+
+--concurrency клиентов в цикле отправляют запросы, выбирая эндпоинт по весам --mix. Каждый вход
+уникален (идентификатор прогона в тексте), поэтому кеши сервера не подменяют вызовы модели.
+Выводятся пропускная способность, p50/p95/p99 задержки и коды ответов по эндпоинтам, а также
+задержка цикла событий сервера (из /health/ready раз в секунду) и самого драйвера: если растет
+задержка драйвера, упирается в нагрузку он, а не сервер.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression_bench import build_spec  # noqa: E402
+from health import EventLoopLag  # noqa: E402
+from mock_upstream import CANNED_MODULE, CANNED_TEST  # noqa: E402
+
+REQUIREMENTS = """Owner: load
+Feature: Авторизация
+Story: Вход по паролю
+
+1. Пользователь вводит логин и пароль на странице входа.
+2. При верных данных открывается главная страница.
+3. При неверном пароле показывается сообщение об ошибке.
+4. После пяти неудачных попыток учетная запись блокируется на 15 минут.
+5. Ссылка «Забыли пароль» ведет на форму восстановления.
+"""
+
+
+def percentile(values: List[float], share: float) -> float:
+    return values[min(int(len(values) * share), len(values) - 1)] if values else 0.0
+
+
+class Payloads:
+    """Тела запросов по эндпоинтам; каждое тело уникально"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.spec = json.loads(build_spec(args.spec_kb * 1024))
+        self.module = CANNED_MODULE.format(tests="\n".join(CANNED_TEST.format(index=index) for index in range(1, 26)))
+        self.lime_mode = args.lime_mode
+
+    def build(self, endpoint: str) -> Dict[str, Any]:
+        run_id = uuid.uuid4().hex
+        if endpoint == "generate":
+            return {"text": f"{REQUIREMENTS}\nИдентификатор прогона: {run_id}"}
+        if endpoint == "lime":
+            self.spec["info"]["description"] = run_id
+            return {"openapi_spec": json.dumps(self.spec, ensure_ascii=False), "mode": self.lime_mode}
+        return {"text": f"# run {run_id}\n{self.module}"}
+
+
+async def client_loop(http: httpx.AsyncClient, payloads: Payloads, mix: List[Tuple[str, int]], deadline: float,
+                      results: Dict[str, Dict[str, Any]], rng: random.Random) -> None:
+    endpoints = [endpoint for endpoint, _ in mix]
+    weights = [weight for _, weight in mix]
+    while time.monotonic() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        body = payloads.build(endpoint)
+        started = time.perf_counter()
+        try:
+            response = await http.post(f"/{endpoint}", json=body)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        entry = results.setdefault(endpoint, {"latencies": [], "statuses": {}})
+        entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+        if status == "200":
+            entry["latencies"].append(time.perf_counter() - started)
+
+
+async def poll_server(http: httpx.AsyncClient, deadline: float, samples: List[Dict[str, Any]]) -> None:
+    """Раз в секунду снимает задержку цикла событий и нагрузку сервера из /health/ready (и при 503)"""
+    while time.monotonic() < deadline:
+        try:
+            response = await http.get("/health/ready")
+            samples.append(response.json().get("load", {}))
+        except (httpx.HTTPError, ValueError):
+            pass
+        await asyncio.sleep(1.0)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    mix = []
+    for part in args.mix.split(","):
+        endpoint, _, weight = part.partition("=")
+        mix.append((endpoint.strip(), int(weight or 1)))
+    payloads = Payloads(args)
+    results: Dict[str, Dict[str, Any]] = {}
+    server_samples: List[Dict[str, Any]] = []
+    driver_lag = EventLoopLag(interval=0.1)
+    driver_lag.start()
+    limits = httpx.Limits(max_connections=args.concurrency + 2, max_keepalive_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as http:
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(
+            poll_server(http, deadline, server_samples),
+            *(client_loop(http, payloads, mix, deadline, results, random.Random(index)) for index in range(args.concurrency)),
+        )
+        elapsed = time.monotonic() - started
+
+    report: Dict[str, Any] = {"concurrency": args.concurrency, "elapsed_s": round(elapsed, 1), "endpoints": {}}
+    for endpoint, entry in sorted(results.items()):
+        latencies = sorted(entry["latencies"])
+        report["endpoints"][endpoint] = {
+            "ok": len(latencies),
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "statuses": entry["statuses"],
+        }
+    lags = [sample["event_loop"]["lag_ms"] for sample in server_samples if "event_loop" in sample]
+    report["server_event_loop"] = {
+        "lag_p50_ms": round(percentile(sorted(lags), 0.50), 1),
+        "lag_max_ms": max((sample["event_loop"]["lag_max_ms"] for sample in server_samples if "event_loop" in sample), default=0.0),
+        "peak_in_flight": max((sample.get("peak", 0) for sample in server_samples), default=0),
+        "max_queued": max((sample.get("queued", 0) for sample in server_samples), default=0),
+    }
+    report["driver_event_loop"] = driver_lag.snapshot()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=60.0, help="длительность прогона, секунд")
+    parser.add_argument("--mix", default="generate=4,lime=2,blue=2,purple=2", help="веса эндпоинтов")
+    parser.add_argument("--spec-kb", type=int, default=64, help="размер OpenAPI спецификации для /lime, KB")
+    parser.add_argument("--lime-mode", default="llm", choices=("llm", "template", "hybrid", "auto"))
+    parser.add_argument("--timeout", type=float, default=600.0, help="таймаут одного запроса, секунд")
+    parser.add_argument("--json", help="записать отчет в файл JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"{'эндпоинт':<10}{'ok':>7}{'rps':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}  коды")
+    for endpoint, row in report["endpoints"].items():
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(row["statuses"].items()))
+        print(f"{endpoint:<10}{row['ok']:>7}{row['rps']:>8.2f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}  {statuses}")
+    server, driver = report["server_event_loop"], report["driver_event_loop"]
+    print(f"цикл событий сервера: p50 {server['lag_p50_ms']} мс, max {server['lag_max_ms']} мс; "
+          f"пик запросов {server['peak_in_flight']}, очередь до {server['max_queued']}")
+    print(f"цикл событий драйвера: p99 {driver['lag_p99_ms']} мс, max {driver['lag_max_ms']} мс")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
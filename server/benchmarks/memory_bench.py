@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Проверка пикового потребления памяти при обработке большого входа (регрессионный замер).
+
+Запуск из директории server:
+    python benchmarks/memory_bench.py [--size-mb 20] [--max-multiple N]
+Тот же замер в составе тестов: python -m pytest -m slow tests/test_memory.py (см. tests/test_memory.py).
+
+Для /lime (OpenAPI спецификация) и /blue, /purple, /export (код тестов) в отдельном процессе
+отправляет вход заданного размера через ASGI-приложение с подмененным вызовом модели
+и сравнивает прирост пикового RSS (VmHWM) с размером входа. Завершается с кодом 1,
+если прирост больше допустимой кратности (MAX_MULTIPLE или --max-multiple).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression_bench import build_spec  # noqa: E402
+
+ENDPOINTS = ("lime", "blue", "purple", "export")
+
+# Допустимый прирост пикового RSS в размерах входа. Для /lime основную часть занимает сам
+# распарсенный dict спецификации (~6x текста), плюс компактный JSON для промпта и сам промпт
+MAX_MULTIPLE = {"lime": 16.0, "blue": 8.0, "purple": 6.0, "export": 8.0}
+
+# Небольшой валидный модуль, который возвращает подмененная модель
+FAKE_MODULE = '''import allure
+from pytest import mark
+
+
+class TestGenerated:
+    def test_ok(self):
+        assert True
+'''
+
+
+def _status_kb(field: str) -> int:
+    with open("/proc/self/status", encoding="ascii") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} недоступен (нужен Linux)")
+
+
+def _reset_peak() -> bool:
+    """Сбрасывает VmHWM процесса (Linux 4.0+); False, если сброс не поддерживается"""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def build_test_code(target_size: int) -> bytes:
+    """Строит модуль тестов Allure заданного размера"""
+    parts = ["import allure\nfrom pytest import mark\nfrom allure_commons._allure import step as allure_step\n"]
+    size = len(parts[0])
+    i = 0
+    while size < target_size:
+        block = (
+            f'\n\n@allure.feature("Функциональность {i % 100}")\nclass TestCase{i}:\n'
+            f'    @allure.title("Проверка сценария {i}")\n    def test_case_{i}(self):\n'
+            f'        with allure_step("Arrange: подготовить данные для сценария {i}"):\n            pass\n'
+            f'        with allure_step("Act: выполнить действие"):\n            pass\n'
+            f'        with allure_step("Assert: проверить результат"):\n            pass\n'
+        )
+        parts.append(block)
+        size += len(block.encode("utf-8"))
+        i += 1
+    return "".join(parts).encode("utf-8")
+
+
+async def _run_child(endpoint: str, input_path: str) -> dict:
+    os.environ.setdefault("OPENAI_API_KEY", "sk-memory-bench-0000")
+    os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+    import httpx
+    import main
+
+    async def fake_create(**kwargs):
+        message = types.SimpleNamespace(content=FAKE_MODULE)
+        choice = types.SimpleNamespace(message=message, finish_reason="stop")
+        return types.SimpleNamespace(choices=[choice], usage=None)
+
+    main.client.chat.completions.create = fake_create
+
+    with open(input_path, "rb") as input_file:
+        raw = input_file.read()
+    input_size = len(raw)
+    field = "openapi_spec" if endpoint == "lime" else "text"
+    body = json.dumps({field: raw.decode("utf-8")}, ensure_ascii=False).encode("utf-8")
+    del raw
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Прогрев: импорт ленивых модулей и первые аллокации не относятся к входу
+        await client.get("/health")
+        baseline_kb = _status_kb("VmRSS")
+        peak_reset = _reset_peak()
+        start = time.perf_counter()
+        response = await client.post(f"/{endpoint}", content=body, headers={"Content-Type": "application/json"})
+        elapsed = time.perf_counter() - start
+    peak_kb = _status_kb("VmHWM")
+    return {
+        "endpoint": endpoint,
+        "status": response.status_code,
+        "input_size": input_size,
+        "peak_delta": max(0, peak_kb - baseline_kb) * 1024,
+        "peak_reset": peak_reset,
+        "seconds": round(elapsed, 2),
+    }
+
+
+def write_inputs(directory: str, size_mb: float) -> dict:
+    """Записывает входы заданного размера в directory: {"spec": путь к спецификации, "code": путь к модулю тестов}"""
+    target = int(size_mb * 1024 * 1024)
+    paths = {}
+    for name, build in (("spec", build_spec), ("code", build_test_code)):
+        paths[name] = os.path.join(directory, name)
+        with open(paths[name], "wb") as input_file:
+            input_file.write(build(target))
+    return paths
+
+
+def measure(endpoint: str, paths: dict, directory: str) -> dict:
+    """Замер одного эндпоинта в отдельном процессе; к результату дочернего процесса добавляется multiple"""
+    input_path = paths["spec" if endpoint == "lime" else "code"]
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", endpoint, input_path],
+        check=True, capture_output=True, text=True,
+        env={**os.environ, "LOG_LEVEL": "WARNING", "USAGE_DB": os.path.join(directory, "usage.db")},
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["multiple"] = result["peak_delta"] / result["input_size"]
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=20.0, help="размер входа, MB")
+    parser.add_argument("--max-multiple", type=float, default=None,
+                        help="допустимый прирост пикового RSS в размерах входа (по умолчанию свой для каждого эндпоинта)")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, action="append", help="проверяемые эндпоинты")
+    parser.add_argument("--child", nargs=2, metavar=("ENDPOINT", "INPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_run_child(*args.child))))
+        return
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_inputs(tmp, args.size_mb)
+        print(f"{'эндпоинт':<10}{'вход, MB':>10}{'пик RSS, MB':>13}{'кратность':>11}{'время, с':>10}")
+        for endpoint in args.endpoint or ENDPOINTS:
+            result = measure(endpoint, paths, tmp)
+            limit = args.max_multiple or MAX_MULTIPLE[endpoint]
+            verdict = "ok" if result["multiple"] <= limit and result["status"] == 200 else f"FAIL (> {limit}x)"
+            failed = failed or verdict != "ok"
+            print(f"{endpoint:<10}{result['input_size'] / 1048576:>10.1f}{result['peak_delta'] / 1048576:>13.1f}"
+                  f"{result['multiple']:>10.1f}x{result['seconds']:>10}  {verdict}"
+                  + ("" if result["peak_reset"] else "  (VmHWM не сбрасывается — пик завышен)"))
+    if failed:
+        print("Пиковое потребление памяти превышает допустимую кратность размера входа")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
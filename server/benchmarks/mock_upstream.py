@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Локальный OpenAI-совместимый upstream для нагрузочных прогонов без оплаты инференса.
+
+Запуск из директории server:
+    python benchmarks/mock_upstream.py [--port 8100] [--latency lognormal:800,0.4] [--tokens-per-second 60]
+                                       [--error-rate 0.01] [--rate-limit-rate 0.02]
+
+Сервер для нагрузки запускается с OPENAI_BASE_URL=http://127.0.0.1:8100/v1.
+
+POST /v1/chat/completions отвечает заготовленным результатом по режиму, определенному по системному
+промпту: модуль Allure для Green/Lime, JSON проверок для гибридного режима, входной код для Blue и
+исправления фрагмента (компактную форму — как есть), отчет для Purple. Время ответа — задержка до первого токена из распределения
+--latency плюс генерация ответа со скоростью --tokens-per-second; при stream=true фрагменты отдаются
+по мере «генерации». Доля ответов 500 и 429 (с Retry-After) задается --error-rate и --rate-limit-rate.
+GET /v1/models отвечает списком из одной модели (проба готовности сервера).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Символов ответа на токен (как в оценках планировщика)
+CHARS_PER_TOKEN = 3
+# Сколько токенов в одном фрагменте потокового ответа
+STREAM_CHUNK_TOKENS = 8
+
+CANNED_MODULE = '''import allure
+from pytest import mark
+from allure_commons._allure import step as allure_step
+
+
+@allure.manual
+@allure.label("owner", "load")
+@allure.feature("Нагрузочный прогон")
+@allure.story("Заготовленный ответ")
+@allure.suite("mock")
+@mark.manual
+class TestMockUpstream:
+{tests}
+'''
+
+CANNED_TEST = '''    @allure.title("Проверка {index}")
+    @allure.tag("NORMAL")
+    @allure.label("priority", "normal")
+    def test_case_{index}(self):
+        with allure_step("Arrange: подготовить данные"):
+            pass
+        with allure_step("Act: выполнить действие"):
+            pass
+        with allure_step("Assert: результат соответствует требованиям"):
+            pass
+'''
+
+CANNED_REPORT = '''# Отчет о проверке тест-кейсов
+
+## Итог
+Проверено тест-кейсов: {tests}. Критичных нарушений не найдено.
+
+## Рекомендации
+1. Уточнить ожидаемый результат в шагах Assert.
+2. Добавить @allure.link на требования.
+'''
+
+_OPERATION_RE = re.compile(r'"operation"\s*:\s*"([^"]+)"')
+# Компактная форма тестов в промптах Blue/Purple (compaction.py)
+_COMPACT_RE = re.compile(r"```text\n(.*?)```", re.DOTALL)
+_TEST_LINE_RE = re.compile(r"^\s*(?:def )?test_", re.MULTILINE)
+
+
+def latency_sampler(spec: str) -> Callable[[random.Random], float]:
+    """Распределение задержки до первого токена, секунд: fixed:<мс>, uniform:<мин>,<макс>, lognormal:<медиана>,<sigma>"""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1]) / 1000
+    raise argparse.ArgumentTypeError(f"неизвестное распределение задержки: {spec}")
+
+
+def canned_answer(messages: List[Dict[str, Any]], tests: int) -> str:
+    """Заготовленный ответ в формате, которого ждет режим, определенный по системному промпту"""
+    system = next((message.get("content") or "" for message in messages if message.get("role") == "system"), "")
+    user = next((message.get("content") or "" for message in reversed(messages) if message.get("role") == "user"), "")
+    if "Верни ТОЛЬКО JSON-объект" in system:
+        # Гибридный режим: проверки для каждой операции из пакета
+        return json.dumps({operation: ["assert response.status_code == 200, 'Неверный код ответа'"]
+                           for operation in _OPERATION_RE.findall(user)}, ensure_ascii=False)
+    if "оптимизировать существующие" in system or "синтаксической ошибкой" in system:
+        compact = _COMPACT_RE.search(user)
+        if compact:
+            return compact.group(1)
+        return user.split("\n\n", 1)[1] if user.startswith("Ошибка:") else user
+    if "проверить существующие" in system:
+        return CANNED_REPORT.format(tests=len(_TEST_LINE_RE.findall(user)))
+    return CANNED_MODULE.format(tests="\n".join(CANNED_TEST.format(index=index) for index in range(1, tests + 1)))
+
+
+def build_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(args.seed)
+    sample_latency = latency_sampler(args.latency)
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    def completion_body(model: str, content: str, prompt_chars: int) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_chars // CHARS_PER_TOKEN + 1,
+                "completion_tokens": len(content) // CHARS_PER_TOKEN + 1,
+                "total_tokens": (prompt_chars + len(content)) // CHARS_PER_TOKEN + 2,
+            },
+        }
+
+    async def stream_chunks(model: str, content: str, prompt_chars: int) -> AsyncIterator[bytes]:
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        step = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+        try:
+            for start in range(0, len(content), step):
+                await asyncio.sleep(STREAM_CHUNK_TOKENS / args.tokens_per_second)
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                         "choices": [{"index": 0, "delta": {"content": content[start:start + step]}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+            last = completion_body(model, "", prompt_chars)
+            last.update(object="chat.completion.chunk",
+                        choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            last["usage"]["completion_tokens"] = len(content) // CHARS_PER_TOKEN + 1
+            yield f"data: {json.dumps(last)}\n\n".encode("utf-8")
+            yield b"data: [DONE]\n\n"
+        finally:
+            stats["in_flight"] -= 1
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": args.model, "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def mock_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        roll = rng.random()
+        if roll < args.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(status_code=429, headers={"Retry-After": str(args.retry_after)},
+                                content={"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": "rate_limit"}})
+        if roll < args.rate_limit_rate + args.error_rate:
+            stats["errors"] += 1
+            await asyncio.sleep(sample_latency(rng))
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected upstream error", "type": "server_error"}})
+
+        messages = body.get("messages") or []
+        prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        content = canned_answer(messages, args.tests)
+        # Ответ не длиннее max_tokens запроса, как у настоящей модели
+        max_chars = int(body.get("max_tokens") or 1_000_000) * CHARS_PER_TOKEN
+        content = content[:max_chars]
+        model = body.get("model") or args.model
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        await asyncio.sleep(sample_latency(rng))
+        if body.get("stream"):
+            return StreamingResponse(stream_chunks(model, content, prompt_chars), media_type="text/event-stream")
+        try:
+            await asyncio.sleep(len(content) / CHARS_PER_TOKEN / args.tokens_per_second)
+        finally:
+            stats["in_flight"] -= 1
+        return completion_body(model, content, prompt_chars)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="lognormal:800,0.4",
+                        help="задержка до первого токена, мс: fixed:<мс>, uniform:<мин>,<макс>, lognormal:<медиана>,<sigma>")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0, help="скорость генерации ответа")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After ответов 429, секунд")
+    parser.add_argument("--tests", type=int, default=25, help="тестов в заготовленном модуле")
+    parser.add_argument("--model", default=os.getenv("LLM_MODEL", "mock-model"))
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    latency_sampler(args.latency)
+
+    import uvicorn
+    uvicorn.run(build_app(args), host=args.host, port=args.port, log_level="warning", timeout_keep_alive=75)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк рендера отчета Green в код: прежняя раскладка (класс на каждый тест-кейс) против
+одного класса на feature/suite в generate_allure_test_code.
+
+Запуск из директории server:
+    python benchmarks/render_bench.py [--cases 35] [--features 3] [--repeat 20]
+
+Для синтетического отчета сравниваются размер кода, число классов, число тестов, которые видит сбор
+pytest (одноименные классы модуля перекрывают друг друга, одноименные методы класса — тоже), и время
+сбора: компиляция модуля, его выполнение с заглушкой allure и обход классов в поисках test_*.
+"""
+import argparse
+import os
+import sys
+import time
+import types
+from typing import Callable, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-render-bench-0000")
+os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from main import escape_string, generate_allure_test_code  # noqa: E402
+from schemas.AllureTestOps import AllureTestOpsReport  # noqa: E402
+
+
+def legacy_render(report: AllureTestOpsReport) -> str:
+    """Прежняя раскладка: отдельный класс с полным набором декораторов на каждый тест-кейс"""
+    lines = ["import allure", "import pytest", "from pytest import mark", "from contextlib import contextmanager", "", "",
+             "@contextmanager", "def allure_step(step_name: str):", "    with allure.step(step_name):", "        yield", "", ""]
+    for test_case in report.testCases:
+        test = test_case.test
+        class_name = f"{(test.test_type or test.feature).replace(' ', '').replace('-', '')}Tests"
+        lines += ["@allure.manual", "", f'@allure.label("owner", "{escape_string(test.owner)}")',
+                  f'@allure.feature("{escape_string(test.feature)}")', f'@allure.story("{escape_string(test.story)}")',
+                  f'@allure.suite("{escape_string(test.test_type)}")', "@mark.manual", f"class {class_name}:", ""]
+        name = "test_" + (test.title or "function").lower().replace(" ", "_").replace("-", "_")
+        name = "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+        if test.title:
+            lines.append(f'    @allure.title("{escape_string(test.title)}")')
+        lines.append(f'    @allure.tag("{escape_string(test.tags[0])}")')
+        lines.append(f'    @allure.label("priority", "{escape_string(test.priority.value)}")')
+        lines.append(f"    def {name}(self) -> None:")
+        for step in test_case.steps:
+            lines += [f'        with allure_step("{escape_string(step.step_name)}"):', "            pass"]
+        lines += ["", ""]
+    return "\n".join(lines)
+
+
+def build_report(cases: int, features: int) -> AllureTestOpsReport:
+    test_cases = []
+    for i in range(cases):
+        feature = f"Функция {i % features}"
+        test_cases.append({
+            "test": {
+                "owner": "qa", "feature": feature, "story": f"История {i % features}", "test_type": "UI",
+                # Часть заголовков повторяется, как в реальных отчетах модели
+                "title": f"Проверка сценария {i % (cases * 3 // 4 or 1)}",
+                "priority": "NORMAL", "tags": ["NORMAL"],
+            },
+            "steps": [{"step_name": f"{stage}: шаг {i}", "step_action": ""} for stage in ("Arrange", "Act", "Assert")],
+        })
+    return AllureTestOpsReport.model_validate({"testCases": test_cases})
+
+
+def _allure_stub() -> types.ModuleType:
+    """Заглушка allure для выполнения модуля: декораторы возвращают объект без изменений"""
+    allure = types.ModuleType("allure")
+    decorator = lambda *args, **kwargs: (lambda target: target)  # noqa: E731
+    for name in ("label", "feature", "story", "suite", "title", "tag", "link"):
+        setattr(allure, name, decorator)
+    allure.manual = lambda target: target
+    return allure
+
+
+def collect(code: str) -> int:
+    """Тесты, которые увидит сбор: test_* методы классов, оставшихся в пространстве имен модуля"""
+    namespace: Dict[str, object] = {}
+    sys.modules.setdefault("allure", _allure_stub())
+    exec(compile(code, "<generated>", "exec"), namespace)
+    return sum(1 for value in namespace.values() if isinstance(value, type)
+               for name in vars(value) if name.startswith("test_"))
+
+
+def measure(render: Callable[[AllureTestOpsReport], str], report: AllureTestOpsReport, repeat: int) -> Dict[str, float]:
+    code = render(report)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        collected = collect(code)
+    return {
+        "chars": len(code),
+        "classes": code.count("\nclass "),
+        "collected": collected,
+        "collect_ms": (time.perf_counter() - started) / repeat * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", type=int, default=35, help="тест-кейсов в отчете")
+    parser.add_argument("--features", type=int, default=3, help="различных feature")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    report = build_report(args.cases, args.features)
+    print(f"{'раскладка':<22}{'символов':>10}{'классов':>9}{'собрано':>9}{'сбор, мс':>10}  (кейсов: {args.cases})")
+    for name, render in (("класс на кейс", legacy_render), ("класс на feature", generate_allure_test_code)):
+        result = measure(render, report, args.repeat)
+        print(f"{name:<22}{result['chars']:>10}{result['classes']:>9}{result['collected']:>9}{result['collect_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
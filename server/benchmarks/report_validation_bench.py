@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарк разбора JSON-отчета модели в AllureTestOpsReport (режим Green).
+
+Запуск из директории server:
+    python benchmarks/report_validation_bench.py [--cases 10000] [--repeat 5]
+
+Сравнивает прежний путь (json.loads → проверка ключей → AllureTestOpsReport(**dict) с
+Python-валидатором tags), однопроходную валидацию кешированным TypeAdapter (validate_json из строки,
+min_length вместо валидатора) и parse_report_json (то же с паузой gc): время и пик выделенной памяти
+(tracemalloc).
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import field_validator  # noqa: E402
+
+from schemas.AllureTestOps import REPORT_ADAPTER, AllureTest, AllureTestOpsReport, TestCase, parse_report_json  # noqa: E402
+
+
+class LegacyAllureTest(AllureTest):
+    # Прежняя проверка tags Python-валидатором
+    @field_validator("tags")
+    def validate_tags(cls, v):
+        if len(v) < 1:
+            raise ValueError("tags must contain at least one item")
+        return v
+
+
+class LegacyTestCase(TestCase):
+    test: LegacyAllureTest
+
+
+class LegacyReport(AllureTestOpsReport):
+    testCases: List[LegacyTestCase]
+
+
+def build_report(cases: int) -> str:
+    """JSON-отчет, как его возвращает модель: cases тест-кейсов по три шага AAA"""
+    return json.dumps({"testCases": [
+        {
+            "test": {
+                "owner": "qa-team",
+                "feature": f"Функциональность {i % 50}",
+                "story": f"История {i % 200}",
+                "test_type": "manual",
+                "manual_mark": True,
+                "title": f"Проверка сценария {i}: пользователь выполняет действие и получает результат",
+                "priority": ("CRITICAL", "NORMAL", "LOW")[i % 3],
+                "tags": ["smoke", f"tag{i % 10}"],
+                "labels": {"suite": "Регрессия"},
+            },
+            "steps": [
+                {"step_name": "Arrange", "step_action": f"Подготовить данные для сценария {i}", "attachments": []},
+                {"step_name": "Act", "step_action": "Выполнить действие в интерфейсе", "attachments": []},
+                {"step_name": "Assert", "step_action": "Проверить, что результат соответствует ожиданиям"},
+            ],
+        }
+        for i in range(cases)
+    ]}, ensure_ascii=False)
+
+
+def legacy_parse(raw: str):
+    response_json = json.loads(raw)
+    if isinstance(response_json, dict) and "error" in response_json:
+        raise ValueError(response_json["error"])
+    if isinstance(response_json, dict) and "testCases" in response_json:
+        return LegacyReport(**response_json)
+    raise ValueError("нет testCases")
+
+
+def measure(parse: Callable[[str], object], raw: str, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parse(raw)
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    result = parse(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(timings), peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", type=int, default=10000, help="число тест-кейсов в отчете")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов для замера времени")
+    args = parser.parse_args()
+
+    raw = build_report(args.cases)
+    assert legacy_parse(raw).model_dump() == parse_report_json(raw).model_dump()
+
+    print(f"Отчет: {args.cases} тест-кейсов, {len(raw.encode('utf-8')) / 1048576:.1f} MB JSON")
+    print(f"{'путь':<28}{'время, мс':>12}{'пик памяти, MB':>17}")
+    results = {}
+    paths = (
+        ("json.loads + Model(**dict)", legacy_parse),
+        ("TypeAdapter.validate_json", REPORT_ADAPTER.validate_json),
+        ("parse_report_json", parse_report_json),
+    )
+    for name, parse in paths:
+        results[name] = measure(parse, raw, args.repeat)
+        seconds, peak = results[name]
+        print(f"{name:<28}{seconds * 1000:>12.1f}{peak / 1048576:>17.1f}")
+    old_time, old_peak = results["json.loads + Model(**dict)"]
+    for name, _ in paths[1:]:
+        new_time, new_peak = results[name]
+        print(f"{name}: ускорение {old_time / new_time:.2f}x, пик памяти меньше на {(1 - new_peak / old_peak) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Задержка интерактивных вызовов при смешанной нагрузке: очередь FIFO против FairScheduler.
+
+Запуск из директории server:
+    python benchmarks/scheduler_bench.py [--batch-jobs 40] [--interactive-jobs 60] [--slots 16]
+
+Моделируется upstream, время ответа которого пропорционально оценке токенов вызова.
+Одна сторона ставит в очередь пачку больших вызовов lime (спецификация на много мегабайт,
+разбитая на части), несколько других — поток коротких вызовов purple и green.
+Сравниваются p50/p95 ожидания коротких вызовов и общее время прогона для FIFO, FairScheduler
+без слотов режимов (только SJF со старением) и FairScheduler со слотами lime (3/8 общего лимита).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import FairScheduler, estimate_call_tokens  # noqa: E402
+
+# Секунд ответа upstream на 1000 токенов оценки (в масштабе бенчмарка)
+SECONDS_PER_KTOKEN = 0.01
+
+
+class FifoScheduler:
+    """Прежнее поведение: общий лимит одновременных вызовов, порядок поступления"""
+
+    def __init__(self, slots: int):
+        self._semaphore = asyncio.Semaphore(slots)
+
+    async def acquire(self, mode: str, caller: str, tokens: int):
+        await self._semaphore.acquire()
+
+    def release(self, ticket) -> None:
+        self._semaphore.release()
+
+
+async def call(scheduler, mode: str, caller: str, input_chars: int, waits: Dict[str, List[float]]) -> None:
+    tokens = estimate_call_tokens(input_chars, 8000)
+    queued = time.perf_counter()
+    ticket = await scheduler.acquire(mode, caller, tokens)
+    waits.setdefault(mode, []).append(time.perf_counter() - queued)
+    try:
+        await asyncio.sleep(tokens / 1000 * SECONDS_PER_KTOKEN)
+    finally:
+        scheduler.release(ticket)
+
+
+async def run(scheduler, args) -> Dict[str, object]:
+    rng = random.Random(7)
+    waits: Dict[str, List[float]] = {}
+    started = time.perf_counter()
+    batch = [asyncio.create_task(call(scheduler, "lime", "batch-user", 200_000, waits)) for _ in range(args.batch_jobs)]
+
+    async def interactive():
+        tasks = []
+        for i in range(args.interactive_jobs):
+            mode = "purple" if i % 2 else "green"
+            tasks.append(asyncio.create_task(call(scheduler, mode, f"user-{i % 5}", rng.randint(2_000, 12_000), waits)))
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(interactive(), asyncio.gather(*batch))
+    elapsed = time.perf_counter() - started
+    short = sorted(waits.get("purple", []) + waits.get("green", []))
+    return {
+        "short_p50_ms": short[len(short) // 2] * 1000,
+        "short_p95_ms": short[int(len(short) * 0.95)] * 1000,
+        "short_max_ms": short[-1] * 1000,
+        "total_s": elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-jobs", type=int, default=40, help="больших вызовов lime от одной стороны")
+    parser.add_argument("--interactive-jobs", type=int, default=60, help="коротких вызовов purple/green")
+    parser.add_argument("--slots", type=int, default=16, help="общий лимит одновременных вызовов")
+    args = parser.parse_args()
+
+    print(f"{'очередь':<16}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}{'всего, с':>11}")
+    for name, scheduler in (
+        ("FIFO", FifoScheduler(args.slots)),
+        ("без слотов", FairScheduler(args.slots, {})),
+        ("слоты lime", FairScheduler(args.slots, {"lime": max(args.slots * 3 // 8, 1)})),
+    ):
+        result = asyncio.run(run(scheduler, args))
+        print(f"{name:<16}{result['short_p50_ms']:>10.1f}{result['short_p95_ms']:>10.1f}"
+              f"{result['short_max_ms']:>10.1f}{result['total_s']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
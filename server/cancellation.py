@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Отмена работы, результат которой больше никто не ждет.
+
+DisconnectMiddleware отменяет обработчик запроса, когда клиент закрыл соединение (закрыл вкладку,
+прокси оборвал запрос по таймауту): вместе с ним отменяется и ожидающий вызов модели, httpx закрывает
+соединение с upstream, и генерация там прекращается. SharedCalls объединяет одновременные одинаковые
+вызовы модели в один; такой вызов отменяется, только когда ушли все ожидающие его запросы.
+"""
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from logger import get_logger, kv
+
+log = get_logger("cancellation")
+
+# Статус ответа для запросов, клиент которых отключился (как у nginx); клиенту он не отправляется,
+# но попадает в итоговую запись запроса и спан
+CLIENT_CLOSED_REQUEST = 499
+
+
+class DisconnectMiddleware:
+    """ASGI middleware: после чтения тела запроса следит за http.disconnect и отменяет обработчик.
+
+    Обработчик, который сам ждет http.disconnect (потоковые ответы Starlette), получает его как обычно.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        disconnected = asyncio.Event()
+        response_done = False
+        watcher: Optional[asyncio.Task] = None
+
+        async def watch() -> None:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                if not response_done:
+                    handler_task.cancel()
+
+        async def receive_wrapper():
+            nonlocal watcher
+            if watcher is not None:
+                # Тело уже прочитано: дальше от клиента может прийти только disconnect
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                watcher = asyncio.create_task(watch())
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_done
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_done = True
+            await send(message)
+
+        handler_task = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+        try:
+            await handler_task
+        except asyncio.CancelledError:
+            if not disconnected.is_set():
+                raise  # отменили сам запрос (остановка сервера), а не обработчик
+            log.info("Клиент отключился, обработка запроса отменена", extra=kv(path=scope.get("path")))
+            # Сервер не отправит ответ закрытому соединению; статус нужен внешним middleware для записи запроса
+            try:
+                await send({"type": "http.response.start", "status": CLIENT_CLOSED_REQUEST, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+            except Exception:
+                pass
+        finally:
+            if watcher is not None and not watcher.done():
+                watcher.cancel()
+            if not handler_task.done():
+                handler_task.cancel()
+
+
+def call_key(*parts: Any, messages: Iterable[Dict[str, str]] = ()) -> str:
+    """Ключ вызова модели: параметры и содержимое сообщений (хешируются по частям, без склейки промпта)"""
+    digest = hashlib.sha256(repr(parts).encode("utf-8"))
+    for message in messages:
+        digest.update(b"\x00" + (message.get("role") or "").encode("utf-8") + b"\x00")
+        digest.update((message.get("content") or "").encode("utf-8", errors="replace"))
+    return digest.hexdigest()
+
+
+class _SharedCall:
+    __slots__ = ("task", "subscribers")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.subscribers = 0
+
+
+class SharedCalls:
+    """Один вызов на ключ для одновременных одинаковых запросов; отменяется, когда не осталось ожидающих"""
+
+    def __init__(self):
+        self._calls: Dict[str, _SharedCall] = {}
+        self.joined = 0
+        self.cancelled = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _SharedCall(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(key, call))
+        else:
+            self.joined += 1
+        call.subscribers += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.subscribers == 1:
+                call.task.cancel()
+                self.cancelled += 1
+            raise
+        finally:
+            call.subscribers -= 1
+
+    def _forget(self, key: str, call: _SharedCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "joined": self.joined, "cancelled": self.cancelled}
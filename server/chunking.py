@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Разбиение большого модуля тестов на пакеты для параллельной обработки и обратная сборка"""
+import ast
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Бюджет входных токенов на один пакет (оценка по длине текста)
+CHUNK_TOKEN_BUDGET = int(os.getenv("BLUE_CHUNK_TOKENS", "6000"))
+
+_FEATURE_RE = re.compile(r'@allure\.feature\(\s*["\']([^"\']+)["\']')
+_IMPORT_LINE_RE = re.compile(r"^(import\s|from\s+\S+\s+import\s)")
+# Возможное начало оператора верхнего уровня: строка без отступа, не комментарий
+_STATEMENT_START_RE = re.compile(r"^[^\s#]", re.MULTILINE)
+# Имя класса или функции единицы: первая строка def/class без отступа (после декораторов)
+_UNIT_NAME_RE = re.compile(r"^((?:async[ \t]+def|def|class)[ \t]+)(\w+)", re.MULTILINE)
+# Размер куска модуля, который разбирается ast за раз: AST всего большого файла в памяти не держится
+PARSE_BLOCK_CHARS = 256 * 1024
+
+
+def unique_name(name: str, used: set) -> str:
+    """name, а при совпадении с уже использованным — name_2, name_3, ..."""
+    candidate, index = name, 2
+    while candidate in used:
+        candidate = f"{name}_{index}"
+        index += 1
+    used.add(candidate)
+    return candidate
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов: ~3 символа на токен для смеси кириллицы и кода"""
+    return len(text) // 3 + 1
+
+
+class TestModule:
+    """Модуль тестов, разобранный на импорты, общие хелперы и тестовые единицы.
+
+    Единица — класс с тестами или тестовая функция верхнего уровня вместе с декораторами;
+    group — значение @allure.feature (или имя класса), по нему связанные тесты попадают в один пакет.
+    """
+
+    def __init__(self, imports: List[str], helpers: Dict[str, str], units: List[Tuple[str, str]]):
+        self.imports = imports
+        self.helpers = helpers
+        self.units = units
+
+    def header(self) -> str:
+        """Импорты и хелперы — общая шапка, которую получает каждый пакет"""
+        parts = ["\n".join(self.imports)] if self.imports else []
+        parts.extend(self.helpers.values())
+        return "\n\n\n".join(parts)
+
+
+def _node_start(node: ast.AST) -> int:
+    decorators = getattr(node, "decorator_list", None) or []
+    return min([node.lineno] + [d.lineno for d in decorators])
+
+
+def _helper_name(node: ast.stmt, source: str) -> str:
+    """Ключ дедупликации хелпера: имя функции/класса или нормализованный текст оператора"""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return node.name
+    return " ".join(source.split())
+
+
+def _is_test_unit(node: ast.stmt) -> bool:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return node.name.startswith("test")
+    if isinstance(node, ast.ClassDef):
+        return any(
+            isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) and child.name.startswith("test")
+            for child in node.body
+        )
+    return False
+
+
+def _iter_blocks(code: str, block_chars: int = PARSE_BLOCK_CHARS) -> Iterator[Tuple[ast.Module, str, int]]:
+    """Разбирает модуль кусками: (AST куска, текст куска, число строк до начала куска).
+
+    Модуль режется по границам строк без отступа. Если граница попала внутрь
+    многострочной строки или скобок, кусок не компилируется и расширяется до следующей границы,
+    поэтому результат совпадает с разбором файла целиком, а пик памяти ограничен одним куском.
+    """
+    length = len(code)
+    start = 0
+    line_offset = 0
+    while start < length:
+        match = _STATEMENT_START_RE.search(code, start + block_chars) if start + block_chars < length else None
+        end = match.start() if match else length
+        while True:
+            block = code[start:end]
+            try:
+                tree = ast.parse(block)
+                break
+            except SyntaxError as e:
+                if end >= length:
+                    if e.lineno is not None:
+                        e.lineno += line_offset
+                    raise
+                # Кусок растет геометрически, чтобы настоящая ошибка не приводила к квадратичному разбору
+                grow_to = start + 2 * (end - start)
+                match = _STATEMENT_START_RE.search(code, grow_to) if grow_to < length else None
+                end = match.start() if match else length
+        yield tree, block, line_offset
+        line_offset += block.count("\n")
+        del tree, block
+        start = end
+
+
+def _iter_statements(code: str, block_chars: int = PARSE_BLOCK_CHARS) -> Iterator[Tuple[ast.stmt, str, bool]]:
+    """Перебирает операторы верхнего уровня: (узел, исходный текст с декораторами, первый ли оператор)"""
+    first = True
+    for tree, block, _ in _iter_blocks(code, block_chars):
+        lines = block.splitlines()
+        for node in tree.body:
+            yield node, "\n".join(lines[_node_start(node) - 1:node.end_lineno]), first
+            first = False
+        del lines
+
+
+def iter_statement_lines(code: str, block_chars: int = PARSE_BLOCK_CHARS) -> Iterator[Tuple[ast.stmt, int, int]]:
+    """Операторы верхнего уровня без копирования текста: (узел, первая и последняя строка в модуле, с 1).
+
+    Номера строк внутри узла отсчитываются от начала куска, а не модуля.
+    """
+    for tree, _, line_offset in _iter_blocks(code, block_chars):
+        for node in tree.body:
+            yield node, line_offset + _node_start(node), line_offset + node.end_lineno
+
+
+def split_test_module(code: str) -> TestModule:
+    """Разбирает модуль через ast; SyntaxError пробрасывается вызывающему"""
+    imports: List[str] = []
+    helpers: Dict[str, str] = {}
+    units: List[Tuple[str, str]] = []
+    for node, source, first in _iter_statements(code):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            if source not in imports:
+                imports.append(source)
+        elif _is_test_unit(node):
+            match = _FEATURE_RE.search(source)
+            units.append((match.group(1) if match else getattr(node, "name", ""), source))
+        elif first and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+            continue  # docstring модуля в пакеты не передается
+        else:
+            helpers.setdefault(_helper_name(node, source), source)
+    return TestModule(imports, helpers, units)
+
+
+def make_batches(units: List[Tuple[str, str]], budget: int = CHUNK_TOKEN_BUDGET) -> List[List[str]]:
+    """Упаковывает единицы в пакеты не больше budget токенов.
+
+    Единицы одной группы (feature) стараются держаться в одном пакете, чтобы модель видела
+    возможные дубликаты; группа больше бюджета делится, единица больше бюджета идет отдельным пакетом.
+    """
+    groups: Dict[str, List[str]] = {}
+    for group, source in units:
+        groups.setdefault(group, []).append(source)
+
+    batches: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for sources in groups.values():
+        group_tokens = sum(estimate_tokens(source) for source in sources)
+        if current and current_tokens + group_tokens > budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        for source in sources:
+            tokens = estimate_tokens(source)
+            if current and current_tokens + tokens > budget:
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(source)
+            current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _split_output(code: str) -> Tuple[List[str], List[Tuple[str, str]], List[str]]:
+    """Делит ответ модели на импорты, хелперы и тестовые единицы; неразбираемый ответ делится построчно"""
+    try:
+        module: Optional[TestModule] = split_test_module(code)
+    except SyntaxError:
+        module = None
+    if module is None:
+        imports = [line for line in code.splitlines() if _IMPORT_LINE_RE.match(line)]
+        body = "\n".join(line for line in code.splitlines() if not _IMPORT_LINE_RE.match(line))
+        body = body.strip("\n")
+        return imports, [], [body] if body else []
+    return module.imports, list(module.helpers.items()), [source for _, source in module.units]
+
+
+def _rename_unit(source: str, used: set) -> str:
+    """Дает классу или тестовой функции единицы имя, не занятое в собираемом модуле"""
+    match = _UNIT_NAME_RE.search(source)
+    if match is None:
+        return source
+    name = unique_name(match.group(2), used)
+    if name == match.group(2):
+        return source
+    return source[:match.start(2)] + name + source[match.end(2):]
+
+
+def assemble_module(original: TestModule, outputs: List[str]) -> str:
+    """Собирает один модуль из ответов по пакетам: импорты и хелперы (allure_step и т.п.) без дублей.
+
+    Пакеты одной большой feature модель часто называет одинаково (class TestAuth), а повторное
+    определение заменило бы предыдущее при импорте: повторяющиеся имена классов и тестов получают суффикс.
+    """
+    imports = list(original.imports)
+    seen_imports = {" ".join(imp.split()) for imp in imports}
+    helpers = dict(original.helpers)
+    bodies: List[str] = []
+    used_names = set(helpers)
+    for output in outputs:
+        output_imports, output_helpers, units = _split_output(output)
+        for imp in output_imports:
+            normalized = " ".join(imp.split())
+            if normalized not in seen_imports:
+                seen_imports.add(normalized)
+                imports.append(imp)
+        for name, source in output_helpers:
+            helpers.setdefault(name, source)
+            used_names.add(name)
+        bodies.extend(_rename_unit(source, used_names) for source in units)
+
+    parts = ["\n".join(imports)] if imports else []
+    parts.extend(helpers.values())
+    parts.extend(bodies)
+    return "\n\n\n".join(parts) + "\n"
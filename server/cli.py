@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Пакетная генерация тестов из директории без HTTP-сервера и прокси клиента.
+
+Запуск из директории server (нужны те же переменные окружения, что и серверу):
+    python cli.py <входная директория> <выходная директория> [--concurrency 8] [--lime-mode auto]
+                  [--profile xdist] [--optimize] [--validate] [--processes 2] [--force]
+
+Файлы .yaml/.yml/.json обрабатываются как OpenAPI спецификации (Lime), .txt/.md — как текстовые
+требования (Green). Результат каждого файла записывается сразу по готовности в выходную директорию
+с той же структурой поддиректорий (test_<имя>.py, отчет Purple — test_<имя>.validation.txt; у файлов
+одной директории с одинаковым именем, например api.yaml и api.json, в имя результата добавляется
+расширение: test_api_yaml.py, test_api_json.py), а в manifest.jsonl дописывается строка с итогом. При повторном запуске файлы, у которых в манифесте
+есть успешная запись с тем же отпечатком входа и параметров, пропускаются — прерванный прогон
+продолжается с того места, где остановился. В профиле xdist рядом с тестами спецификации
+записывается conftest.py с фикстурой api; pytest берет conftest.py по директории, поэтому если в
+директории несколько спецификаций, результаты каждой записываются в свою поддиректорию test_<имя>.
+
+Файлы обрабатывают --concurrency воркеров в одном цикле событий (вызовы модели проходят через тот же
+планировщик, что и на сервере); разбор больших YAML спецификаций, нагружающий процессор, выполняется
+в пуле из --processes процессов.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+from chunking import unique_name
+from lime_profiles import LIME_OUTPUT_PROFILE, profile_files
+from logger import get_logger, kv, request_id_var, stage
+from usage import caller_var
+
+import main
+
+log = get_logger("cli")
+
+MANIFEST_NAME = "manifest.jsonl"
+SPEC_SUFFIXES = (".yaml", ".yml", ".json")
+TEXT_SUFFIXES = (".txt", ".md")
+# Спецификации больше этого размера (в символах) разбираются в пуле процессов
+CLI_PROCESS_PARSE_CHARS = int(os.getenv("CLI_PROCESS_PARSE_CHARS", str(1024 * 1024)))
+
+
+class Job:
+    """Входной файл и пути его результатов относительно выходной директории"""
+
+    __slots__ = ("source", "path", "kind", "directory", "stem", "output", "report")
+
+    def __init__(self, root: str, path: str):
+        self.path = path
+        self.source = os.path.relpath(path, root).replace(os.sep, "/")
+        self.kind = "lime" if path.lower().endswith(SPEC_SUFFIXES) else "green"
+        self.directory, name = os.path.split(self.source)
+        self.stem = os.path.splitext(name)[0]
+        self.place(self.directory, self.stem)
+
+    def place(self, directory: str, name: str) -> None:
+        """Результаты записываются в directory как test_<name>.py и test_<name>.validation.txt"""
+        self.output = "/".join(filter(None, [directory, f"test_{name}.py"]))
+        self.report = "/".join(filter(None, [directory, f"test_{name}.validation.txt"]))
+
+
+def find_jobs(root: str, profile: str = "default") -> List[Job]:
+    """Входные файлы директории в стабильном порядке (скрытые файлы и директории пропускаются).
+
+    Имена результатов уникальны в пределах выходной директории, а в профиле xdist у каждой спецификации
+    директории с несколькими спецификациями своя поддиректория (conftest.py у них разный).
+    """
+    jobs = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith("."))
+        group = [Job(root, os.path.join(directory, name)) for name in sorted(files)
+                 if not name.startswith(".") and name.lower().endswith(SPEC_SUFFIXES + TEXT_SUFFIXES)]
+        stems = Counter(job.stem for job in group)
+        separate_specs = profile == "xdist" and sum(job.kind == "lime" for job in group) > 1
+        used: set = set()
+        for job in group:
+            # api.yaml и api.json дали бы один test_api.py: расширение остается в имени результата
+            name = job.stem if stems[job.stem] == 1 else f"{job.stem}_{os.path.splitext(job.path)[1][1:]}"
+            name = unique_name(name, used)
+            if separate_specs and job.kind == "lime":
+                job.place("/".join(filter(None, [job.directory, f"test_{name}"])), name)
+            else:
+                job.place(job.directory, name)
+        jobs.extend(group)
+    return jobs
+
+
+def fingerprint(data: bytes, options: Dict[str, Any]) -> str:
+    """Отпечаток входа и параметров обработки: изменение любого из них требует повторной генерации"""
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8"))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Журнал результатов (JSON Lines, только дозапись): последняя запись по файлу — его текущий итог"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as manifest:
+                for line in manifest:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # строка, недописанная при аварийном завершении
+                    self.records[record["source"]] = record
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done(self, job: Job, digest: str, output_dir: str) -> bool:
+        record = self.records.get(job.source)
+        return (record is not None and record.get("status") == "ok" and record.get("fingerprint") == digest
+                and os.path.exists(os.path.join(output_dir, record["output"])))
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.records[record["source"]] = record
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # Запись на диске до перехода к следующему файлу: прерывание не теряет готовые результаты
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def write_atomic(path: str, text: str) -> None:
+    """Записывает файл через временный: прерванная запись не оставляет обрезанный результат"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as output:
+        output.write(text)
+    os.replace(temporary, path)
+
+
+class Runner:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.options = {"lime_mode": args.lime_mode, "profile": args.profile, "optimize": args.optimize,
+                        "validate": args.validate}
+        self.manifest = Manifest(os.path.join(args.output, MANIFEST_NAME))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    async def parse_spec(self, text: str) -> Dict[str, Any]:
+        if self.args.processes <= 0 or len(text) < CLI_PROCESS_PARSE_CHARS:
+            return main.parse_openapi_spec(text)
+        if self._pool is None:
+            # spawn: дочерние процессы не наследуют потоки логгера и учета родителя
+            self._pool = ProcessPoolExecutor(self.args.processes, mp_context=get_context("spawn"))
+        return await asyncio.get_running_loop().run_in_executor(self._pool, main.parse_openapi_spec, text)
+
+    async def generate(self, job: Job, text: str) -> Dict[str, str]:
+        """Та же обработка, что и у эндпоинтов /generate и /lime, плюс Blue и Purple по флагам"""
+        if job.kind == "lime":
+            with stage("parse", **{"sos.spec_chars": len(text)}):
+                openapi_spec = await self.parse_spec(text)
+            code = await main.generate_lime_code(openapi_spec, self.args.lime_mode, profile=self.args.profile)
+            files = profile_files(openapi_spec, self.args.profile) or {}
+        else:
+            code = (await main.generate_test_code(main.GenerateRequest(text=text))).code
+            files = {}
+        directory = os.path.dirname(job.output)
+        results = {"/".join(filter(None, [directory, name])): content for name, content in files.items()}
+        if self.args.optimize:
+            code = await main.ensure_valid_python(await main.optimize_module(code), "blue")
+        results[job.output] = code
+        if self.args.validate:
+            results[job.report] = await main.validate_test_cases(code)
+        return results
+
+    async def process(self, job: Job) -> None:
+        with open(job.path, "rb") as source:
+            data = source.read()
+        digest = fingerprint(data, self.options)
+        if not self.args.force and self.manifest.done(job, digest, self.args.output):
+            self.counts["skipped"] += 1
+            return
+        request_id_var.set(hashlib.sha256(job.source.encode("utf-8")).hexdigest()[:16])
+        started = time.perf_counter()
+        record: Dict[str, Any] = {"source": job.source, "fingerprint": digest, "output": job.output}
+        try:
+            results = await self.generate(job, data.decode("utf-8", errors="replace"))
+            for path, text in results.items():
+                write_atomic(os.path.join(self.args.output, path), text)
+            record["status"] = "ok"
+        except Exception as e:
+            # HTTPException эндпоинтов несет понятное описание в detail
+            record["status"] = "error"
+            record["error"] = main.safe_str(getattr(e, "detail", None) or e)[:500]
+            log.error("Файл не обработан: %s", record["error"], extra=kv(source=job.source))
+        record["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        record["ts"] = time.time()
+        self.manifest.append(record)
+        self.counts[record["status"]] += 1
+        log.info("Файл обработан", extra=kv(source=job.source, status=record["status"], elapsed_ms=record["elapsed_ms"]))
+
+    async def run(self, jobs: List[Job]) -> None:
+        queue: "asyncio.Queue[Job]" = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        async def worker() -> None:
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self.process(job)
+
+        caller_var.set(self.args.caller)
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(self.args.concurrency, 1))))
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+            self.manifest.close()
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="директория с требованиями (.txt, .md) и спецификациями (.yaml, .yml, .json)")
+    parser.add_argument("output", help="директория для результатов и manifest.jsonl")
+    parser.add_argument("--concurrency", type=int, default=8, help="сколько файлов обрабатывается одновременно")
+    parser.add_argument("--processes", type=int, default=min(os.cpu_count() or 1, 4),
+                        help="процессов для разбора больших спецификаций (0 — разбирать в основном процессе)")
+    parser.add_argument("--lime-mode", choices=("llm", "template", "hybrid", "auto"), default="llm",
+                        help="режим генерации по OpenAPI")
+    parser.add_argument("--profile", choices=("default", "xdist"), default=LIME_OUTPUT_PROFILE,
+                        help="профиль вывода Lime (xdist — фикстура api с пулом соединений в conftest.py)")
+    parser.add_argument("--optimize", action="store_true", help="оптимизировать результат (Blue)")
+    parser.add_argument("--validate", action="store_true", help="проверить результат на стандарты (Purple)")
+    parser.add_argument("--force", action="store_true", help="обработать заново файлы, уже успешные в манифесте")
+    parser.add_argument("--caller", default="cli", help="вызывающая сторона в учете токенов")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input):
+        parser.error(f"директория не найдена: {args.input}")
+    os.makedirs(args.output, exist_ok=True)
+    jobs = find_jobs(args.input, args.profile)
+    runner = Runner(args)
+    started = time.perf_counter()
+    try:
+        asyncio.run(runner.run(jobs))
+    except KeyboardInterrupt:
+        print("Прервано: готовые результаты записаны, повторный запуск продолжит обработку", file=sys.stderr)
+        return 130
+    counts = runner.counts
+    print(f"файлов: {len(jobs)}, успешно: {counts['ok']}, с ошибкой: {counts['error']}, "
+          f"пропущено: {counts['skipped']}, {time.perf_counter() - started:.1f} с")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
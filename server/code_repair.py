@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Проверка компиляции сгенерированного кода и точечное исправление сломанных фрагментов"""
+import re
+import textwrap
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Начало блока верхнего уровня: декоратор, класс или функция без отступа
+_TOP_LEVEL_START = re.compile(r"^(@|class\s|def\s|async\s+def\s)")
+# Начало метода класса (отступ 4 пробела)
+_METHOD_START = re.compile(r"^    (@|def\s|async\s+def\s)")
+
+
+def check_code(code: str) -> Optional[SyntaxError]:
+    """Компилирует код; возвращает SyntaxError или None, если код валиден"""
+    try:
+        compile(code, "<generated>", "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return e
+    except ValueError as e:  # например, нулевой байт в исходнике
+        return SyntaxError(str(e))
+    return None
+
+
+def _blocks(lines: List[str], start_re: "re.Pattern[str]", first: int, last: int) -> List[Tuple[int, int]]:
+    """Разбивает строки [first, last) на блоки; декораторы относятся к следующему def/class"""
+    starts = []
+    previous_is_decorator = False
+    for number in range(first, last):
+        line = lines[number]
+        if start_re.match(line):
+            if not previous_is_decorator:
+                starts.append(number)
+            previous_is_decorator = line.lstrip().startswith("@")
+        elif line.strip():
+            previous_is_decorator = False
+    blocks = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else last
+        # Хвостовые пустые строки не входят в блок
+        while end > start + 1 and not lines[end - 1].strip():
+            end -= 1
+        blocks.append((start, end))
+    return blocks
+
+
+def find_broken_fragment(code: str, error: SyntaxError) -> Optional[Tuple[int, int]]:
+    """Находит наименьший фрагмент (метод или блок верхнего уровня), содержащий ошибку.
+
+    Возвращает диапазон строк [start, end) с нумерацией с нуля или None,
+    если ошибку не удалось локализовать (например, она в импортах).
+    """
+    lines = code.splitlines()
+    if not error.lineno:
+        return None
+    error_line = error.lineno - 1
+
+    for start, end in _blocks(lines, _TOP_LEVEL_START, 0, len(lines)):
+        if not start <= error_line < end:
+            continue
+        if lines[start].lstrip().startswith(("class ", "@")) and any(
+            line.startswith("class ") for line in lines[start:end]
+        ):
+            # Внутри класса пробуем сузить до метода: заменяем метод заглушкой и проверяем модуль
+            for method_start, method_end in _blocks(lines, _METHOD_START, start + 1, end):
+                if method_start <= error_line < method_end:
+                    stub = lines[:method_start] + ["    pass"] + lines[method_end:]
+                    if check_code("\n".join(stub)) is None:
+                        return method_start, method_end
+                    break
+        return start, end
+    return None
+
+
+async def repair_code(code: str, repair: Callable[[str, str], Awaitable[str]],
+                      max_attempts: int = 3) -> Tuple[str, Dict]:
+    """Проверяет код и исправляет сломанные фрагменты через await repair(fragment, error_message).
+
+    Каждый фрагмент отправляется на исправление без отступа и возвращается на место
+    с исходным отступом. Возвращает (код, отчет).
+    """
+    report: Dict = {"attempts": 0, "repaired": [], "valid": False}
+    error = check_code(code)
+    while error is not None and report["attempts"] < max_attempts:
+        span = find_broken_fragment(code, error)
+        if span is None:
+            break
+        start, end = span
+        lines = code.splitlines()
+        fragment = "\n".join(lines[start:end])
+        indent = len(lines[start]) - len(lines[start].lstrip())
+        relative_line = (error.lineno or start + 1) - start
+        message = f"{error.msg} (строка {relative_line} фрагмента)"
+
+        report["attempts"] += 1
+        fixed = await repair(textwrap.dedent(fragment), message)
+        if not fixed or not fixed.strip():
+            break
+        fixed = textwrap.indent(textwrap.dedent(fixed.strip("\n")), " " * indent)
+
+        candidate = "\n".join(lines[:start] + fixed.splitlines() + lines[end:])
+        if code.endswith("\n"):
+            candidate += "\n"
+        candidate_error = check_code(candidate)
+        # Принимаем исправление, только если ошибка ушла из этого фрагмента
+        if candidate_error is not None and candidate_error.lineno is not None:
+            new_end = start + len(fixed.splitlines())
+            if start < candidate_error.lineno <= new_end:
+                continue
+        code = candidate
+        error = candidate_error
+        report["repaired"].append({"start_line": start + 1, "end_line": end})
+    report["valid"] = error is None
+    return code, report
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""Компактная форма ручных тестов Allure для промптов Blue и Purple и обратное восстановление кода.
+
+Модули ручных тестов почти целиком состоят из повторяющегося шаблона: импорты, хелпер allure_step,
+одинаковые стопки @allure.label("owner", ...)/@allure.feature(...)/@allure.suite(...) на каждом классе
+и with allure_step(...): pass на каждом шаге. В компактной форме метаданные, общие для всех тестов
+модуля, указываются один раз в начале, общие для тестов класса — один раз у класса, а от теста
+остаются имя, заголовок, собственные метки и названия шагов:
+
+    owner: qa
+    suite: UI
+    manual
+    mark: manual
+
+    class АвторизацияUITests
+      feature: Авторизация
+      test_вход_по_паролю: Вход по паролю
+        tag: NORMAL
+        priority: NORMAL
+        - Arrange: открыть страницу входа
+        - Act: ввести логин и пароль
+        - Assert: открыта главная страница
+
+Форма строится только для модулей, которые восстанавливаются из нее без потерь: тела тестов — только
+шаги без кода, декораторы — метки Allure, ссылки и pytest-марки без аргументов. Перед использованием
+форма каждого класса разбирается обратно и сравнивается с исходным классом; модуль с чем-либо еще
+(код проверок, параметризация, фикстуры) отправляется в модель как есть.
+"""
+import ast
+import json
+import os
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from chunking import iter_statement_lines
+
+# Компактная форма в промптах Blue и Purple (0 — всегда отправлять исходный код)
+PROMPT_COMPACTION = os.getenv("PROMPT_COMPACTION", "1").strip().lower() not in ("0", "false", "no", "off")
+# Модули больше этого размера (в символах) отправляются исходным кодом: Blue режет большие модули на пакеты
+# меньше порога, а промпт Purple такого размера и в компактной форме не помещается в контекст модели
+PROMPT_COMPACTION_MAX_CHARS = int(os.getenv("PROMPT_COMPACTION_MAX_CHARS", str(256 * 1024)))
+# Кусок модуля, разбираемый ast за раз: AST в десятки раз больше исходника, поэтому куски меньше, чем в chunking.py
+COMPACTION_PARSE_BLOCK_CHARS = 32 * 1024
+
+# Дополнение промпта Blue (добавляется к сообщению пользователя, системный промпт не меняется)
+BLUE_COMPACT_INSTRUCTIONS = '''Тест-кейсы переданы в компактной форме, а не кодом Python. Строки без отступа до первого
+class — метаданные всех тестов модуля, строки под class до первого теста — метаданные всех тестов класса,
+строка "test_имя: заголовок" начинает тест, строки под ней — его метаданные и шаги ("- Arrange: ...").
+Метаданные — метки Allure ("ключ: значение"; owner, feature, story, suite, tag, priority и любые другие),
+link (URL и имя через пробел), manual (@allure.manual) и mark (марка pytest без аргументов). Значения со
+спецсимволами записываются строкой JSON в кавычках. Импорты, allure_step и декораторы сервер добавит сам.
+Верни результат ТОЛЬКО в этой же компактной форме: без кода Python, без markdown и без пояснений.'''
+
+# Дополнение промпта Purple: отчет остается обычным текстом
+PURPLE_COMPACT_INSTRUCTIONS = '''Тест-кейсы переданы в компактной форме: шапка модуля (импорты и allure_step) приведена
+кодом как есть, тесты — списком. Строки без отступа до первого class — метаданные всех тестов модуля
+(соответствуют декораторам каждого класса), строки под class до первого теста — метаданные всех тестов класса,
+строка "test_имя: заголовок" — тест с @allure.title, строки под ней — его декораторы и шаги
+with allure_step(...) (тела шагов пустые). manual — @allure.manual, mark: manual — @mark.manual,
+остальные "ключ: значение" — метки Allure. Местоположение проблем указывай по именам классов и тестов.'''
+
+# Метки, у которых есть собственный декоратор allure.<имя>(значение)
+SHORT_LABELS = ("epic", "feature", "story", "parent_suite", "suite", "sub_suite", "tag")
+# Ключи компактной формы, которые не являются метками
+_RESERVED_KEYS = ("title", "link", "manual", "mark", "class")
+# Порядок декораторов в восстановленном коде (как в generate_allure_test_code)
+_DECORATOR_ORDER = {key: index for index, key in enumerate(
+    ("manual", "owner", "epic", "feature", "story", "parent_suite", "suite", "sub_suite", "title", "link", "tag"))}
+
+_CLASS_RE = re.compile(r"^class\s+([^\s:(]+)\s*:?$")
+_TEST_RE = re.compile(r"^(test\w*)\s*(?::\s*(.*))?$")
+_STEP_RE = re.compile(r"^[-*]\s+(.*)$")
+_META_RE = re.compile(r"^([A-Za-z_][\w.]*)\s*(?::\s*(.*))?$")
+_KEY_RE = re.compile(r"^[A-Za-z_][\w.]*$")
+_IDENTIFIER_RE = re.compile(r"^[^\W\d]\w*$")
+
+Pair = Tuple[str, str]
+
+
+class CompactFormError(ValueError):
+    """Текст не разбирается как компактная форма"""
+
+
+class CompactTest:
+    __slots__ = ("name", "title", "pairs", "steps")
+
+    def __init__(self, name: str, title: Optional[str], pairs: List[Pair], steps: List[str]):
+        self.name = name
+        self.title = title
+        self.pairs = pairs
+        self.steps = steps
+
+    def key(self) -> tuple:
+        return self.name, self.title, tuple(sorted(self.pairs)), tuple(self.steps)
+
+
+class CompactClass:
+    __slots__ = ("name", "tests")
+
+    def __init__(self, name: str, tests: List[CompactTest]):
+        self.name = name
+        self.tests = tests
+
+    def key(self) -> tuple:
+        return self.name, tuple(test.key() for test in self.tests)
+
+
+class CompactModule:
+    """Шапка модуля (исходный текст импортов и хелперов) и тесты с полными метаданными каждого"""
+
+    def __init__(self, header: str, classes: List[CompactClass]):
+        self.header = header
+        self.classes = classes
+        self._text: Optional[str] = None
+
+    def render(self) -> str:
+        if self._text is None:
+            self._text = render_compact(self.classes)
+        return self._text
+
+    def expand(self, classes: Optional[List[CompactClass]] = None) -> str:
+        """Код модуля из компактной формы (по умолчанию — исходные тесты) с исходной шапкой"""
+        return rehydrate(self.header, self.classes if classes is None else classes)
+
+
+# ---------------------------------------------------------------------------
+# Код -> компактная форма
+# ---------------------------------------------------------------------------
+
+def _attribute_path(node: ast.expr) -> Optional[str]:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def _strings(nodes: Iterable[ast.expr]) -> Optional[List[str]]:
+    values = []
+    for node in nodes:
+        if not (isinstance(node, ast.Constant) and isinstance(node.value, str)):
+            return None
+        values.append(node.value)
+    return values
+
+
+def _decorator_pairs(node: ast.expr) -> Optional[List[Pair]]:
+    """Метаданные одного декоратора; None — декоратор не выражается в компактной форме"""
+    path = _attribute_path(node.func if isinstance(node, ast.Call) else node)
+    if path is None:
+        return None
+    if not isinstance(node, ast.Call):
+        if path == "allure.manual":
+            return [("manual", "")]
+        prefix, _, name = path.rpartition(".")
+        if prefix in ("mark", "pytest.mark"):
+            return [("mark", name)]
+        return None
+    args = _strings(node.args)
+    if args is None:
+        return None
+    if path == "allure.label" and len(args) == 2 and not node.keywords:
+        name = args[0]
+        if not _KEY_RE.match(name) or name in _RESERVED_KEYS or name.startswith("test"):
+            return None
+        return [(name, args[1])]
+    if path == "allure.title" and len(args) == 1 and not node.keywords:
+        return [("title", args[0])]
+    if path.startswith("allure.") and path[7:] in SHORT_LABELS and args and not node.keywords:
+        return [(path[7:], value) for value in args]
+    if path == "allure.link" and len(args) == 1 and args[0] and not re.search(r"\s", args[0]):
+        if not node.keywords:
+            return [("link", args[0])]
+        keyword = node.keywords[0]
+        names = _strings([keyword.value])
+        if len(node.keywords) == 1 and keyword.arg == "name" and names and names[0].strip() == names[0] and names[0]:
+            return [("link", f"{args[0]} {names[0]}")]
+    return None
+
+
+def _decorators(nodes: List[ast.expr]) -> Optional[List[Pair]]:
+    pairs: List[Pair] = []
+    for node in nodes:
+        decorator = _decorator_pairs(node)
+        if decorator is None:
+            return None
+        pairs.extend(decorator)
+    return pairs
+
+
+def _steps(body: List[ast.stmt]) -> Optional[List[str]]:
+    """Названия шагов тела теста, состоящего только из with allure_step(...): pass"""
+    if len(body) == 1 and isinstance(body[0], ast.Pass):
+        return []
+    steps = []
+    for statement in body:
+        if not (isinstance(statement, ast.With) and len(statement.items) == 1 and statement.items[0].optional_vars is None):
+            return None
+        call = statement.items[0].context_expr
+        if not (isinstance(call, ast.Call) and _attribute_path(call.func) in ("allure_step", "allure.step")
+                and len(call.args) == 1 and not call.keywords):
+            return None
+        name = _strings(call.args)
+        if name is None:
+            return None
+        inner = statement.body
+        if not (len(inner) == 1 and (isinstance(inner[0], ast.Pass) or (
+                isinstance(inner[0], ast.Expr) and isinstance(inner[0].value, ast.Constant) and inner[0].value.value is Ellipsis))):
+            return None
+        steps.append(name[0])
+    return steps
+
+
+def _test(node: ast.stmt, class_pairs: List[Pair]) -> Optional[CompactTest]:
+    if not (isinstance(node, ast.FunctionDef) and node.name.startswith("test")):
+        return None
+    args = node.args
+    if (len(args.args) != 1 or args.args[0].arg != "self" or args.args[0].annotation is not None or args.posonlyargs
+            or args.vararg or args.kwonlyargs or args.kwarg or args.defaults):
+        return None
+    if node.returns is not None and not (isinstance(node.returns, ast.Constant) and node.returns.value is None):
+        return None
+    pairs = _decorators(node.decorator_list)
+    steps = _steps(node.body)
+    if pairs is None or steps is None:
+        return None
+    titles = [value for key, value in pairs if key == "title"]
+    pairs = class_pairs + [pair for pair in pairs if pair[0] != "title"]
+    # Повтор метки у одного теста форма не передает
+    if len(titles) > 1 or len(set(pairs)) != len(pairs):
+        return None
+    return CompactTest(node.name, titles[0] if titles else None, pairs, steps)
+
+
+def _class(node: ast.ClassDef) -> Optional[CompactClass]:
+    if node.bases or node.keywords or not node.body:
+        return None
+    class_pairs = _decorators(node.decorator_list)
+    if class_pairs is None or any(key == "title" for key, _ in class_pairs):
+        return None
+    tests = []
+    for child in node.body:
+        test = _test(child, class_pairs)
+        if test is None:
+            return None
+        tests.append(test)
+    return CompactClass(node.name, tests)
+
+
+def _compact_class(node: ast.ClassDef) -> Optional[CompactClass]:
+    """Компактная форма одного класса, если класс восстанавливается из нее без потерь.
+
+    Обратимость проверяется на каждом классе отдельно: текст формы разбирается обратно и должен дать
+    те же тесты (код класса — функция разобранной формы, поэтому повторно он не компилируется).
+    """
+    compact_class = _class(node)
+    if compact_class is None:
+        return None
+    try:
+        restored = parse_compact(render_compact([compact_class]))
+    except CompactFormError:
+        return None
+    if len(restored) != 1 or restored[0].key() != compact_class.key():
+        return None
+    return compact_class
+
+
+def compact_module(code: str) -> Optional[CompactModule]:
+    """Компактная форма модуля или None, если модуль больше PROMPT_COMPACTION_MAX_CHARS или не
+    восстанавливается из нее без потерь"""
+    if len(code) > PROMPT_COMPACTION_MAX_CHARS:
+        return None
+    lines = code.splitlines()
+    imports: List[str] = []
+    helpers: List[str] = []
+    classes: List[CompactClass] = []
+    try:
+        # Разбор кусками (chunking.py): AST всего модуля в памяти не держится
+        for index, (node, first_line, last_line) in enumerate(iter_statement_lines(code, COMPACTION_PARSE_BLOCK_CHARS)):
+            if isinstance(node, ast.ClassDef):
+                compact_class = _compact_class(node)
+                if compact_class is None:
+                    return None
+                classes.append(compact_class)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                imports.append("\n".join(lines[first_line - 1:last_line]))
+            elif isinstance(node, ast.FunctionDef) and node.name == "allure_step":
+                helpers.append("\n".join(lines[first_line - 1:last_line]))
+            elif not (index == 0 and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)):
+                # Прочие операторы (фикстуры, константы, тесты-функции) форма не передает
+                return None
+    except SyntaxError:
+        return None
+    if not classes:
+        return None
+    return CompactModule("\n\n\n".join((["\n".join(imports)] if imports else []) + helpers), classes)
+
+
+# ---------------------------------------------------------------------------
+# Компактная форма <-> текст
+# ---------------------------------------------------------------------------
+
+def _encode(value: str) -> str:
+    """Значение как есть или строкой JSON, если иначе оно не читается однозначно"""
+    if not value or value != value.strip() or value.startswith('"') or any(c in value for c in "\n\r\t"):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _decode(value: Optional[str]) -> str:
+    value = (value or "").strip()
+    if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+        try:
+            decoded = json.loads(value)
+        except json.JSONDecodeError:
+            return value
+        return decoded if isinstance(decoded, str) else value
+    return value
+
+
+def _meta_line(pair: Pair) -> str:
+    key, value = pair
+    return key if key == "manual" else f"{key}: {_encode(value)}"
+
+
+def _shared(pair_lists: List[List[Pair]], exclude: Iterable[Pair] = ()) -> List[Pair]:
+    """Метаданные, которые есть у всех тестов, в порядке первого теста"""
+    if not pair_lists:
+        return []
+    excluded = set(exclude)
+    others = [set(pairs) for pairs in pair_lists[1:]]
+    return [pair for pair in pair_lists[0] if pair not in excluded and all(pair in other for other in others)]
+
+
+def render_compact(classes: List[CompactClass]) -> str:
+    module_pairs = _shared([test.pairs for compact_class in classes for test in compact_class.tests])
+    lines = [_meta_line(pair) for pair in module_pairs]
+    for compact_class in classes:
+        class_pairs = _shared([test.pairs for test in compact_class.tests], module_pairs)
+        hoisted = set(module_pairs) | set(class_pairs)
+        if lines:
+            lines.append("")
+        lines.append(f"class {compact_class.name}")
+        lines.extend("  " + _meta_line(pair) for pair in class_pairs)
+        for test in compact_class.tests:
+            lines.append(f"  {test.name}" + (f": {_encode(test.title)}" if test.title is not None else ""))
+            lines.extend("    " + _meta_line(pair) for pair in test.pairs if pair not in hoisted)
+            lines.extend(f"    - {_encode(step)}" for step in test.steps)
+    return "\n".join(lines) + "\n"
+
+
+def _identifier(text: str, fallback: str) -> str:
+    name = "".join(c if c.isalnum() or c == "_" else "_" for c in text)
+    return name if _IDENTIFIER_RE.match(name) else fallback + name
+
+
+def _unique(name: str, used: set) -> str:
+    candidate, index = name, 2
+    while candidate in used:
+        candidate = f"{name}_{index}"
+        index += 1
+    used.add(candidate)
+    return candidate
+
+
+def parse_compact(text: str, unique: bool = False) -> List[CompactClass]:
+    """Разбирает компактную форму (например, ответ модели); CompactFormError, если это не она.
+
+    unique — делать имена классов и тестов уникальными (для ответа модели: одноименные классы и
+    методы перекрывали бы друг друга при сборе pytest).
+    """
+    module_pairs: List[Pair] = []
+    class_pairs: List[Pair] = []
+    classes: List[CompactClass] = []
+    test: Optional[CompactTest] = None
+    class_names: set = set()
+    test_names: set = set()
+    for number, raw_line in enumerate(text.splitlines(), 1):
+        line = raw_line.strip()
+        if not line or line.startswith(("#", "```")):
+            continue
+        match = _CLASS_RE.match(line)
+        if match:
+            name = _identifier(match.group(1), "C")
+            classes.append(CompactClass(_unique(name, class_names) if unique else name, []))
+            class_pairs, test, test_names = [], None, set()
+            continue
+        match = _TEST_RE.match(line)
+        if match:
+            if not classes:
+                raise CompactFormError(f"строка {number}: тест вне класса")
+            name = _unique(match.group(1), test_names) if unique else match.group(1)
+            title = _decode(match.group(2)) if match.group(2) is not None else None
+            test = CompactTest(name, title, module_pairs + class_pairs, [])
+            classes[-1].tests.append(test)
+            continue
+        match = _STEP_RE.match(line)
+        if match:
+            if test is None:
+                raise CompactFormError(f"строка {number}: шаг вне теста")
+            test.steps.append(_decode(match.group(1)))
+            continue
+        match = _META_RE.match(line)
+        if not match or (match.group(2) is None and match.group(1) != "manual"):
+            raise CompactFormError(f"строка {number}: не разобрана: {line[:80]}")
+        key, value = match.group(1), _decode(match.group(2))
+        if key == "mark" and not _IDENTIFIER_RE.match(value):
+            raise CompactFormError(f"строка {number}: марка pytest должна быть именем: {value[:80]}")
+        if key == "link" and not value.split(" ", 1)[0]:
+            raise CompactFormError(f"строка {number}: пустая ссылка")
+        if key == "title" and test is not None:
+            test.title = value
+        elif test is not None:
+            test.pairs.append((key, value))
+        elif classes:
+            class_pairs.append((key, value))
+        else:
+            module_pairs.append((key, value))
+    if not any(compact_class.tests for compact_class in classes):
+        raise CompactFormError("нет ни одного теста")
+    return [compact_class for compact_class in classes if compact_class.tests]
+
+
+# ---------------------------------------------------------------------------
+# Компактная форма -> код
+# ---------------------------------------------------------------------------
+
+def _literal(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _decorator(pair: Pair) -> str:
+    key, value = pair
+    if key == "manual":
+        return "@allure.manual"
+    if key == "mark":
+        return f"@mark.{value}"
+    if key == "title":
+        return f"@allure.title({_literal(value)})"
+    if key == "link":
+        url, _, name = value.partition(" ")
+        return f"@allure.link({_literal(url)}, name={_literal(name)})" if name else f"@allure.link({_literal(url)})"
+    if key in SHORT_LABELS:
+        return f"@allure.{key}({_literal(value)})"
+    return f"@allure.label({_literal(key)}, {_literal(value)})"
+
+
+def _ordered(pairs: Iterable[Pair]) -> List[Pair]:
+    """manual первым, метки Allure в привычном порядке, марки pytest последними"""
+    return sorted(pairs, key=lambda pair: (pair[0] == "mark", _DECORATOR_ORDER.get(pair[0], len(_DECORATOR_ORDER))))
+
+
+def _bound_names(header: str) -> set:
+    names = set()
+    try:
+        tree = ast.parse(header)
+    except SyntaxError:
+        return names
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.FunctionDef):
+            names.add(node.name)
+    return names
+
+
+def _complete_header(header: str, uses_mark: bool) -> str:
+    """Исходная шапка с недостающими импортами allure, mark и хелпером allure_step"""
+    bound = _bound_names(header)
+    imports = []
+    if "allure" not in bound:
+        imports.append("import allure")
+    if uses_mark and "mark" not in bound:
+        imports.append("from pytest import mark")
+    helper = ""
+    if "allure_step" not in bound:
+        if "contextmanager" not in bound:
+            imports.append("from contextlib import contextmanager")
+        helper = ('@contextmanager\ndef allure_step(step_name: str):\n    """Контекстный менеджер для шагов Allure"""\n'
+                  "    with allure.step(step_name):\n        yield")
+    return "\n\n\n".join(part for part in ("\n".join(imports), header.strip("\n"), helper) if part)
+
+
+def _class_lines(compact_class: CompactClass) -> List[str]:
+    """Код класса: общие метаданные тестов на классе, собственные — на методах"""
+    class_pairs = _shared([test.pairs for test in compact_class.tests])
+    shared = set(class_pairs)
+    lines = [_decorator(pair) for pair in _ordered(class_pairs)]
+    lines.append(f"class {compact_class.name}:")
+    for test in compact_class.tests:
+        own = [pair for pair in test.pairs if pair not in shared]
+        if test.title is not None:
+            own.append(("title", test.title))
+        lines.append("")
+        lines.extend("    " + _decorator(pair) for pair in _ordered(own))
+        lines.append(f"    def {test.name}(self) -> None:")
+        for step in test.steps:
+            lines += [f"        with allure_step({_literal(step)}):", "            pass"]
+        if not test.steps:
+            lines.append("        pass")
+    return lines
+
+
+def rehydrate(header: str, classes: List[CompactClass]) -> str:
+    """Код модуля: шапка с недостающими импортами, затем классы"""
+    lines: List[str] = []
+    for compact_class in classes:
+        lines += ["", ""] + _class_lines(compact_class)
+    uses_mark = any(key == "mark" for compact_class in classes for test in compact_class.tests for key, _ in test.pairs)
+    return _complete_header(header, uses_mark) + "\n" + "\n".join(lines) + "\n"
+
+
+def is_compact_form(text: str) -> bool:
+    """Ответ модели — компактная форма хотя бы с одним тестом"""
+    try:
+        parse_compact(text)
+    except CompactFormError:
+        return False
+    return True
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""Сжатие ответов (zstd/br/gzip) и распаковка сжатых тел запросов"""
+import os
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+# brotli и zstandard — необязательные зависимости: без них используется только gzip
+try:
+    import brotli
+except ImportError:  # pragma: no cover - зависит от окружения
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - зависит от окружения
+    zstandard = None
+
+# Ответы меньше этого размера не сжимаются — накладные расходы больше выигрыша
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Максимальный размер тела запроса после распаковки (защита от zip-бомб)
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", str(200 * 1024 * 1024)))
+
+# Сколько байт сжатого тела brotli подается распаковщику за раз (размер проверяется после каждой порции).
+# brotli до 1.2 не ограничивает вывод вызова, а одна команда копирования разворачивается в мегабайты,
+# поэтому ему вход подается по 16 байт: превышение лимита до проверки — не больше ~16 MB
+_BROTLI_INPUT_CHUNK = 64 * 1024
+_BROTLI_LEGACY_INPUT_CHUNK = 16
+# То же для zstd: блок до 128 KB кодируется несколькими байтами (RLE), вывод вызова ограничен порцией входа
+_ZSTD_INPUT_CHUNK = 256
+
+# Типы содержимого, которые уже сжаты и повторно не сжимаются
+_ALREADY_COMPRESSED_TYPES = (b"application/zip", b"application/gzip", b"image/", b"video/", b"audio/")
+
+
+class DecompressionError(ValueError):
+    """Тело запроса не удалось распаковать"""
+
+
+class BodyTooLargeError(ValueError):
+    """Распакованное тело запроса превышает допустимый размер"""
+
+
+def available_encodings() -> List[str]:
+    """Поддерживаемые кодировки в порядке предпочтения"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбирает лучшую кодировку из заголовка Accept-Encoding клиента"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip())
+    for encoding in available_encodings():
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+class _StreamCompressor:
+    """Единый интерфейс compress/flush для потокового сжатия разными алгоритмами"""
+
+    def __init__(self, encoding: str):
+        if encoding == "gzip":
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self._compress: Callable[[bytes], bytes] = compressor.compress
+            self._finish: Callable[[], bytes] = compressor.flush
+        elif encoding == "br":
+            compressor = brotli.Compressor(quality=5)
+            self._compress = compressor.process
+            self._finish = compressor.finish
+        elif encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=3).compressobj()
+            self._compress = compressor.compress
+            self._finish = compressor.flush
+        else:
+            raise ValueError(f"Неподдерживаемая кодировка: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    """Сжимает данные целиком указанным алгоритмом"""
+    compressor = _StreamCompressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def _brotli_decompress(body: bytes, max_size: int) -> bytes:
+    """Потоковая распаковка brotli: вход подается порциями, распакованный размер проверяется по ходу.
+
+    brotli 1.2+ ограничивает вывод одного вызова (output_buffer_limit), поэтому бомба не распаковывается
+    дальше max_size + 1 байт; в более старых версиях вывод ограничен маленькой порцией входа.
+    """
+    decompressor = brotli.Decompressor()
+    limited = hasattr(decompressor, "can_accept_more_data")
+    chunk = _BROTLI_INPUT_CHUNK if limited else _BROTLI_LEGACY_INPUT_CHUNK
+    parts: List[bytes] = []
+    size = 0
+    for start in range(0, len(body), chunk):
+        data = body[start:start + chunk]
+        while True:
+            if limited:
+                part = decompressor.process(data, output_buffer_limit=max_size - size + 1)
+            else:
+                part = decompressor.process(data)
+            size += len(part)
+            if size > max_size:
+                raise BodyTooLargeError(f"Распакованное тело запроса превышает {max_size} байт")
+            parts.append(part)
+            data = b""
+            # Остаток вывода, не уместившийся в лимит вызова, забирается до подачи следующей порции
+            if not limited or decompressor.is_finished() or decompressor.can_accept_more_data():
+                break
+    if not decompressor.is_finished():
+        raise DecompressionError("Не удалось распаковать тело запроса (br): поток обрезан")
+    return b"".join(parts)
+
+
+def _zstd_decompress(body: bytes, max_size: int) -> bytes:
+    """Потоковая распаковка zstd с проверкой размера по ходу.
+
+    ZstdDecompressor.decompress выделяет буфер по размеру из заголовка кадра и не соблюдает
+    max_output_size, а кадр без размера при превышении дает ZstdError (400 вместо 413).
+    """
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    parts: List[bytes] = []
+    size = 0
+    for start in range(0, len(body), _ZSTD_INPUT_CHUNK):
+        part = decompressor.decompress(body[start:start + _ZSTD_INPUT_CHUNK])
+        size += len(part)
+        if size > max_size:
+            raise BodyTooLargeError(f"Распакованное тело запроса превышает {max_size} байт")
+        parts.append(part)
+    if not decompressor.eof:
+        raise DecompressionError("Не удалось распаковать тело запроса (zstd): поток обрезан")
+    return b"".join(parts)
+
+
+def decompress_body(body: bytes, content_encoding: str, max_size: int = MAX_DECOMPRESSED_BODY) -> bytes:
+    """Распаковывает тело запроса по заголовку Content-Encoding с ограничением размера"""
+    encoding = (content_encoding or "").strip().lower()
+    if not encoding or encoding == "identity":
+        return body
+    try:
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            wbits = 47 if encoding != "deflate" else 15  # 47 = автоопределение gzip/zlib заголовка
+            decompressor = zlib.decompressobj(wbits)
+            result = decompressor.decompress(body, max_size + 1)
+            if len(result) > max_size or decompressor.unconsumed_tail:
+                raise BodyTooLargeError(f"Распакованное тело запроса превышает {max_size} байт")
+            tail = decompressor.flush()
+            if tail:
+                result += tail
+        elif encoding == "br" and brotli is not None:
+            result = _brotli_decompress(body, max_size)
+        elif encoding == "zstd" and zstandard is not None:
+            result = _zstd_decompress(body, max_size)
+        else:
+            raise DecompressionError(f"Неподдерживаемый Content-Encoding: {encoding}")
+    except (DecompressionError, BodyTooLargeError):
+        raise
+    except Exception as e:
+        # brotli.error / zstandard.ZstdError не наследуются от общего базового класса
+        raise DecompressionError(f"Не удалось распаковать тело запроса ({encoding}): {e}") from e
+    if len(result) > max_size:
+        raise BodyTooLargeError(f"Распакованное тело запроса превышает {max_size} байт")
+    return result
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _add_vary_accept_encoding(headers: List[Tuple[bytes, bytes]]) -> None:
+    """Добавляет Accept-Encoding в Vary, дописывая в уже выставленный заголовок, а не дублируя его"""
+    for index, (key, value) in enumerate(headers):
+        if key.lower() != b"vary":
+            continue
+        tokens = [token.strip().lower() for token in value.split(b",")]
+        if b"*" not in tokens and b"accept-encoding" not in tokens:
+            headers[index] = (key, value + b", Accept-Encoding")
+        return
+    headers.append((b"vary", b"Accept-Encoding"))
+
+
+class CompressionMiddleware:
+    """ASGI middleware сжатия ответов: zstd/br (если установлены) или gzip.
+
+    Ответы меньше COMPRESSION_MIN_SIZE и уже сжатые типы содержимого отдаются как есть.
+    Потоковые ответы сжимаются по частям без буферизации всего тела.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers: Dict[bytes, bytes] = dict(scope.get("headers", []))
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[dict] = None
+        compressor: Optional[_StreamCompressor] = None
+        passthrough = False
+        # Начало тела копится, пока не станет ясно, достигает ли ответ порога сжатия
+        pending = b""
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough, pending
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = message.get("headers", [])
+                content_type = _header(headers, b"content-type") or b""
+                if _header(headers, b"content-encoding") is not None or content_type.startswith(_ALREADY_COMPRESSED_TYPES):
+                    passthrough = True
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                pending += message.get("body", b"")
+                if more_body and len(pending) < self.minimum_size:
+                    return
+                if not more_body and len(pending) < self.minimum_size:
+                    # Маленький ответ целиком — отдаем без сжатия
+                    passthrough = True
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": pending})
+                    return
+                headers = [(k, v) for k, v in start_message.get("headers", []) if k.lower() != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                _add_vary_accept_encoding(headers)
+                compressor = _StreamCompressor(encoding)
+                body, pending = pending, b""
+                if not more_body:
+                    compressed = compressor.compress(body) + compressor.finish()
+                    headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+                    start_message["headers"] = headers
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                start_message["headers"] = headers
+                await send(start_message)
+            else:
+                body = message.get("body", b"")
+
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.finish()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
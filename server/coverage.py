@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Матрица покрытия OpenAPI спецификации тестами (режим Lime).
+
+Для каждой операции ячейки строятся по трем измерениям: документированные коды ответа
+(status:404), обязательные параметры и тело запроса (param:limit, param:body) и варианты
+авторизации (auth:<схема> и auth:none для запроса без учетных данных). Сгенерированный модуль
+разбирается ast, тесты сопоставляются с операциями (см. openapi_diff.iter_tests) и с ячейками:
+по явной метке @allure.label("coverage", "<ячейка>") или по проверкам и тексту шагов теста.
+"""
+import ast
+import re
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+from openapi_diff import deref, iter_operations, iter_tests, operation_key, operation_parameters
+
+# Метка, которой тест явно помечает покрываемые ячейки: @allure.label("coverage", "status:404")
+COVERAGE_LABEL = "coverage"
+_COVERAGE_LABEL_RE = re.compile(r'@allure\.label\(\s*["\']coverage["\']\s*,\s*["\']([^"\']+)["\']\s*\)')
+# Код ответа в тексте шага: "Assert: статус 404", "ответ 201 Created", "status code 400"
+_STATUS_TEXT_RE = re.compile(r"(?:статус|status|код|code|ответ|response)\D{0,20}([1-5]\d\d)\b", re.IGNORECASE)
+_STATUS_ATTRS = ("status_code", "status")
+
+
+def _security_schemes(spec: Dict[str, Any], operation: Dict[str, Any]) -> List[str]:
+    """Имена схем авторизации операции (security операции приоритетнее глобального)"""
+    security = operation.get("security", spec.get("security"))
+    names: List[str] = []
+    for requirement in security or []:
+        if isinstance(requirement, dict):
+            names.extend(name for name in requirement if name not in names)
+    return names
+
+
+def _credential_markers(spec: Dict[str, Any], scheme: str) -> List[str]:
+    """Строки, по которым в тесте видно использование схемы: имя заголовка, Bearer и т. п."""
+    definition = ((spec.get("components") or {}).get("securitySchemes") or {}).get(scheme)
+    if not isinstance(definition, dict):
+        return [scheme]
+    if definition.get("type") == "apiKey" and definition.get("name"):
+        return [str(definition["name"]), scheme]
+    if definition.get("type") == "http" and str(definition.get("scheme", "")).lower() == "basic":
+        return ["Authorization", "Basic", "auth=", scheme]
+    return ["Authorization", "Bearer", scheme]
+
+
+class OperationCoverage:
+    """Ячейки одной операции и тесты, которые их покрывают"""
+
+    __slots__ = ("key", "cells", "markers", "param_names", "tests")
+
+    def __init__(self, key: str):
+        self.key = key
+        # ячейка → имена покрывающих тестов; у непокрытой ячейки общий пустой кортеж, список заводится
+        # при первом тесте (операций в большой спецификации десятки тысяч, пустые списки заметны в памяти)
+        self.cells: Dict[str, Sequence[str]] = {}
+        self.markers: Dict[str, List[str]] = {}
+        self.param_names: Dict[str, str] = {}
+        self.tests = 0
+
+    def cover(self, cell: str, test_name: str) -> None:
+        tests = self.cells[cell]
+        if not isinstance(tests, list):
+            tests = self.cells[cell] = []
+        tests.append(test_name)
+
+    def uncovered(self) -> List[str]:
+        return [cell for cell, tests in self.cells.items() if not tests]
+
+
+class CoverageMatrix:
+    """Матрица операции × (коды ответа, обязательные параметры, варианты авторизации)"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.operations: Dict[str, OperationCoverage] = {}
+        self.unmapped_tests = 0
+        for method, path, operation, shared_params in iter_operations(spec):
+            # Нужны только поля верхнего уровня: ссылки раскрываются по месту, без копии схем операции
+            # (resolved_operation на каждой операции большой спецификации поднимал пик памяти /lime)
+            entry = OperationCoverage(operation_key(method, path))
+            for status in (deref(operation.get("responses"), spec) or {}):
+                if str(status).lower() != "default":
+                    entry.cells[sys.intern(f"status:{status}")] = ()
+            for param in operation_parameters(spec, operation, shared_params):
+                if param.get("required") and param.get("name"):
+                    cell = sys.intern(f"param:{param['name']}")
+                    entry.cells[cell] = ()
+                    entry.param_names[cell] = str(param["name"])
+            body = deref(operation.get("requestBody"), spec)
+            if isinstance(body, dict) and body.get("required"):
+                entry.cells["param:body"] = ()
+            schemes = _security_schemes(spec, operation)
+            for scheme in schemes:
+                entry.cells[sys.intern(f"auth:{scheme}")] = ()
+                entry.markers[f"auth:{scheme}"] = _credential_markers(spec, scheme)
+            if schemes:
+                entry.cells["auth:none"] = ()
+            self.operations[entry.key] = entry
+
+    def apply(self, code: str) -> "CoverageMatrix":
+        """Отмечает ячейки, покрытые тестами модуля; SyntaxError пробрасывается"""
+        for node, source, key in iter_tests(code, set(self.operations)):
+            entry = self.operations.get(key) if key is not None else None
+            if entry is None:
+                self.unmapped_tests += 1
+                continue
+            entry.tests += 1
+            for cell in self._cells_of(entry, node, source):
+                entry.cover(cell, node.name)
+        return self
+
+    def _cells_of(self, entry: OperationCoverage, node: ast.AST, source: str) -> Set[str]:
+        labelled = {cell for cell in _COVERAGE_LABEL_RE.findall(source) if cell in entry.cells}
+        statuses = _asserted_statuses(node) | {int(code) for code in _STATUS_TEXT_RE.findall(_string_text(node))}
+        cells = set(labelled)
+        for cell in entry.cells:
+            kind, _, value = cell.partition(":")
+            if kind == "status" and _status_matches(value, statuses):
+                cells.add(cell)
+        negative = any(400 <= status < 500 for status in statuses)
+        success = any(200 <= status < 300 for status in statuses)
+        auth_cells = [cell for cell in entry.cells if cell.startswith("auth:") and cell != "auth:none"]
+        # Путь операции не считается упоминанием параметра: в нем есть {id} у любого теста операции
+        text = source.replace(entry.key.split(" ", 1)[1], "")
+        for cell, name in entry.param_names.items():
+            # Обязательный параметр проверен, если тест ждет ошибку клиента и упоминает параметр
+            if negative and re.search(rf"\b{re.escape(name)}\b", text):
+                cells.add(cell)
+        if "param:body" in entry.cells and negative and re.search(r"\b(json|data|body|тел[оа])\b", text, re.IGNORECASE):
+            cells.add("param:body")
+        if "auth:none" in entry.cells and statuses & {401, 403}:
+            cells.add("auth:none")
+        for cell in auth_cells:
+            if success and (len(auth_cells) == 1 or any(marker in source for marker in entry.markers[cell])):
+                cells.add(cell)
+        return cells
+
+    def uncovered(self) -> Dict[str, List[str]]:
+        """{операция: непокрытые ячейки} только для операций с пробелами"""
+        return {key: cells for key, entry in self.operations.items() if (cells := entry.uncovered())}
+
+    def summary(self) -> Dict[str, Any]:
+        """Матрица для ответа API: итоги и ячейки каждой операции с покрывающими тестами"""
+        total = sum(len(entry.cells) for entry in self.operations.values())
+        covered = sum(1 for entry in self.operations.values() for tests in entry.cells.values() if tests)
+        return {
+            "cells_total": total,
+            "cells_covered": covered,
+            "ratio": round(covered / total, 4) if total else 1.0,
+            "unmapped_tests": self.unmapped_tests,
+            "operations": {
+                key: {
+                    "tests": entry.tests,
+                    "cells": {cell: sorted(set(tests)) for cell, tests in entry.cells.items()},
+                }
+                for key, entry in self.operations.items()
+            },
+        }
+
+
+def _status_matches(value: str, statuses: Iterable[int]) -> bool:
+    if value.isdigit():
+        return int(value) in statuses
+    # Диапазоны вида 4XX
+    if len(value) == 3 and value[0].isdigit() and value[1:].upper() == "XX":
+        return any(status // 100 == int(value[0]) for status in statuses)
+    return False
+
+
+def _asserted_statuses(node: ast.AST) -> Set[int]:
+    """Коды из сравнений с response.status_code (==, !=, in [...])"""
+    statuses: Set[int] = set()
+    for compare in ast.walk(node):
+        if not isinstance(compare, ast.Compare):
+            continue
+        operands = [compare.left] + list(compare.comparators)
+        if not any(isinstance(operand, ast.Attribute) and operand.attr in _STATUS_ATTRS for operand in operands):
+            continue
+        for operand in operands:
+            values = operand.elts if isinstance(operand, (ast.List, ast.Tuple, ast.Set)) else [operand]
+            for value in values:
+                if isinstance(value, ast.Constant) and isinstance(value.value, int) and 100 <= value.value < 600:
+                    statuses.add(value.value)
+    return statuses
+
+
+def _string_text(node: ast.AST) -> str:
+    """Строковые константы теста (заголовок, шаги) одной строкой"""
+    return "\n".join(const.value for const in ast.walk(node)
+                     if isinstance(const, ast.Constant) and isinstance(const.value, str))
+
+
+def coverage_for(spec: Dict[str, Any], code: str) -> Optional[Dict[str, Any]]:
+    """Сводка покрытия модуля; None, если модуль не разбирается"""
+    try:
+        return CoverageMatrix(spec).apply(code).summary()
+    except SyntaxError:
+        return None
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Экспорт большого модуля тестов в zip-архив: один модуль на feature или тег и manifest.json.
+
+Архив отдается потоком: файлы собираются и проверяются параллельно небольшими окнами,
+а в памяти одновременно находятся только файлы текущего окна и буфер сжатия.
+"""
+import ast
+import asyncio
+import json
+import os
+import re
+import time
+import zipfile
+from array import array
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from chunking import iter_statement_lines
+from code_repair import check_code
+
+# Сколько файлов архива собирается и проверяется одновременно
+EXPORT_PARALLEL = int(os.getenv("EXPORT_PARALLEL", "4"))
+
+_UNGROUPED = "common"
+_TRANSLIT = dict(zip(
+    "абвгдеёжзийклмнопрстуфхцчшщъыьэюя",
+    ["a", "b", "v", "g", "d", "e", "e", "zh", "z", "i", "y", "k", "l", "m", "n", "o", "p", "r", "s", "t",
+     "u", "f", "kh", "ts", "ch", "sh", "shch", "", "y", "", "e", "yu", "ya"],
+))
+_NON_IDENTIFIER_RE = re.compile(r"[^a-z0-9]+")
+
+
+class ExportPlan:
+    """Разметка модуля для экспорта: общая шапка и диапазоны строк тестов по группам.
+
+    Тексты тестов не копируются — хранятся только номера строк исходного модуля.
+    """
+
+    def __init__(self, code: str, group_by: str):
+        self.code = code
+        self.group_by = group_by
+        self.import_ranges: List[Tuple[int, int]] = []
+        self.helper_ranges: List[Tuple[int, int]] = []
+        self.groups: "OrderedDict[str, List[Tuple[int, int]]]" = OrderedDict()
+        self.tests: Dict[str, int] = {}
+        self._header: Optional[str] = None
+        # Смещение начала каждой строки в символах
+        self._line_starts = array("q", [0])
+        self._line_starts.extend(match.end() for match in re.finditer("\n", code))
+
+    def lines(self, start: int, end: int) -> str:
+        begin = self._line_starts[start - 1]
+        finish = self._line_starts[end] if end < len(self._line_starts) else len(self.code)
+        return self.code[begin:finish].rstrip("\n")
+
+    def header(self) -> str:
+        """Импорты и хелперы — общая шапка каждого файла"""
+        if self._header is not None:
+            return self._header
+        parts = ["\n".join(self.lines(start, end) for start, end in self.import_ranges)] if self.import_ranges else []
+        parts.extend(self.lines(start, end) for start, end in self.helper_ranges)
+        self._header = "\n\n\n".join(parts)
+        return self._header
+
+    def render(self, group: str) -> str:
+        header = self.header()
+        parts = [header] if header else []
+        parts.extend(self.lines(start, end) for start, end in self.groups[group])
+        return "\n\n\n".join(parts) + "\n"
+
+
+def _decorator_value(node: ast.AST, name: str) -> Optional[str]:
+    """Первый строковый аргумент декоратора @allure.<name>(...) узла или его методов"""
+    candidates = [node] + [child for child in getattr(node, "body", []) if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    for candidate in candidates:
+        for decorator in getattr(candidate, "decorator_list", []):
+            if (isinstance(decorator, ast.Call) and isinstance(decorator.func, ast.Attribute)
+                    and decorator.func.attr == name and decorator.args
+                    and isinstance(decorator.args[0], ast.Constant) and isinstance(decorator.args[0].value, str)):
+                return decorator.args[0].value
+    return None
+
+
+def _count_tests(node: ast.stmt) -> int:
+    if isinstance(node, ast.ClassDef):
+        return sum(1 for child in node.body
+                   if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) and child.name.startswith("test"))
+    return 1
+
+
+def plan_export(code: str, group_by: str = "feature") -> ExportPlan:
+    """Разбирает модуль (кусками, см. chunking) и распределяет тесты по группам; SyntaxError пробрасывается"""
+    plan = ExportPlan(code, group_by)
+    seen_header = set()
+    for node, start, end in iter_statement_lines(code):
+        is_test = (isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test")) or (
+            isinstance(node, ast.ClassDef) and _count_tests(node) > 0)
+        if not is_test:
+            if start == 1 and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant):
+                continue  # docstring модуля
+            # Импорты и хелперы попадают в каждый файл; повторы (после склейки модулей) пропускаются
+            key = " ".join(plan.lines(start, end).split())
+            if key not in seen_header:
+                seen_header.add(key)
+                ranges = plan.import_ranges if isinstance(node, (ast.Import, ast.ImportFrom)) else plan.helper_ranges
+                ranges.append((start, end))
+            continue
+        group = _decorator_value(node, group_by) or _UNGROUPED
+        plan.groups.setdefault(group, []).append((start, end))
+        plan.tests[group] = plan.tests.get(group, 0) + _count_tests(node)
+    return plan
+
+
+def module_filename(group: str, used: set) -> str:
+    """Имя модуля pytest для группы: test_<транслит>.py, уникальное в пределах архива"""
+    slug = "".join(_TRANSLIT.get(char, char) for char in group.lower())
+    slug = _NON_IDENTIFIER_RE.sub("_", slug).strip("_")[:60] or "group"
+    name = f"test_{slug}.py"
+    suffix = 2
+    while name in used:
+        name = f"test_{slug}_{suffix}.py"
+        suffix += 1
+    used.add(name)
+    return name
+
+
+class _ChunkWriter:
+    """Файлоподобный приемник для ZipFile: накапливает записанные байты до следующей выдачи"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _render_file(plan: ExportPlan, group: str) -> Tuple[bytes, Optional[str]]:
+    source = plan.render(group)
+    error = check_code(source)
+    return source.encode("utf-8"), None if error is None else f"{error.msg} (строка {error.lineno})"
+
+
+async def stream_export(plan: ExportPlan, source_id: Optional[str] = None,
+                        parallel: int = EXPORT_PARALLEL) -> AsyncIterator[bytes]:
+    """Отдает zip-архив по частям: модули групп в порядке появления и manifest.json в конце"""
+    writer = _ChunkWriter()
+    archive = zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+    used: set = set()
+    manifest_files = []
+    groups = list(plan.groups)
+    for offset in range(0, len(groups), parallel):
+        window = groups[offset:offset + parallel]
+        rendered = await asyncio.gather(*(asyncio.to_thread(_render_file, plan, group) for group in window))
+        for group, (data, error) in zip(window, rendered):
+            name = module_filename(group, used)
+            archive.writestr(name, data)
+            manifest_files.append({
+                "path": name,
+                plan.group_by: group,
+                "tests": plan.tests[group],
+                "bytes": len(data),
+                "valid": error is None,
+                "error": error,
+            })
+            yield writer.drain()
+        del rendered
+    manifest = {
+        "source_id": source_id,
+        "group_by": plan.group_by,
+        "files": manifest_files,
+        "tests_total": sum(plan.tests.values()),
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    archive.close()
+    yield writer.drain()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Проверки живости и готовности: кешируемая проба upstream модели и счетчик запросов в обработке.
+
+Живость (/health/live) не зависит от upstream. Готовность (/health/ready) учитывает доступность
+и задержку upstream и текущую нагрузку, чтобы оркестратор и прокси направляли трафик только
+на экземпляры, которые обслужат его быстро. Проба upstream выполняется не чаще раза в
+READINESS_PROBE_TTL секунд, сколько бы проверок ни пришло; одновременные проверки ждут одну пробу.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import openai
+
+# Сколько секунд результат пробы upstream считается актуальным (он же минимальный интервал между пробами)
+READINESS_PROBE_TTL = float(os.getenv("READINESS_PROBE_TTL", "15"))
+# Таймаут одной пробы, секунд
+READINESS_PROBE_TIMEOUT = float(os.getenv("READINESS_PROBE_TIMEOUT", "5"))
+# Задержка пробы, при превышении которой экземпляр не готов, мс (0 — не проверять)
+READINESS_MAX_LATENCY_MS = float(os.getenv("READINESS_MAX_LATENCY_MS", "3000"))
+# Число запросов в обработке, начиная с которого экземпляр не готов (0 — без ограничения)
+READINESS_MAX_INFLIGHT = int(os.getenv("READINESS_MAX_INFLIGHT", "80"))
+# Сколько соединений с upstream открывается при старте сервера
+READINESS_WARM_CONNECTIONS = int(os.getenv("READINESS_WARM_CONNECTIONS", "2"))
+# Период замера задержки цикла событий, секунд
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.25"))
+
+# Сколько последних замеров задержки цикла событий учитывается в сводке
+_LAG_WINDOW = 240
+
+
+class InFlightCounter:
+    """Число HTTP-запросов в обработке (проверки здоровья не учитываются) и открытых WebSocket-сессий.
+
+    Сессия держит соединение, пока открыта вкладка, и большую часть времени простаивает, поэтому в
+    нагрузку (current) не входит: ее вызовы модели видны в очереди планировщика.
+    """
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self.websockets = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"in_flight": self.current, "peak": self.peak, "websockets": self.websockets}
+
+
+in_flight = InFlightCounter()
+
+
+class InFlightMiddleware:
+    """ASGI middleware: учитывает HTTP-запрос в in_flight на все время обработки, включая потоковый ответ"""
+
+    def __init__(self, app, counter: InFlightCounter = in_flight):
+        self.app = app
+        self.counter = counter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            self.counter.websockets += 1
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.counter.websockets -= 1
+            return
+        if scope["type"] != "http" or scope.get("path", "").startswith("/health"):
+            await self.app(scope, receive, send)
+            return
+        self.counter.current += 1
+        self.counter.peak = max(self.counter.peak, self.counter.current)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.counter.current -= 1
+
+
+class EventLoopLag:
+    """Задержка цикла событий: насколько позже срока просыпается задача, спящая interval секунд.
+
+    Рост задержки означает, что обработчики занимают цикл синхронной работой (разбор, сериализация)
+    и все остальные запросы, включая потоковые ответы, ждут.
+    """
+
+    def __init__(self, interval: float = EVENT_LOOP_LAG_INTERVAL, window: int = _LAG_WINDOW):
+        self.interval = interval
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.max_ms = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - scheduled) * 1000)
+            self._samples.append(lag_ms)
+            self.max_ms = max(self.max_ms, lag_ms)
+
+    def snapshot(self) -> Dict[str, float]:
+        samples = sorted(self._samples)
+        return {
+            "lag_ms": round(self._samples[-1], 1) if self._samples else 0.0,
+            "lag_p99_ms": round(samples[int(len(samples) * 0.99)], 1) if samples else 0.0,
+            "lag_max_ms": round(self.max_ms, 1),
+        }
+
+
+event_loop_lag = EventLoopLag()
+
+
+class UpstreamProbe:
+    """Кешируемая проба upstream (GET /models) с записью задержки.
+
+    Ответ upstream с кодом, отличным от 401/403/5xx (например, 404 у провайдера без /models),
+    означает, что upstream доступен; ошибка соединения, таймаут и 401/403/5xx — что нет.
+    """
+
+    def __init__(self, request: Callable[[], Awaitable[Any]], ttl: float = READINESS_PROBE_TTL):
+        self.request = request
+        self.ttl = ttl
+        self.ok = False
+        self.latency_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.probes = 0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self.checked_at is not None and time.monotonic() - self.checked_at < self.ttl
+
+    async def _probe_once(self) -> None:
+        started = time.perf_counter()
+        try:
+            await self.request()
+            ok, error = True, None
+        except openai.APIStatusError as e:
+            ok = e.status_code not in (401, 403) and e.status_code < 500
+            error = None if ok else f"HTTP {e.status_code}"
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"[:200]
+        self.latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.ok, self.error = ok, error
+        self.checked_at = time.monotonic()
+        self.probes += 1
+
+    async def check(self, force: bool = False) -> Dict[str, Any]:
+        """Результат пробы; upstream опрашивается, только если кешированный результат устарел"""
+        if force or not self._fresh():
+            async with self._lock:
+                # Пока ждали блокировку, пробу могла выполнить другая проверка
+                if force or not self._fresh():
+                    await self._probe_once()
+        return self.snapshot()
+
+    async def warm_up(self, connections: int = READINESS_WARM_CONNECTIONS) -> Dict[str, Any]:
+        """Открывает connections соединений с upstream (TLS, keep-alive) параллельными пробами"""
+        async with self._lock:
+            await asyncio.gather(*(self._probe_once() for _ in range(max(connections, 1))))
+        return self.snapshot()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ok": self.ok,
+            "latency_ms": self.latency_ms,
+            "error": self.error,
+            "age_s": None if self.checked_at is None else round(time.monotonic() - self.checked_at, 1),
+        }
+
+
+def readiness(upstream: Dict[str, Any], queued: int = 0, counter: InFlightCounter = in_flight,
+              lag: EventLoopLag = event_loop_lag) -> Dict[str, Any]:
+    """Сводка готовности: ready и причины неготовности; queued — вызовы модели в очереди планировщика"""
+    reasons = []
+    if not upstream["ok"]:
+        reasons.append(f"upstream недоступен: {upstream['error']}")
+    elif READINESS_MAX_LATENCY_MS and upstream["latency_ms"] > READINESS_MAX_LATENCY_MS:
+        reasons.append(f"задержка upstream {upstream['latency_ms']} мс > {READINESS_MAX_LATENCY_MS:g} мс")
+    if READINESS_MAX_INFLIGHT and counter.current >= READINESS_MAX_INFLIGHT:
+        reasons.append(f"нагрузка {counter.current} запросов >= {READINESS_MAX_INFLIGHT}")
+    return {
+        "status": "ready" if not reasons else "not_ready",
+        "reasons": reasons,
+        "upstream": upstream,
+        "load": dict(counter.snapshot(), max_in_flight=READINESS_MAX_INFLIGHT, queued=queued, event_loop=lag.snapshot()),
+    }
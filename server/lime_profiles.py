@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Профили вывода Lime: как сгенерированные тесты обращаются к API.
+
+default — прежний вывод: каждый тест вызывает requests.get/post напрямую с полным URL.
+xdist — тесты получают фикстуру api из conftest.py: requests.Session уровня сессии pytest с пулом
+соединений, базовым URL и авторизацией из окружения. Под pytest-xdist фикстура создается один раз
+на воркер, поэтому соединения (TCP и TLS) переиспользуются всеми тестами воркера. Классы с
+изменяющими операциями помечаются xdist_group и при --dist loadgroup выполняются в одном воркере;
+читающие тесты распределяются по воркерам свободно.
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+# Профиль по умолчанию для запросов /lime без поля profile
+LIME_OUTPUT_PROFILE = os.getenv("LIME_OUTPUT_PROFILE", "default")
+
+LIME_PROFILES = ("default", "xdist")
+MUTATING_METHODS = ("post", "put", "patch", "delete")
+CONFTEST_NAME = "conftest.py"
+
+# Дополнение промпта генерации (добавляется к сообщению пользователя, системный промпт не меняется)
+XDIST_INSTRUCTIONS = '''Тесты выполняются параллельно через pytest-xdist. Не импортируй requests и не создавай
+соединения в тестах: принимай фикстуру api из conftest.py (requests.Session с пулом соединений, базовым URL
+и авторизацией) и указывай относительные пути — api.get("/users/1"), api.post("/users", json={...}).
+Для запроса без учетных данных используй фикстуру anonymous_api. Тесты не должны зависеть друг от друга
+и от порядка выполнения; класс с тестами, изменяющими данные (POST, PUT, PATCH, DELETE), помечай
+@pytest.mark.xdist_group(name="<тег класса>") и импортируй pytest.'''
+
+_CONFTEST_HEADER = '''"""Фикстуры сгенерированных тестов API: один пул соединений на процесс pytest (воркер xdist).
+
+Запуск: pytest -n auto --dist loadgroup
+Окружение: API_BASE_URL, API_TOKEN (для Basic — "логин:пароль"), API_TIMEOUT, API_POOL_SIZE.
+"""
+import os
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = os.getenv("API_BASE_URL", {base_url!r})
+API_TOKEN = os.getenv("API_TOKEN", "")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "30"))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "16"))
+
+
+class ApiSession(requests.Session):
+    """Session с базовым URL, таймаутом по умолчанию и пулом соединений на хост"""
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=API_POOL_SIZE)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", API_TIMEOUT)
+        if not url.startswith(("http://", "https://")):
+            url = self.base_url + url
+        return super().request(method, url, *args, **kwargs)
+
+
+def _authorize(session: ApiSession) -> None:
+{auth}
+
+
+@pytest.fixture(scope="session")
+def api():
+    """Авторизованная сессия, общая для всех тестов процесса"""
+    with ApiSession(API_BASE_URL) as session:
+        if API_TOKEN:
+            _authorize(session)
+        yield session
+
+
+@pytest.fixture(scope="session")
+def anonymous_api():
+    """Сессия без учетных данных (проверки 401/403)"""
+    with ApiSession(API_BASE_URL) as session:
+        yield session
+'''
+
+
+def _auth_lines(spec: Dict[str, Any]) -> List[str]:
+    """Код авторизации сессии по первой схеме из security спецификации (или ее операций)"""
+    schemes = (spec.get("components") or {}).get("securitySchemes") or {}
+    names: List[str] = []
+    requirements = list(spec.get("security") or [])
+    for path_item in (spec.get("paths") or {}).values():
+        for operation in (path_item.values() if isinstance(path_item, dict) else []):
+            if isinstance(operation, dict):
+                requirements.extend(operation.get("security") or [])
+    for requirement in requirements:
+        if isinstance(requirement, dict):
+            names.extend(name for name in requirement if name not in names)
+    scheme: Optional[Dict[str, Any]] = next((schemes[name] for name in names if isinstance(schemes.get(name), dict)), None)
+    if scheme is None:
+        return ['    session.headers["Authorization"] = f"Bearer {API_TOKEN}"']
+    if scheme.get("type") == "apiKey" and scheme.get("name"):
+        name = str(scheme["name"])
+        location = scheme.get("in", "header")
+        if location == "query":
+            return [f"    session.params[{name!r}] = API_TOKEN"]
+        if location == "cookie":
+            return [f"    session.cookies.set({name!r}, API_TOKEN)"]
+        return [f"    session.headers[{name!r}] = API_TOKEN"]
+    if scheme.get("type") == "http" and str(scheme.get("scheme", "")).lower() == "basic":
+        return ['    username, _, password = API_TOKEN.partition(":")', "    session.auth = (username, password)"]
+    return ['    session.headers["Authorization"] = f"Bearer {API_TOKEN}"']
+
+
+def render_conftest(spec: Dict[str, Any]) -> str:
+    """conftest.py профиля xdist: базовый URL из servers спецификации и авторизация по ее security"""
+    servers = spec.get("servers") or []
+    base_url = servers[0].get("url") if servers and isinstance(servers[0], dict) else None
+    return _CONFTEST_HEADER.format(base_url=str(base_url or "https://api.example.com"),
+                                   auth="\n".join(_auth_lines(spec)))
+
+
+def profile_files(spec: Dict[str, Any], profile: str) -> Optional[Dict[str, str]]:
+    """Дополнительные файлы набора тестов для профиля (None для профиля по умолчанию)"""
+    if profile == "xdist":
+        return {CONFTEST_NAME: render_conftest(spec)}
+    return None
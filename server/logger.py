@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Структурированное JSON-логирование с фоновой записью через очередь"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from tracing import current_trace_id, start_span
+
+# Настройки логирования из переменных окружения
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Доля debug-записей с содержимым запросов/ответов, которые реально пишутся в лог
+DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+# Сколько символов payload сохранять в начале и в конце
+DEBUG_PAYLOAD_LIMIT = int(os.getenv("LOG_DEBUG_PAYLOAD_LIMIT", "100"))
+
+# Контекст текущего запроса: идентификатор и накопленные тайминги этапов
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_stages_var: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stages", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def kv(**fields) -> Dict[str, Any]:
+    """Упаковывает структурированные поля для передачи в extra= логгера"""
+    return {"fields": fields}
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись лога в одну JSON-строку"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который в вызывающем потоке делает только дешевую подготовку записи.
+
+    Сериализация в JSON и запись в поток выполняются в фоновом потоке QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.request_id = request_id_var.get()
+        record.trace_id = current_trace_id()
+        return record
+
+
+class _Utf8StreamHandler(logging.StreamHandler):
+    """Пишет записи в UTF-8 независимо от кодировки sys.stderr"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = (self.format(record) + "\n").encode("utf-8", errors="replace")
+            buffer = getattr(self.stream, "buffer", None)
+            if buffer is not None:
+                buffer.write(data)
+                buffer.flush()
+            else:
+                self.stream.write(data.decode("utf-8"))
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logging() -> None:
+    """Настраивает корневой логгер приложения (идемпотентно)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = _Utf8StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = _ContextQueueHandler(log_queue)
+
+    root = logging.getLogger("sos")
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Возвращает логгер приложения с именем sos.<name>"""
+    setup_logging()
+    return logging.getLogger(f"sos.{name}")
+
+
+log = get_logger("request")
+
+
+def debug_payload(logger: logging.Logger, message: str, payload: Any, **fields) -> None:
+    """Логирует начало и конец payload на уровне DEBUG с семплированием.
+
+    При выключенном DEBUG стоимость вызова — одна проверка уровня.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if DEBUG_SAMPLE_RATE < 1.0 and random.random() >= DEBUG_SAMPLE_RATE:
+        return
+    text = payload if isinstance(payload, str) else str(payload)
+    fields["size"] = len(text)
+    if len(text) > DEBUG_PAYLOAD_LIMIT * 2:
+        fields["head"] = text[:DEBUG_PAYLOAD_LIMIT]
+        fields["tail"] = text[-DEBUG_PAYLOAD_LIMIT:]
+    else:
+        fields["payload"] = text
+    logger.debug(message, extra=kv(**fields))
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Замеряет длительность этапа обработки и добавляет ее в сводку запроса.
+
+    Этап также записывается спаном трассы; в with ... as span можно добавить атрибуты.
+    """
+    start = time.perf_counter()
+    try:
+        with start_span(name, **attributes) as span:
+            yield span
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stages = _stages_var.get()
+        if stages is not None:
+            stages[name] = round(stages.get(name, 0.0) + elapsed_ms, 2)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("stage finished", extra=kv(stage=name, duration_ms=round(elapsed_ms, 2)))
+
+
+class RequestLoggingMiddleware:
+    """ASGI middleware: присваивает запросу request id и пишет итоговую запись с таймингами этапов"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for header_name, header_value in scope.get("headers", []):
+            if header_name == b"x-request-id":
+                request_id = header_value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex[:16]
+
+        rid_token = request_id_var.set(request_id)
+        stages_token = _stages_var.set({})
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            log.info(
+                "request finished",
+                extra=kv(
+                    method=scope.get("method"),
+                    path=scope.get("path"),
+                    status=status_code,
+                    duration_ms=round((time.perf_counter() - start) * 1000, 2),
+                    stages=_stages_var.get(),
+                ),
+            )
+            _stages_var.reset(stages_token)
+            request_id_var.reset(rid_token)
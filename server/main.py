@@ -1,41 +1,132 @@
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
-from pydantic import BaseModel, Field
-from openai import OpenAI
-from schemas.AllureTestOps import AllureTestOpsReport
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from openai import AsyncOpenAI
+from schemas.AllureTestOps import AllureTestOpsReport, parse_report_json
+from typing import Optional, Dict, Any, List, Literal, AsyncIterator
 import os
+import re
+import ast
+import asyncio
+import contextlib
+import time
+import uuid
 import json
-import sys
-import io
-import traceback
 import httpx
 import yaml
-from starlette.middleware.base import BaseHTTPMiddleware
-
-# Убеждаемся, что используется UTF-8 для всех операций
-if sys.stdout.encoding != 'utf-8':
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-if sys.stderr.encoding != 'utf-8':
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
-
-app = FastAPI()
-
-# Middleware для увеличения лимита размера тела запроса
-class LargeRequestMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Увеличиваем лимит размера тела запроса до 200MB
-        if request.method == "POST":
-            # Читаем тело запроса с увеличенным лимитом
-            body = await request.body()
-            # Создаем новый request с прочитанным телом
-            async def receive():
-                return {"type": "http.request", "body": body}
-            request._receive = receive
-        response = await call_next(request)
-        return response
+from urllib.parse import quote
+from logger import RequestLoggingMiddleware, debug_payload, get_logger, kv, request_id_var, stage
+from tracing import TracingMiddleware
+from routing import LLM_MODEL, choose_model, model_hint_var, response_is_valid, strip_code_fence
+from usage import GROUP_COLUMNS, CallerMiddleware, UsageStore, caller_var, usage_tokens
+from compression import BodyTooLargeError, CompressionMiddleware, DecompressionError, decompress_body
+from openapi_diff import (
+    build_subset_spec,
+    compute_fingerprints,
+    deref,
+    diff_fingerprints,
+    iter_operations,
+    operation_key,
+    operation_parameters,
+    remove_operations,
+    resolved_operation,
+    splice_module,
+)
+from openapi_index import SpecIndex, SpecIndexCache, spec_id_for
+from coverage import COVERAGE_LABEL, CoverageMatrix, coverage_for
+from code_repair import check_code, repair_code
+from chunking import CHUNK_TOKEN_BUDGET, assemble_module, make_batches, split_test_module, unique_name
+from sessions import Session, SessionStore
+from results import PatchError, ResultStore, apply_unified_diff, result_id_for
+from export import plan_export, stream_export
+from scheduler import FairScheduler, estimate_call_tokens, estimate_completion_tokens
+from cancellation import DisconnectMiddleware, SharedCalls, call_key
+from health import READINESS_PROBE_TIMEOUT, InFlightMiddleware, UpstreamProbe, event_loop_lag, readiness
+from similarity import SimilarityCache
+from lime_profiles import LIME_OUTPUT_PROFILE, MUTATING_METHODS, XDIST_INSTRUCTIONS, profile_files
+from compaction import (
+    BLUE_COMPACT_INSTRUCTIONS,
+    PROMPT_COMPACTION,
+    PURPLE_COMPACT_INSTRUCTIONS,
+    CompactFormError,
+    CompactModule,
+    compact_module,
+    parse_compact,
+)
+
+log = get_logger("server")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Старт: замер задержки цикла событий, поток записи учета и прогрев соединений с upstream;
+    остановка: дожидается записи учета, накопленного в очереди"""
+    event_loop_lag.start()
+    # База учета создается в потоке записи, пока сервер прогревается, а не на первом вызове модели
+    usage_store.start()
+    await warm_up_upstream()
+    yield
+    await asyncio.to_thread(usage_store.flush)
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Отмена обработчика (и вызова модели), если клиент закрыл соединение; самый внутренний middleware
+app.add_middleware(DisconnectMiddleware)
+
+# Middleware распаковки тела запроса. Несжатое тело не буферизуется и не копируется —
+# его читает обработчик напрямую; сжатое собирается, распаковывается и отдается обработчику одним куском
+class LargeRequestMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST":
+            await self.app(scope, receive, send)
+            return
+        content_encoding = dict(scope.get("headers", [])).get(b"content-encoding", b"").decode("latin-1")
+        if not content_encoding or content_encoding.strip().lower() == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        with stage("read_body") as span:
+            chunks = []
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                chunks.append(message.get("body", b""))
+                more_body = message.get("more_body", False)
+            body = b"".join(chunks)
+            del chunks
+            span.set_attribute("http.request.body.size", len(body))
+        # Распаковываем тело, если клиент прислал его сжатым (Content-Encoding: gzip/br/zstd)
+        try:
+            with stage("decompress") as span:
+                body = decompress_body(body, content_encoding)
+                span.set_attribute("sos.decompressed_size", len(body))
+        except BodyTooLargeError as e:
+            await JSONResponse(status_code=413, content={"detail": str(e)})(scope, receive, send)
+            return
+        except DecompressionError as e:
+            await JSONResponse(status_code=400, content={"detail": str(e)})(scope, receive, send)
+            return
+
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        # Ссылку на тело держит только очередь: после чтения обработчиком тело больше не удерживается здесь
+        pending = [body]
+        del body
+
+        async def receive_body():
+            if pending:
+                return {"type": "http.request", "body": pending.pop(), "more_body": False}
+            return await receive()
+
+        await self.app(dict(scope, headers=headers), receive_body, send)
 
 app.add_middleware(LargeRequestMiddleware)
 
@@ -48,6 +139,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие ответов (zstd/br, если установлены, иначе gzip) с порогом по размеру
+app.add_middleware(CompressionMiddleware)
+
+# Request id и итоговая запись с таймингами этапов (добавляется последним, чтобы быть внешним)
+app.add_middleware(RequestLoggingMiddleware)
+
+# Идентификатор вызывающей стороны (X-Caller-ID) для учета токенов
+app.add_middleware(CallerMiddleware)
+
+# Корневой спан запроса, продолжающий трассу из заголовка traceparent (TRACE_EXPORTER=file|otlp)
+app.add_middleware(TracingMiddleware)
+
+# Счетчик запросов в обработке для /health/ready
+app.add_middleware(InFlightMiddleware)
+
 # Конфигурация OpenAI
 # Загружаем API ключ из переменной окружения
 api_key = os.getenv("OPENAI_API_KEY")
@@ -55,12 +161,12 @@ url = os.getenv("OPENAI_BASE_URL")
 
 # Проверяем, что API ключ не пустой
 if not api_key or len(api_key.strip()) == 0:
-    print(f"[ERROR] API ключ пустой или не найден!", file=sys.stderr)
+    log.error("API ключ пустой или не найден")
     raise ValueError("API ключ не может быть пустым! Установите переменную окружения OPENAI_API_KEY в файле .env")
 
 # Проверяем, что URL не пустой
 if not url or len(url.strip()) == 0:
-    print(f"[ERROR] OPENAI_BASE_URL не установлен!", file=sys.stderr)
+    log.error("OPENAI_BASE_URL не установлен")
     raise ValueError("OPENAI_BASE_URL не может быть пустым! Установите переменную окружения OPENAI_BASE_URL в файле .env")
 
 # Удаляем пробелы в начале и конце (на случай, если они там есть)
@@ -74,18 +180,13 @@ try:
     is_ascii = True
 except UnicodeEncodeError:
     is_ascii = False
-    print(f"[WARNING] API ключ содержит не-ASCII символы. Это может быть проблемой, если сервер API не поддерживает такие ключи.", file=sys.stderr)
-    # Показываем какие символы не-ASCII (для отладки)
-    non_ascii_chars = [c for c in api_key if ord(c) > 127]
-    if non_ascii_chars:
-        print(f"[DEBUG] Найдены не-ASCII символы: {set(non_ascii_chars)}", file=sys.stderr)
+    log.warning("API ключ содержит не-ASCII символы. Это может быть проблемой, если сервер API не поддерживает такие ключи.")
 
-# Логируем информацию о ключе для отладки (безопасно - только первые и последние символы)
+# Логируем только метаданные ключа — сам ключ и его фрагменты в лог не попадают
 if len(api_key) > 10:
-    print(f"[DEBUG] API ключ загружен: {api_key[:5]}...{api_key[-5:]} (длина: {len(api_key)}, ASCII: {is_ascii})", file=sys.stderr)
+    log.info("API ключ загружен", extra=kv(key_length=len(api_key), ascii=is_ascii))
 else:
-    print(f"[WARNING] API ключ очень короткий: {api_key[:min(20, len(api_key))]} (длина: {len(api_key)})", file=sys.stderr)
-    print(f"[WARNING] Это может быть проблемой! API ключи обычно длиннее.", file=sys.stderr)
+    log.warning("API ключ очень короткий, API ключи обычно длиннее", extra=kv(key_length=len(api_key)))
 
 # Патч для httpx.Headers для правильной обработки не-ASCII символов
 # Проблема: httpx пытается закодировать заголовки в ASCII, но попадаются не-ASCII символы
@@ -118,7 +219,7 @@ try:
                             return latin1_str.encode(encoding)
                     except Exception as e:
                         # Если не получается, логируем ошибку и пробуем оригинальную функцию
-                        print(f"[WARNING] Проблема с кодировкой Authorization заголовка: {e}", file=sys.stderr)
+                        log.warning("Проблема с кодировкой Authorization заголовка: %s", e)
                         try:
                             return _original_normalize_header_value(value, encoding)
                         except:
@@ -137,7 +238,7 @@ try:
                         # В крайнем случае удаляем не-ASCII символы (только для не-критичных заголовков)
                         safe_value = value.encode('ascii', errors='ignore').decode('ascii')
                         if safe_value != value:
-                            print(f"[WARNING] Удалены не-ASCII символы из заголовка: {value[:50]}...", file=sys.stderr)
+                            log.warning("Удалены не-ASCII символы из заголовка")
                         return safe_value.encode(encoding or "ascii")
         return _original_normalize_header_value(value, encoding)
     
@@ -145,13 +246,12 @@ try:
     httpx._models._normalize_header_value = _safe_normalize_header_value
 except (AttributeError, ImportError) as e:
     # Если не удалось применить патч, логируем предупреждение
-    print(f"[WARNING] Не удалось применить патч для httpx: {e}", file=sys.stderr)
+    log.warning("Не удалось применить патч для httpx: %s", e)
 
 # Создаем клиент OpenAI
 # ВАЖНО: Кириллица должна быть только в теле запроса (в messages), а не в заголовках
 # Увеличиваем timeout до 300 секунд (5 минут) для больших запросов
-print(f"[DEBUG] Создание клиента OpenAI с API ключом длиной {len(api_key)} символов", file=sys.stderr)
-client = OpenAI(
+client = AsyncOpenAI(
     api_key=api_key,
     base_url=url,
     timeout=300.0,  # 5 минут для больших запросов
@@ -161,23 +261,133 @@ client = OpenAI(
 if hasattr(client, 'api_key'):
     client_api_key = client.api_key
     if client_api_key != api_key:
-        print(f"[ERROR] Несоответствие API ключа! Переданный: {len(api_key)} символов, клиент получил: {len(client_api_key) if client_api_key else 0} символов", file=sys.stderr)
+        log.error("Несоответствие API ключа в клиенте OpenAI", extra=kv(expected_length=len(api_key), actual_length=len(client_api_key) if client_api_key else 0))
     else:
-        print(f"[DEBUG] Клиент OpenAI успешно создан с API ключом длиной {len(client_api_key)} символов", file=sys.stderr)
+        log.debug("Клиент OpenAI успешно создан")
 else:
-    print(f"[WARNING] Не удалось проверить API ключ клиента", file=sys.stderr)
+    log.warning("Не удалось проверить API ключ клиента")
+
+# Проба upstream для /health/ready; копия клиента использует тот же пул соединений
+upstream_probe = UpstreamProbe(
+    lambda: client.with_options(timeout=READINESS_PROBE_TIMEOUT, max_retries=0).models.list()
+)
+
+
+async def warm_up_upstream():
+    """Открывает соединения с upstream до первого запроса, чтобы он не платил за TLS и установку соединения"""
+    upstream = await upstream_probe.warm_up()
+    if upstream["ok"]:
+        log.info("Соединения с upstream открыты", extra=kv(latency_ms=upstream["latency_ms"]))
+    else:
+        log.warning("Upstream недоступен при старте", extra=kv(error=upstream["error"]))
+
+
+# Сколько пакетов большого модуля оптимизируются одновременно (режим Blue)
+BLUE_MAX_PARALLEL = int(os.getenv("BLUE_MAX_PARALLEL", "4"))
+
+# Сколько раз за запрос можно отправить сломанный фрагмент кода модели на исправление
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", "3"))
+
+# Режим Lime "auto": спецификации, где операций не больше порога, генерируются шаблоном без LLM
+LIME_TEMPLATE_MAX_OPERATIONS = int(os.getenv("LIME_TEMPLATE_MAX_OPERATIONS", "20"))
+# Сколько операций уходит в LLM одним запросом в гибридном режиме
+HYBRID_BATCH_SIZE = int(os.getenv("LIME_HYBRID_BATCH_SIZE", "40"))
+# Сколько раундов дозапросов к LLM для непокрытых ячеек матрицы покрытия (0 — только посчитать матрицу)
+LIME_COVERAGE_ROUNDS = int(os.getenv("LIME_COVERAGE_ROUNDS", "1"))
+# Сколько операций с пробелами покрытия уходит в LLM одним дозапросом и сколько всего за раунд
+LIME_COVERAGE_BATCH = int(os.getenv("LIME_COVERAGE_BATCH", "8"))
+LIME_COVERAGE_MAX_OPERATIONS = int(os.getenv("LIME_COVERAGE_MAX_OPERATIONS", "40"))
 
 
 class GenerateRequest(BaseModel):
+    # model_hint не конфликтует с методами pydantic, отключаем предупреждение о префиксе model_
+    model_config = ConfigDict(protected_namespaces=())
+
     text: str
+    # fast — малая модель, quality — большая; по умолчанию модель выбирается по режиму и размеру входа
+    model_hint: Optional[Literal["fast", "quality"]] = Field(None, description="Подсказка выбора модели")
 
 
 class GenerateFromOpenAPIRequest(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
     openapi_spec: str = Field(..., min_length=1, description="OpenAPI спецификация в формате YAML или JSON (строка)")
+    # llm — весь модуль пишет модель; template — шаблон без LLM; hybrid — шаблон + проверки от LLM;
+    # auto — template для небольших спецификаций, hybrid для больших
+    mode: Literal["llm", "template", "hybrid", "auto"] = Field("llm", description="Режим генерации")
+    # Инкрементальная пересборка: предыдущий модуль тестов и предыдущая спецификация (или ее отпечатки)
+    previous_code: Optional[str] = Field(None, description="Ранее сгенерированный модуль тестов")
+    previous_spec: Optional[str] = Field(None, description="Предыдущая версия OpenAPI спецификации")
+    previous_fingerprints: Optional[Dict[str, str]] = Field(None, description="Отпечатки операций предыдущей спецификации")
+    # fast — малая модель, quality — большая; по умолчанию модель выбирается по режиму и размеру входа
+    model_hint: Optional[Literal["fast", "quality"]] = Field(None, description="Подсказка выбора модели")
+    coverage_rounds: Optional[int] = Field(None, ge=0, le=3, description="Раунды дозапросов для непокрытых ячеек (по умолчанию LIME_COVERAGE_ROUNDS)")
+    # default — requests в каждом тесте; xdist — фикстура api с пулом соединений из conftest.py
+    profile: Optional[Literal["default", "xdist"]] = Field(None, description="Профиль вывода (по умолчанию LIME_OUTPUT_PROFILE)")
 
 
 class GenerateResponse(BaseModel):
     code: str
+    # Green: exact — результат взят из кеша без вызова модели, seeded — модель получила похожий прошлый результат
+    cache: Optional[Literal["exact", "seeded"]] = None
+
+
+class CodeRequest(GenerateRequest):
+    # Вместо полного текста можно передать unified diff относительно ранее возвращенного input_id или result_id
+    text: str = ""
+    base_id: Optional[str] = Field(None, description="input_id или result_id предыдущего ответа Blue/Purple")
+    diff: Optional[str] = Field(None, description="Unified diff относительно текста base_id")
+
+
+class CodeResponse(GenerateResponse):
+    # Id входа (восстановленного из diff) и результата — база для следующих запросов с diff
+    input_id: str
+    result_id: str
+
+
+class GenerateFromOpenAPIResponse(GenerateResponse):
+    # Отпечатки операций текущей спецификации — клиент передает их в следующий запрос
+    fingerprints: Dict[str, str] = Field(default_factory=dict)
+    # Результат сравнения со старой спецификацией (только для инкрементальной пересборки)
+    diff: Optional[Dict[str, List[str]]] = None
+    # Матрица покрытия: операции × коды ответа, обязательные параметры, варианты авторизации
+    coverage: Optional[Dict[str, Any]] = None
+    # Дополнительные файлы набора тестов профиля вывода ({"conftest.py": "..."})
+    files: Optional[Dict[str, str]] = None
+
+
+class RegisterSpecRequest(BaseModel):
+    openapi_spec: str = Field(..., min_length=1, description="OpenAPI спецификация в формате YAML или JSON (строка)")
+
+
+class RegisterSpecResponse(BaseModel):
+    spec_id: str
+    operations_count: int
+    tags: Dict[str, int]
+
+
+class OperationsPage(BaseModel):
+    total: int
+    offset: int
+    limit: int
+    items: List[Dict[str, Any]]
+
+
+class GenerateFromIndexRequest(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    # Явный список операций ("GET /users") и/или фильтры, выбирающие операции из индекса
+    operations: List[str] = Field(default_factory=list)
+    tag: Optional[str] = None
+    path_prefix: Optional[str] = None
+    method: Optional[str] = None
+    mode: Literal["llm", "template", "hybrid", "auto"] = "llm"
+    model_hint: Optional[Literal["fast", "quality"]] = None
+    coverage_rounds: Optional[int] = Field(None, ge=0, le=3)
+    profile: Optional[Literal["default", "xdist"]] = None
+
+
+_SURROGATE_RE = re.compile("[\ud800-\udfff]")
 
 
 def safe_str(obj) -> str:
@@ -188,12 +398,10 @@ def safe_str(obj) -> str:
         if isinstance(obj, bytes):
             return obj.decode('utf-8', errors='replace')
         if isinstance(obj, str):
-            # Убеждаемся, что строка правильно закодирована
-            try:
-                obj.encode('utf-8')
+            # В UTF-8 не кодируются только одиночные суррогаты; проверка без копирования строки
+            if obj.isascii() or not _SURROGATE_RE.search(obj):
                 return obj
-            except UnicodeEncodeError:
-                return obj.encode('utf-8', errors='replace').decode('utf-8')
+            return obj.encode('utf-8', errors='replace').decode('utf-8')
         # Для других типов используем стандартное преобразование
         result = str(obj)
         try:
@@ -220,8 +428,20 @@ def escape_string(s: str) -> str:
     return s
 
 
+def _python_name(text: str, fallback: str) -> str:
+    """Идентификатор из произвольного текста: недопустимые символы заменяются на _"""
+    name = "".join(c if c.isalnum() or c == "_" else "_" for c in text)
+    return name if name and not name[0].isdigit() else fallback + name
+
+
 def generate_allure_test_code(report: AllureTestOpsReport) -> str:
-    """Генерирует Python код с Allure декораторами на основе отчета"""
+    """Генерирует Python код с Allure декораторами на основе отчета.
+
+    Тест-кейсы группируются в один класс на пару feature/suite: общие декораторы (manual, feature,
+    suite, а также owner и story, если они одинаковы у всех кейсов класса) указываются один раз на
+    классе, остальные — на методах. Имена классов и методов уникальны, поэтому ни один тест не
+    перекрывается другим при сборе pytest.
+    """
     try:
         code_lines = []
         
@@ -240,81 +460,93 @@ def generate_allure_test_code(report: AllureTestOpsReport) -> str:
         code_lines.append("")
         code_lines.append("")
         
+        # Группы (feature, suite) в порядке первого появления
+        groups: Dict[tuple, list] = {}
         for test_case in report.testCases:
             test = test_case.test
-            steps = test_case.steps
-            
-            # Безопасно обрабатываем все строки
-            owner = safe_str(test.owner)
-            feature = safe_str(test.feature)
-            story = safe_str(test.story)
-            test_type = safe_str(test.test_type)
-            title = safe_str(test.title) if test.title else None
+            groups.setdefault((safe_str(test.feature), safe_str(test.test_type)), []).append(test_case)
+        
+        class_names: set = set()
+        for (feature, test_type), cases in groups.items():
+            owners = {safe_str(case.test.owner) for case in cases}
+            stories = {safe_str(case.test.story) for case in cases}
+            shared_owner = owners.pop() if len(owners) == 1 else None
+            shared_story = stories.pop() if len(stories) == 1 else None
             
-            # Определяем имя класса на основе feature или test_type
-            class_name = f"{feature.replace(' ', '').replace('-', '')}Tests"
-            if test_type:
-                class_name = f"{test_type.replace(' ', '').replace('-', '')}Tests"
+            # Имя класса на основе feature и test_type (несколько feature одного типа не совпадают по имени)
+            base_name = f"{feature}{test_type}".replace(' ', '').replace('-', '')
+            class_name = unique_name(_python_name(f"{base_name}Tests", "C"), class_names)
             
-            # Декораторы класса
+            # Декораторы класса — общие для всех его тестов
             code_lines.append("@allure.manual")
-            code_lines.append("")
-            code_lines.append(f'@allure.label("owner", "{escape_string(owner)}")')
+            if shared_owner is not None:
+                code_lines.append(f'@allure.label("owner", "{escape_string(shared_owner)}")')
             code_lines.append(f'@allure.feature("{escape_string(feature)}")')
-            code_lines.append(f'@allure.story("{escape_string(story)}")')
+            if shared_story is not None:
+                code_lines.append(f'@allure.story("{escape_string(shared_story)}")')
             code_lines.append(f'@allure.suite("{escape_string(test_type)}")')
             code_lines.append("@mark.manual")
             code_lines.append(f"class {class_name}:")
             code_lines.append("")
             
-            # Определяем имя функции теста
-            if title:
-                function_name = "test_" + title.lower().replace(" ", "_").replace("-", "_")
-            else:
-                function_name = "test_function"
-            function_name = "".join(c if c.isalnum() or c == "_" else "_" for c in function_name)
-            
-            # Декораторы метода
-            if title:
-                code_lines.append(f'    @allure.title("{escape_string(title)}")')
-            
-            # Jira ссылка (если есть в labels)
-            jira_link = safe_str(test.labels.get("jira_link", ""))
-            jira_name = safe_str(test.labels.get("jira_name", ""))
-            if jira_link:
-                code_lines.append(f'    @allure.link("{escape_string(jira_link)}", name="{escape_string(jira_name)}")')
-            
-            # Теги и приоритет
-            if test.tags:
-                # Берем первый тег как основной (CRITICAL, NORMAL, LOW)
-                main_tag = safe_str(test.tags[0] if test.tags else test.priority.value)
-                code_lines.append(f'    @allure.tag("{escape_string(main_tag)}")')
-            
-            priority = safe_str(test.priority.value)
-            code_lines.append(f'    @allure.label("priority", "{escape_string(priority)}")')
-            code_lines.append(f"    def {function_name}(self) -> None:")
-            
-            # Шаги теста
-            for i, step in enumerate(steps):
-                step_name = escape_string(safe_str(step.step_name))
-                step_action = escape_string(safe_str(step.step_action)) if step.step_action else ""
-                
-                code_lines.append(f'        with allure_step("{step_name}"):')
+            method_names: set = set()
+            for test_case in cases:
+                test = test_case.test
+                steps = test_case.steps
+                title = safe_str(test.title) if test.title else None
                 
-                if step.attachments:
-                    for attachment in step.attachments:
-                        attachment_path = escape_string(safe_str(attachment))
-                        attachment_name = escape_string(safe_str(attachment.split("/")[-1]))
-                        code_lines.append(f"            allure.attach.file(")
-                        code_lines.append(f'                "{attachment_path}",')
-                        code_lines.append(f'                name="{attachment_name}",')
-                        code_lines.append(f"                attachment_type=allure.attachment_type.PNG,")
-                        code_lines.append(f"            )")
+                # Определяем имя функции теста
+                if title:
+                    function_name = "test_" + title.lower().replace(" ", "_").replace("-", "_")
                 else:
-                    code_lines.append("            pass")
+                    function_name = "test_function"
+                function_name = unique_name(_python_name(function_name, "test_"), method_names)
+                
+                # Декораторы метода
+                if shared_owner is None:
+                    code_lines.append(f'    @allure.label("owner", "{escape_string(safe_str(test.owner))}")')
+                if shared_story is None:
+                    code_lines.append(f'    @allure.story("{escape_string(safe_str(test.story))}")')
+                if title:
+                    code_lines.append(f'    @allure.title("{escape_string(title)}")')
+                
+                # Jira ссылка (если есть в labels)
+                jira_link = safe_str(test.labels.get("jira_link", ""))
+                jira_name = safe_str(test.labels.get("jira_name", ""))
+                if jira_link:
+                    code_lines.append(f'    @allure.link("{escape_string(jira_link)}", name="{escape_string(jira_name)}")')
+                
+                # Теги и приоритет
+                if test.tags:
+                    # Берем первый тег как основной (CRITICAL, NORMAL, LOW)
+                    main_tag = safe_str(test.tags[0] if test.tags else test.priority.value)
+                    code_lines.append(f'    @allure.tag("{escape_string(main_tag)}")')
+                
+                priority = safe_str(test.priority.value)
+                code_lines.append(f'    @allure.label("priority", "{escape_string(priority)}")')
+                code_lines.append(f"    def {function_name}(self) -> None:")
+                
+                # Шаги теста
+                for step in steps:
+                    step_name = escape_string(safe_str(step.step_name))
+                    
+                    code_lines.append(f'        with allure_step("{step_name}"):')
+                    
+                    if step.attachments:
+                        for attachment in step.attachments:
+                            attachment_path = escape_string(safe_str(attachment))
+                            attachment_name = escape_string(safe_str(attachment.split("/")[-1]))
+                            code_lines.append(f"            allure.attach.file(")
+                            code_lines.append(f'                "{attachment_path}",')
+                            code_lines.append(f'                name="{attachment_name}",')
+                            code_lines.append(f"                attachment_type=allure.attachment_type.PNG,")
+                            code_lines.append(f"            )")
+                    else:
+                        code_lines.append("            pass")
+                
+                code_lines.append("")
             
             code_lines.append("")
-            code_lines.append("")
         
         # Объединяем все строки
         result = "\n".join(code_lines)
@@ -328,16 +560,274 @@ def generate_allure_test_code(report: AllureTestOpsReport) -> str:
     except Exception as e:
         # Если произошла ошибка при генерации, логируем и пробрасываем
         error_msg = safe_str(e)
-        print(f"[ERROR] Ошибка в generate_allure_test_code: {error_msg}", file=sys.stderr)
+        log.error("Ошибка в generate_allure_test_code: %s", error_msg)
+        raise
+
+
+# Учет токенов, задержки и стоимости каждого вызова модели (USAGE_DB)
+usage_store = UsageStore()
+
+# Очередь допуска к upstream: слоты по режимам, честность между вызывающими сторонами, короткие вызовы первыми
+scheduler = FairScheduler()
+# Одновременные одинаковые вызовы модели выполняются один раз
+shared_calls = SharedCalls()
+
+
+async def chat_completion(mode: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float):
+    """Единая точка обращения к модели: все режимы вызывают upstream через эту функцию.
+
+    Модель выбирается политикой маршрутизации (режим, размер промпта, подсказка клиента);
+    ответ малой модели, не прошедший структурную проверку режима, переспрашивается у большой.
+    Одинаковые одновременные вызовы выполняются один раз; вызов отменяется, когда отключились
+    все ожидающие его клиенты.
+    """
+    key = call_key(mode, model_hint_var.get(), max_tokens, temperature, messages=messages)
+    return await shared_calls.run(key, lambda: _chat_completion(mode, messages, max_tokens, temperature))
+
+
+async def _chat_completion(mode: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float):
+    input_chars = sum(len(message.get("content") or "") for message in messages)
+    model = choose_model(mode, input_chars, model_hint_var.get())
+    log.debug("Запрос к модели", extra=kv(mode=mode, model=model, max_tokens=max_tokens))
+    if model == LLM_MODEL:
+        return await _model_call(mode, model, messages, max_tokens, temperature, input_chars)
+
+    try:
+        response = await _model_call(mode, model, messages, max_tokens, temperature, input_chars)
+        if response_is_valid(mode, response):
+            return response
+        reason = "invalid_response"
+    except Exception as e:
+        reason = type(e).__name__
+    log.info("Эскалация вызова на большую модель", extra=kv(mode=mode, small_model=model, reason=reason))
+    return await _model_call(mode, LLM_MODEL, messages, max_tokens, temperature, input_chars, escalated=True)
+
+
+async def _model_call(mode: str, model: str, messages: List[Dict[str, str]], max_tokens: int,
+                      temperature: float, input_chars: int, escalated: bool = False):
+    """Один вызов модели со спаном upstream и записью в учет токенов; слот выдает планировщик"""
+    ticket = await wait_for_slot(mode, model, input_chars, max_tokens)
+    started = time.perf_counter()
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    status = "error"
+    saved_tokens = 0
+    try:
+        with stage(
+            "upstream",
+            **{
+                "sos.mode": mode,
+                "sos.escalated": escalated,
+                "gen_ai.request.model": model,
+                "gen_ai.request.max_tokens": max_tokens,
+                "gen_ai.request.temperature": temperature,
+                "sos.prompt_chars": input_chars,
+            },
+        ) as span:
+            response = await client.chat.completions.create(
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                presence_penalty=0,
+                top_p=0.95,
+                messages=messages,
+            )
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                span.set_attribute("gen_ai.usage.input_tokens", getattr(usage, "prompt_tokens", None))
+                span.set_attribute("gen_ai.usage.output_tokens", getattr(usage, "completion_tokens", None))
+            choices = getattr(response, "choices", None) or []
+            span.set_attribute("gen_ai.response.finish_reasons", [str(getattr(c, "finish_reason", "")) for c in choices])
+            if choices:
+                span.set_attribute("sos.completion_chars", len(choices[0].message.content or ""))
+        tokens = usage_tokens(usage)
+        status = "ok"
+        return response
+    except asyncio.CancelledError:
+        # Клиент отключился: промпт уже оплачен, не сгенерированный ответ — экономия
+        status = "cancelled"
+        saved_tokens = estimate_completion_tokens(input_chars, max_tokens)
+        raise
+    finally:
+        scheduler.release(ticket)
+        _record_usage(mode, model, status, input_chars, started, tokens, saved_tokens)
+
+
+async def wait_for_slot(mode: str, model: str, input_chars: int, max_tokens: int):
+    """Ожидание слота upstream в очереди планировщика (этап queue)"""
+    estimated = estimate_call_tokens(input_chars, max_tokens)
+    started = time.perf_counter()
+    try:
+        with stage("queue", **{"sos.mode": mode, "sos.estimated_tokens": estimated}):
+            return await scheduler.acquire(mode, caller_var.get(), estimated)
+    except asyncio.CancelledError:
+        # Клиент отключился, пока вызов ждал в очереди: upstream не вызывался вовсе
+        _record_usage(mode, model, "cancelled", input_chars, started,
+                      {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}, estimated)
         raise
 
 
+def _record_usage(mode: str, model: str, status: str, input_chars: int, started: float, tokens: Dict[str, int],
+                  saved_tokens: int = 0) -> None:
+    if status == "cancelled":
+        log.info("Вызов модели отменен", extra=kv(mode=mode, model=model, saved_tokens=saved_tokens))
+    usage_store.record(
+        request_id=request_id_var.get(),
+        caller=caller_var.get(),
+        mode=mode,
+        model=model,
+        status=status,
+        input_chars=input_chars,
+        latency_ms=round((time.perf_counter() - started) * 1000, 1),
+        saved_tokens=saved_tokens,
+        **tokens,
+    )
+
+
+async def chat_completion_stream(mode: str, messages: List[Dict[str, str]], max_tokens: int,
+                                 temperature: float) -> AsyncIterator[str]:
+    """Потоковый вызов модели: отдает фрагменты текста ответа по мере генерации.
+
+    Ответ нельзя проверить до конца потока, поэтому эскалации на большую модель нет —
+    проверку и исправление результата выполняет вызывающий код.
+    """
+    input_chars = sum(len(message.get("content") or "") for message in messages)
+    model = choose_model(mode, input_chars, model_hint_var.get())
+    ticket = await wait_for_slot(mode, model, input_chars, max_tokens)
+    started = time.perf_counter()
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    status = "error"
+    saved_tokens = 0
+    completion_chars = 0
+    try:
+        with stage(
+            "upstream",
+            **{
+                "sos.mode": mode,
+                "sos.stream": True,
+                "gen_ai.request.model": model,
+                "gen_ai.request.max_tokens": max_tokens,
+                "gen_ai.request.temperature": temperature,
+                "sos.prompt_chars": input_chars,
+            },
+        ) as span:
+            stream = await client.chat.completions.create(
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                presence_penalty=0,
+                top_p=0.95,
+                messages=messages,
+                stream=True,
+            )
+            finish_reason = None
+            # Закрытие потока при досрочном выходе обрывает соединение, и upstream прекращает генерацию
+            async with stream:
+                async for chunk in stream:
+                    # Провайдеры, поддерживающие учет в потоке, присылают usage в последнем фрагменте
+                    if getattr(chunk, "usage", None) is not None:
+                        tokens = usage_tokens(chunk.usage)
+                    for choice in getattr(chunk, "choices", None) or []:
+                        finish_reason = getattr(choice, "finish_reason", None) or finish_reason
+                        text = getattr(choice.delta, "content", None)
+                        if text:
+                            completion_chars += len(text)
+                            yield text
+            span.set_attribute("gen_ai.response.finish_reasons", [str(finish_reason or "")])
+            span.set_attribute("sos.completion_chars", completion_chars)
+        status = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        # Клиент отключился или перестал читать поток: экономия — оставшаяся часть ожидаемого ответа
+        status = "cancelled"
+        saved_tokens = max(0, estimate_completion_tokens(input_chars, max_tokens) - completion_chars // 3)
+        raise
+    finally:
+        scheduler.release(ticket)
+        _record_usage(mode, model, status, input_chars, started, tokens, saved_tokens)
+
+
+async def repair_fragment_with_llm(fragment: str, error_message: str) -> str:
+    """Отправляет модели только сломанный фрагмент кода и возвращает исправленный"""
+    system_prompt = '''Ты — Python-разработчик. Тебе дан фрагмент Python-кода (класс или метод теста Allure) с синтаксической ошибкой.
+Исправь ошибку, не меняя логику, имена, декораторы и текст шагов.
+Верни ТОЛЬКО исправленный фрагмент целиком, без markdown и пояснений.'''
+    user_content = f"Ошибка: {error_message}\n\n{fragment}"
+    try:
+        response = await chat_completion(
+            "repair",
+            [
+                {"role": "system", "content": safe_str(system_prompt)},
+                {"role": "user", "content": safe_str(user_content)},
+            ],
+            max_tokens=min(8000, len(fragment) // 2 + 500),  # Фрагмент примерно того же размера
+            temperature=0,
+        )
+    except Exception as api_error:
+        log.error("Ошибка при вызове OpenAI API: %s - %s", type(api_error).__name__, safe_str(api_error))
+        return ""
+
+    fixed = (response.choices[0].message.content or "").strip()
+    if fixed.startswith("```python"):
+        fixed = fixed[9:]
+    if fixed.startswith("```"):
+        fixed = fixed[3:]
+    if fixed.endswith("```"):
+        fixed = fixed[:-3]
+    return fixed.strip("\n")
+
+
+async def ensure_valid_python(code: str, mode: str) -> str:
+    """Проверяет компиляцию сгенерированного кода и точечно чинит сломанные функции/классы.
+
+    Если исправить в пределах REPAIR_MAX_ATTEMPTS не удалось, возвращается лучший полученный вариант.
+    """
+    with stage("compile_check"):
+        error = check_code(code)
+    if error is None:
+        return code
+    log.warning("Сгенерированный код не компилируется: %s (строка %s)", error.msg, error.lineno, extra=kv(mode=mode))
+    with stage("repair"):
+        code, report = await repair_code(code, repair_fragment_with_llm, REPAIR_MAX_ATTEMPTS)
+    log.info(
+        "Исправление сгенерированного кода завершено",
+        extra=kv(mode=mode, attempts=report["attempts"], repaired=len(report["repaired"]), valid=report["valid"]),
+    )
+    return code
+
+
+green_cache = SimilarityCache()
+
+
 @app.post("/generate", response_model=GenerateResponse)
 async def generate_test_code(request: GenerateRequest):
-    """Генерирует код тестов Allure на основе текстовых требований"""
+    """Генерирует код тестов Allure на основе текстовых требований.
+
+    Требования, совпадающие с прошлыми после нормализации, обслуживаются из green_cache с подстановкой
+    owner/feature/story/suite; для похожих требований прошлый результат передается модели как основа.
+    """
+    model_hint_var.set(request.model_hint)
+    scope = request.model_hint or ""
+    started = time.perf_counter()
+    with stage("cache"):
+        match = green_cache.lookup(request.text, scope)
+    if match is not None and match.exact:
+        saved = estimate_call_tokens(len(request.text), 5000)
+        log.info("Результат Green взят из кеша", extra=kv(similarity=match.similarity))
+        _record_usage("green", "cache", "cached", len(request.text), started,
+                      {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}, saved)
+        return GenerateResponse(code=match.code, cache="exact")
+    response = await generate_green(request, match.code if match is not None else None)
+    if check_code(response.code) is None:
+        green_cache.put(request.text, response.code, scope)
+    if match is not None:
+        response.cache = "seeded"
+    return response
+
+
+async def generate_green(request: GenerateRequest, seed: Optional[str] = None) -> GenerateResponse:
+    """Генерация Green моделью; seed — прошлый результат для похожих требований"""
     try:
         # Логируем начало обработки (для отладки)
-        print(f"[DEBUG] Начало обработки запроса, длина текста: {len(request.text)}")
+        log.debug("Начало обработки запроса (режим Green)", extra=kv(text_length=len(request.text)))
         # Системный промпт для генерации тест-кейсов
         system_prompt = '''Ты — Senior QA Automation Engineer и Python-разработчик, эксперт по тест-дизайну, Allure TestOps as Code и паттерну AAA (Arrange-Act-Assert).
 
@@ -395,6 +885,13 @@ from allure_commons._allure import step as allure_step
         # Используем только данные, которые приходят с фронтенда
         # Убеждаемся, что все строки правильно обработаны
         user_content = safe_str(request.text)
+        if seed is not None:
+            # Системный промпт не меняется (кешируется провайдером), основа добавляется после требований
+            user_content += (
+                "\n\nДля почти таких же требований ранее сгенерирован код ниже. Возьми его за основу: сохрани "
+                "тест-кейсы, которые по-прежнему соответствуют требованиям, и измени только то, что отличается.\n\n"
+                + safe_str(seed)
+            )
         system_content = safe_str(system_prompt)
         
         messages = [
@@ -411,45 +908,23 @@ from allure_commons._allure import step as allure_step
         # Вызываем OpenAI API
         # Используем стандартный метод create и парсим JSON ответ
         try:
-            # Получаем API ключ из клиента для логирования
-            client_api_key = getattr(client, 'api_key', api_key) if hasattr(client, 'api_key') else api_key
-            client_api_key_str = str(client_api_key) if client_api_key else "НЕТ"
-            
-            # Логируем информацию о запросе для отладки
-            print(f"[DEBUG] Отправка запроса к OpenAI API, модель: Qwen/Qwen3-235B-A22B-Instruct-2507", file=sys.stderr)
-            if client_api_key_str and len(client_api_key_str) > 10:
-                print(f"[DEBUG] API ключ клиента (первые 10 символов): {client_api_key_str[:10]}... (длина: {len(client_api_key_str)})", file=sys.stderr)
-            else:
-                print(f"[ERROR] API ключ клиента пустой или слишком короткий: '{client_api_key_str}' (длина: {len(client_api_key_str) if client_api_key_str else 0})", file=sys.stderr)
-            print(f"[DEBUG] Base URL: {url}", file=sys.stderr)
+            log.debug("Отправка запроса к OpenAI API", extra=kv(mode="green"))
             
-            response = client.chat.completions.create(
-                model="Qwen/Qwen3-235B-A22B-Instruct-2507",
+            response = await chat_completion(
+                "green",
+                messages,
                 max_tokens=5000,  # Увеличено для полных ответов (предыдущая ошибка была из-за обрезанного JSON)
                 temperature=0.5,
-                presence_penalty=0,
-                top_p=0.95,
-                messages=messages,
             )
         except Exception as api_error:
-            # Детальное логирование ошибки API
+            # Детальное логирование ошибки API (без данных ключа)
             error_type = type(api_error).__name__
             error_msg = safe_str(api_error)
-            client_api_key = getattr(client, 'api_key', api_key) if hasattr(client, 'api_key') else api_key
-            client_api_key_str = str(client_api_key) if client_api_key else "НЕТ"
-            
-            print(f"[ERROR] Ошибка при вызове OpenAI API:", file=sys.stderr)
-            print(f"[ERROR] Тип ошибки: {error_type}", file=sys.stderr)
-            print(f"[ERROR] Сообщение: {error_msg}", file=sys.stderr)
-            if client_api_key_str and len(client_api_key_str) > 10:
-                print(f"[ERROR] API ключ клиента (первые 10 символов): {client_api_key_str[:10]}... (длина: {len(client_api_key_str)})", file=sys.stderr)
-            else:
-                print(f"[ERROR] API ключ клиента пустой или слишком короткий: '{client_api_key_str}' (длина: {len(client_api_key_str) if client_api_key_str else 0})", file=sys.stderr)
-            print(f"[ERROR] Base URL: {url}", file=sys.stderr)
+            log.error("Ошибка при вызове OpenAI API: %s", error_msg, extra=kv(error_type=error_type, base_url=url))
             
             # Специальная обработка timeout ошибок
             if "timeout" in error_msg.lower() or "APITimeoutError" in error_type:
-                print(f"[WARNING] Запрос превысил время ожидания (timeout). Возможно, запрос слишком большой или сервер перегружен.", file=sys.stderr)
+                log.warning("Запрос превысил время ожидания (timeout). Возможно, запрос слишком большой или сервер перегружен.")
                 raise HTTPException(
                     status_code=504,
                     detail="Запрос к API превысил время ожидания. Попробуйте уменьшить размер запроса или повторить попытку позже."
@@ -464,20 +939,13 @@ from allure_commons._allure import step as allure_step
         # Проверяем, не был ли ответ обрезан
         finish_reason = response.choices[0].finish_reason if hasattr(response.choices[0], 'finish_reason') else None
         if finish_reason == "length":
-            print(f"[WARNING] Ответ был обрезан из-за достижения лимита max_tokens!", file=sys.stderr)
-            print(f"[WARNING] Рекомендуется увеличить max_tokens для полного ответа.", file=sys.stderr)
+            log.warning("Ответ был обрезан из-за достижения лимита max_tokens", extra=kv(finish_reason=finish_reason))
         
         if not response_text:
             raise HTTPException(status_code=500, detail="Пустой ответ от OpenAI")
         
         # Логируем информацию о ответе для отладки
-        response_length = len(response_text)
-        print(f"[DEBUG] Получен ответ от OpenAI, длина: {response_length} символов", file=sys.stderr)
-        if response_length > 200:
-            print(f"[DEBUG] Начало ответа: {response_text[:100]}...", file=sys.stderr)
-            print(f"[DEBUG] Конец ответа: ...{response_text[-100:]}", file=sys.stderr)
-        else:
-            print(f"[DEBUG] Полный ответ: {response_text}", file=sys.stderr)
+        debug_payload(log, "Получен ответ от OpenAI", response_text)
         
         # Очищаем ответ от возможных markdown блоков
         cleaned_response = response_text.strip()
@@ -501,6 +969,17 @@ from allure_commons._allure import step as allure_step
             for indicator in python_indicators
         )
         
+        # Основной путь: отчет разбирается и валидируется из строки за один проход (без промежуточного dict).
+        # Ответ с ошибкой или с другой структурой разбирается ниже как обычный JSON
+        if cleaned_response.startswith("{"):
+            try:
+                with stage("validate"):
+                    report = parse_report_json(cleaned_response)
+            except ValidationError:
+                report = None
+            if report is not None:
+                return GenerateResponse(code=generate_allure_test_code(report))
+
         # Пытаемся распарсить как JSON
         try:
             response_json = json.loads(cleaned_response)
@@ -524,7 +1003,7 @@ from allure_commons._allure import step as allure_step
                 elif "constraint" in error_message.lower() or "did not conform" in error_message.lower():
                     error_message = "Модель не смогла сгенерировать ответ в требуемом формате. Попробуйте переформулировать запрос."
                 
-                print(f"[ERROR] OpenAI API вернул ошибку: {error_message}", file=sys.stderr)
+                log.error("OpenAI API вернул ошибку: %s", error_message)
                 raise HTTPException(
                     status_code=400,
                     detail=f"Ошибка от OpenAI API: {error_message}"
@@ -532,7 +1011,7 @@ from allure_commons._allure import step as allure_step
             
             # Если это валидный JSON с testCases
             if isinstance(response_json, dict) and "testCases" in response_json:
-                report = AllureTestOpsReport(**response_json)
+                report = AllureTestOpsReport.model_validate(response_json)
                 code = generate_allure_test_code(report)
                 if isinstance(code, bytes):
                     code = code.decode('utf-8', errors='replace')
@@ -540,7 +1019,7 @@ from allure_commons._allure import step as allure_step
                 return GenerateResponse(code=code)
             
             # Если это JSON, но не содержит testCases - это ошибка
-            print(f"[ERROR] Ответ от OpenAI не содержит поле testCases. Структура: {list(response_json.keys()) if isinstance(response_json, dict) else type(response_json)}", file=sys.stderr)
+            log.error("Ответ от OpenAI не содержит поле testCases", extra=kv(structure=list(response_json.keys()) if isinstance(response_json, dict) else type(response_json).__name__))
             raise HTTPException(
                 status_code=500,
                 detail="Ответ от OpenAI API не содержит ожидаемую структуру данных. Попробуйте переформулировать запрос."
@@ -549,13 +1028,13 @@ from allure_commons._allure import step as allure_step
         except json.JSONDecodeError:
             # Не JSON - проверяем, является ли это Python кодом
             if is_python_code:
-                # Модель вернула Python код напрямую - возвращаем его
-                print(f"[DEBUG] Модель вернула Python код напрямую, длина: {len(cleaned_response)} символов", file=sys.stderr)
-                return GenerateResponse(code=cleaned_response)
+                # Модель вернула Python код напрямую - проверяем компиляцию, чиним сломанные фрагменты и возвращаем
+                log.debug("Модель вернула Python код напрямую", extra=kv(code_length=len(cleaned_response)))
+                return GenerateResponse(code=await ensure_valid_python(cleaned_response, "green"))
             else:
                 # Это обычный текст - возвращаем его как код (возможно, модель дала объяснение)
-                print(f"[WARNING] Модель вернула текст вместо кода, возвращаем как есть. Длина: {len(cleaned_response)} символов", file=sys.stderr)
-                print(f"[WARNING] Начало ответа: {cleaned_response[:200]}...", file=sys.stderr)
+                log.warning("Модель вернула текст вместо кода, возвращаем как есть", extra=kv(response_length=len(cleaned_response)))
+                debug_payload(log, "Текстовый ответ модели", cleaned_response)
                 return GenerateResponse(code=cleaned_response)
         
         # Если дошли сюда, значит это был JSON, но что-то пошло не так
@@ -575,14 +1054,8 @@ from allure_commons._allure import step as allure_step
             error_type = type(e).__name__
             error_msg = safe_str(e)
             
-            # Пытаемся получить traceback для отладки
-            try:
-                tb_str = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
-                tb_str = safe_str(tb_str)
-                # Логируем полный traceback в консоль (для отладки)
-                print(f"[ERROR] Traceback: {tb_str}", file=sys.stderr)
-            except:
-                pass
+            # Логируем ошибку вместе с traceback (запись в поток выполняет фоновый поток логгера)
+            log.error("Ошибка при генерации кода (%s): %s", error_type, error_msg, exc_info=e)
             
             # Формируем сообщение об ошибке
             if error_msg:
@@ -607,56 +1080,63 @@ from allure_commons._allure import step as allure_step
         except Exception as inner_e:
             # Если произошла ошибка при обработке ошибки, используем базовое сообщение
             try:
-                print(f"[ERROR] Ошибка при обработке ошибки: {safe_str(inner_e)}", file=sys.stderr)
+                log.error("Ошибка при обработке ошибки: %s", safe_str(inner_e))
             except:
                 pass
             raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
 
+_JSON_START_RE = re.compile(r"\s*[{\[]")
+
+
 def parse_openapi_spec(spec_str: str) -> Dict[str, Any]:
     """Парсит OpenAPI спецификацию из YAML или JSON"""
     try:
-        # Проверяем, что строка не пустая
-        if not spec_str or len(spec_str.strip()) == 0:
+        # Проверяем, что строка не пустая (isspace не копирует строку, в отличие от strip)
+        if not spec_str or spec_str.isspace():
             raise ValueError("OpenAPI спецификация пустая")
         
-        spec_length = len(spec_str)
-        print(f"[DEBUG] Размер OpenAPI спецификации для парсинга: {spec_length} символов ({(spec_length / 1024 / 1024):.2f} MB)", file=sys.stderr)
+        debug_payload(log, "Парсинг OpenAPI спецификации", spec_str)
         
-        # Показываем первые 200 символов для отладки
-        preview = spec_str[:200] if len(spec_str) > 200 else spec_str
-        print(f"[DEBUG] Начало спецификации: {preview}...", file=sys.stderr)
+        # JSON разбирается на порядок быстрее и с меньшим расходом памяти, чем тот же текст через YAML
+        if _JSON_START_RE.match(spec_str):
+            try:
+                spec = json.loads(spec_str)
+                log.debug("Успешно распарсено как JSON")
+                return spec
+            except json.JSONDecodeError as json_error:
+                log.debug("Не удалось распарсить как JSON, пробуем YAML: %s", json_error)
         
         # Пытаемся распарсить как YAML
         try:
             spec = yaml.safe_load(spec_str)
             if spec is None:
                 raise ValueError("YAML парсер вернул None - возможно, файл пустой или невалидный")
-            print(f"[DEBUG] Успешно распарсено как YAML", file=sys.stderr)
+            log.debug("Успешно распарсено как YAML")
             return spec
         except yaml.YAMLError as yaml_error:
-            print(f"[DEBUG] Не удалось распарсить как YAML: {safe_str(yaml_error)}", file=sys.stderr)
+            log.debug("Не удалось распарсить как YAML: %s", yaml_error)
             # Если не получилось, пытаемся как JSON
             try:
                 spec = json.loads(spec_str)
                 if spec is None:
                     raise ValueError("JSON парсер вернул None - возможно, файл пустой или невалидный")
-                print(f"[DEBUG] Успешно распарсено как JSON", file=sys.stderr)
+                log.debug("Успешно распарсено как JSON")
                 return spec
             except json.JSONDecodeError as json_error:
                 error_msg = safe_str(json_error)
-                print(f"[ERROR] Не удалось распарсить как JSON: {error_msg}", file=sys.stderr)
+                log.error("Не удалось распарсить как JSON: %s", error_msg)
                 raise ValueError(f"Не удалось распарсить OpenAPI спецификацию. YAML ошибка: {safe_str(yaml_error)}, JSON ошибка: {error_msg}")
     except ValueError:
         # Пробрасываем ValueError как есть
         raise
     except Exception as e:
         error_msg = safe_str(e)
-        print(f"[ERROR] Неожиданная ошибка при парсинге: {error_msg}", file=sys.stderr)
+        log.error("Неожиданная ошибка при парсинге: %s", error_msg)
         raise ValueError(f"Ошибка при парсинге OpenAPI спецификации: {error_msg}")
 
 
-def generate_tests_from_openapi(openapi_spec: Dict[str, Any]) -> str:
+async def generate_tests_from_openapi(openapi_spec: Dict[str, Any], profile: str = "default") -> str:
     """Генерирует Python код тестов на основе OpenAPI спецификации с использованием LLM"""
     try:
         # Системный промпт для генерации автоматизированных тестов из OpenAPI
@@ -699,6 +1179,9 @@ from allure_commons._allure import step as allure_step
 
 Не придумывай значения owner/feature/story/priority — используй те, что переданы во входных данных пользователя.
 
+Каждый тест помечай операцией, которую он проверяет, декоратором:
+@allure.label("operation", "<METHOD> <path>"), например @allure.label("operation", "GET /users/{id}").
+
 Если пользователь не просит иное, ориентируйся на 25–35 тест-кейсов. Если указано точное число — соблюдай его.
 
 Ты обязан соблюдать:
@@ -712,7 +1195,11 @@ from allure_commons._allure import step as allure_step
 '''
         
         # Преобразуем OpenAPI спецификацию в JSON строку для промпта
-        openapi_json = json.dumps(openapi_spec, ensure_ascii=False, indent=2)
+        # Компактный JSON без отступов: меньше памяти и токенов, чем indent=2
+        with stage("serialize") as span:
+            openapi_json = json.dumps(openapi_spec, ensure_ascii=False, separators=(",", ":"))
+            span.set_attribute("sos.spec_json_chars", len(openapi_json))
+        spec_json_length = len(openapi_json)
         
         # Формируем сообщения для OpenAI
         user_content = f'''Сгенерируй автоматизированные тесты на Python для следующей OpenAPI спецификации:
@@ -720,6 +1207,10 @@ from allure_commons._allure import step as allure_step
 {openapi_json}
 
 Создай полный набор тестов со всеми необходимыми проверками, обработкой параметров и валидацией ответов.'''
+        if profile == "xdist":
+            user_content += "\n\n" + XDIST_INSTRUCTIONS
+        # JSON уже скопирован в промпт — промежуточную строку освобождаем сразу
+        del openapi_json
         
         messages = [
             {
@@ -732,18 +1223,15 @@ from allure_commons._allure import step as allure_step
             }
         ]
         
-        print(f"[DEBUG] Отправка запроса к OpenAI API для генерации тестов из OpenAPI", file=sys.stderr)
-        print(f"[DEBUG] Размер OpenAPI спецификации (JSON): {len(openapi_json)} символов", file=sys.stderr)
+        log.debug("Отправка запроса к OpenAI API для генерации тестов из OpenAPI", extra=kv(mode="lime", spec_json_length=spec_json_length))
         
         # Вызываем OpenAI API
         try:
-            response = client.chat.completions.create(
-                model="Qwen/Qwen3-235B-A22B-Instruct-2507",
+            response = await chat_completion(
+                "lime",
+                messages,
                 max_tokens=8000,  # Увеличено для больших спецификаций
                 temperature=0.3,  # Низкая температура для более детерминированного кода
-                presence_penalty=0,
-                top_p=0.95,
-                messages=messages,
             )
             
             # Получаем текст ответа
@@ -753,30 +1241,73 @@ from allure_commons._allure import step as allure_step
                 raise ValueError("Пустой ответ от OpenAI")
             
             # Очищаем ответ от markdown блоков, если они есть
-            code = response_text.strip()
-            if code.startswith("```python"):
-                code = code[9:]  # Убираем ```python
-            if code.startswith("```"):
-                code = code[3:]  # Убираем ```
-            if code.endswith("```"):
-                code = code[:-3]  # Убираем закрывающий ```
-            code = code.strip()
+            with stage("postprocess"):
+                code = response_text.strip()
+                if code.startswith("```python"):
+                    code = code[9:]  # Убираем ```python
+                if code.startswith("```"):
+                    code = code[3:]  # Убираем ```
+                if code.endswith("```"):
+                    code = code[:-3]  # Убираем закрывающий ```
+                code = code.strip()
             
-            print(f"[DEBUG] Получен ответ от OpenAI, длина: {len(code)} символов", file=sys.stderr)
+            log.debug("Получен ответ от OpenAI", extra=kv(code_length=len(code)))
             
             return code
             
         except Exception as api_error:
             error_type = type(api_error).__name__
             error_msg = safe_str(api_error)
-            print(f"[ERROR] Ошибка при вызове OpenAI API: {error_type} - {error_msg}", file=sys.stderr)
+            log.error("Ошибка при вызове OpenAI API: %s - %s", error_type, error_msg)
             raise
+    except Exception as e:
+        error_msg = safe_str(e)
+        log.error("Ошибка при генерации тестов из OpenAPI: %s", error_msg, exc_info=True)
+        raise
+
+
+# {param} в пути операции
+_PATH_PARAM_RE = re.compile(r"\{([^{}/]+)\}")
+
+
+def _sample_path_value(param: Optional[Dict[str, Any]], spec: Dict[str, Any]) -> str:
+    """Значение path параметра для шаблонного теста: example, default или enum из схемы, иначе по типу"""
+    param = param or {}
+    schema = deref(param.get("schema") or {}, spec)
+    schema = schema if isinstance(schema, dict) else {}
+    value: Any = next((candidate for candidate in (param.get("example"), schema.get("example"), schema.get("default"))
+                       if isinstance(candidate, (str, int, float))), None)
+    if value is None and isinstance(schema.get("enum"), list) and schema["enum"]:
+        value = schema["enum"][0]
+    if value is None:
+        if schema.get("format") == "uuid":
+            value = "00000000-0000-0000-0000-000000000001"
+        else:
+            value = "test" if schema.get("type") == "string" else 1
+    return quote(str(value), safe="")
+
+
+def generate_template_tests_from_openapi(openapi_spec: Dict[str, Any],
+                                         assertions: Optional[Dict[str, List[str]]] = None,
+                                         profile: str = "default") -> str:
+    """Генерирует Python код тестов из OpenAPI спецификации по шаблону, без обращения к LLM.
+
+    assertions — дополнительные проверки ответа по операциям ({"GET /users": ["assert ..."]}),
+    которые в гибридном режиме дописывает LLM. В профиле xdist тесты вызывают API через фикстуру
+    api из conftest.py (относительные пути), а классы с изменяющими операциями получают xdist_group.
+    """
+    xdist = profile == "xdist"
+    # Клиент запросов в тесте и префикс URL: в профиле xdist базовый URL задает сессия из conftest.py
+    http = "api" if xdist else "requests"
+    try:
+        code_lines = []
         
         # Импорты
         code_lines.append("import allure")
         code_lines.append("import pytest")
         code_lines.append("from pytest import mark")
-        code_lines.append("import requests")
+        if not xdist:
+            code_lines.append("import requests")
         code_lines.append("from typing import Optional, Dict, Any")
         code_lines.append("")
         code_lines.append("")
@@ -789,7 +1320,7 @@ from allure_commons._allure import step as allure_step
         # Базовый URL (если есть в спецификации)
         servers = openapi_spec.get("servers", [])
         base_url = servers[0].get("url", "https://api.example.com") if servers else "https://api.example.com"
-        base_url = safe_str(base_url)
+        base_url = "" if xdist else safe_str(base_url)
         
         # Генерируем тесты для каждого endpoint
         paths = openapi_spec.get("paths", {})
@@ -797,39 +1328,40 @@ from allure_commons._allure import step as allure_step
         # Группируем тесты по тегам
         tests_by_tag: Dict[str, list] = {}
         
-        for path, path_item in paths.items():
-            if not isinstance(path_item, dict):
+        for method, path, operation, shared_params in iter_operations(openapi_spec):
+            if method not in ["get", "post", "put", "delete", "patch"]:
                 continue
-                
-            for method, operation in path_item.items():
-                if method.lower() not in ["get", "post", "put", "delete", "patch"]:
-                    continue
-                    
-                if not isinstance(operation, dict):
-                    continue
-                
-                operation_id = safe_str(operation.get("operationId", f"{method}_{path.replace('/', '_').replace('{', '').replace('}', '')}"))
-                summary = safe_str(operation.get("summary", operation_id))
-                tags = operation.get("tags", ["API"])
-                tag = safe_str(tags[0] if tags else "API")
-                
-                if tag not in tests_by_tag:
-                    tests_by_tag[tag] = []
-                
-                tests_by_tag[tag].append({
-                    "path": path,
-                    "method": method,
-                    "operation": operation,
-                    "operation_id": operation_id,
-                    "summary": summary
-                })
-        
+
+            operation_id = safe_str(operation.get("operationId", f"{method}_{path.replace('/', '_').replace('{', '').replace('}', '')}"))
+            summary = safe_str(operation.get("summary", operation_id))
+            tags = operation.get("tags", ["API"])
+            tag = safe_str(tags[0] if tags else "API")
+
+            if tag not in tests_by_tag:
+                tests_by_tag[tag] = []
+
+            tests_by_tag[tag].append({
+                "path": path,
+                "method": method,
+                "operation": operation,
+                # Параметры уровня path вместе с параметрами операции, $ref раскрыты
+                "parameters": operation_parameters(openapi_spec, operation, shared_params),
+                "operation_id": operation_id,
+                "summary": summary
+            })
+
         # Генерируем классы тестов для каждого тега
+        class_names: set = set()
         for tag, tests in tests_by_tag.items():
-            class_name = f"{tag.replace(' ', '').replace('-', '')}Tests"
+            # Тег — произвольный текст (2fa, v1.users): имя класса делаем идентификатором и уникальным
+            class_name = unique_name(_python_name(f"{tag.replace(' ', '').replace('-', '')}Tests", "Tag"), class_names)
+            test_names: set = set()
             
             code_lines.append(f"@allure.feature(\"{escape_string(tag)}\")")
             code_lines.append(f"@allure.suite(\"{escape_string(api_title)}\")")
+            if xdist and any(test["method"].lower() in MUTATING_METHODS for test in tests):
+                # Изменяющие тесты класса выполняются в одном воркере (pytest -n auto --dist loadgroup)
+                code_lines.append(f"@pytest.mark.xdist_group(name=\"{escape_string(tag)}\")")
             code_lines.append(f"class {class_name}:")
             code_lines.append("")
             
@@ -840,38 +1372,34 @@ from allure_commons._allure import step as allure_step
                 operation_id = test_info["operation_id"]
                 summary = test_info["summary"]
                 
-                # Создаем имя метода теста
-                test_method_name = f"test_{operation_id.lower().replace('-', '_').replace(' ', '_')}"
-                # Очищаем имя метода от недопустимых символов
-                test_method_name = "".join(c if c.isalnum() or c == "_" else "_" for c in test_method_name)
+                # Создаем имя метода теста: get-user и get_user дают одно имя, поэтому оно уникально в классе
+                test_method_name = unique_name(_python_name(f"test_{operation_id.lower()}", "test_"), test_names)
                 
                 code_lines.append(f"    @allure.story(\"{escape_string(summary)}\")")
+                code_lines.append(f"    @allure.label(\"operation\", \"{escape_string(operation_key(method, path))}\")")
                 code_lines.append(f"    @allure.title(\"{escape_string(summary)}\")")
-                code_lines.append(f"    def {test_method_name}(self):")
-                code_lines.append(f"        \"\"\"Тест для {method.upper()} {path}\"\"\"")
-                code_lines.append(f"        with allure.step(f\"Выполнение запроса {method.upper()} {path}\"):")
-                
-                # Обрабатываем path parameters
-                path_params = [p for p in operation.get("parameters", []) if p.get("in") == "path"]
-                if path_params:
-                    # Заменяем {param} на {param} в f-string
-                    url_path = path
-                    for param in path_params:
-                        param_name = param.get("name")
-                        url_path = url_path.replace(f"{{{param_name}}}", f"{{{{'{param_name}'}}}}")
-                    code_lines.append(f"            # Заполните path параметры перед использованием")
-                    code_lines.append(f"            url = f\"{base_url}{url_path}\"")
-                else:
-                    code_lines.append(f"            url = f\"{base_url}{path}\"")
-                
+                code_lines.append(f"    def {test_method_name}(self, api):" if xdist else f"    def {test_method_name}(self):")
+                code_lines.append(f"        \"\"\"Тест для {method.upper()} {escape_string(path)}\"\"\"")
+                code_lines.append(f"        with allure.step(\"Выполнение запроса {method.upper()} {escape_string(path)}\"):")
+
+                # Обрабатываем path parameters: {param} заменяется примерным значением, URL — обычная строка
+                # (в f-string {id} подставил бы встроенную функцию id)
+                declared = {p.get("name"): p for p in test_info["parameters"] if p.get("in") == "path"}
+                url_path = _PATH_PARAM_RE.sub(
+                    lambda match: _sample_path_value(declared.get(match.group(1)), openapi_spec), path)
+                if url_path != path:
+                    code_lines.append("            # Примерные значения path параметров: замените на существующие объекты")
+                code_lines.append(f"            url = \"{escape_string(base_url + url_path)}\"")
+
                 # Обрабатываем query параметры
-                query_params = [p for p in operation.get("parameters", []) if p.get("in") == "query"]
+                query_params = [p for p in test_info["parameters"] if p.get("in") == "query"]
                 if query_params:
                     code_lines.append("            params = {}")
                     for param in query_params:
                         param_name = safe_str(param.get("name"))
-                        param_desc = safe_str(param.get("description", ""))
-                        param_schema = param.get("schema", {})
+                        # Описание попадает в комментарий: переводы строк вывели бы его текст в код
+                        param_desc = " ".join(safe_str(param.get("description", "")).split())
+                        param_schema = deref(param.get("schema") or {}, openapi_spec)
                         param_type = param_schema.get("type", "string")
                         param_default = param_schema.get("default")
                         
@@ -901,24 +1429,24 @@ from allure_commons._allure import step as allure_step
                 
                 # Генерируем запрос
                 if method.lower() == "get":
-                    code_lines.append("            response = requests.get(url, params=params)")
+                    code_lines.append(f"            response = {http}.get(url, params=params)")
                 elif method.lower() == "post":
                     if has_body:
-                        code_lines.append("            response = requests.post(url, json=json_data, params=params)")
+                        code_lines.append(f"            response = {http}.post(url, json=json_data, params=params)")
                     else:
-                        code_lines.append("            response = requests.post(url, params=params)")
+                        code_lines.append(f"            response = {http}.post(url, params=params)")
                 elif method.lower() == "put":
                     if has_body:
-                        code_lines.append("            response = requests.put(url, json=json_data, params=params)")
+                        code_lines.append(f"            response = {http}.put(url, json=json_data, params=params)")
                     else:
-                        code_lines.append("            response = requests.put(url, params=params)")
+                        code_lines.append(f"            response = {http}.put(url, params=params)")
                 elif method.lower() == "delete":
-                    code_lines.append("            response = requests.delete(url, params=params)")
+                    code_lines.append(f"            response = {http}.delete(url, params=params)")
                 elif method.lower() == "patch":
                     if has_body:
-                        code_lines.append("            response = requests.patch(url, json=json_data, params=params)")
+                        code_lines.append(f"            response = {http}.patch(url, json=json_data, params=params)")
                     else:
-                        code_lines.append("            response = requests.patch(url, params=params)")
+                        code_lines.append(f"            response = {http}.patch(url, params=params)")
                 
                 # Обрабатываем ответы
                 responses = operation.get("responses", {})
@@ -948,65 +1476,441 @@ from allure_commons._allure import step as allure_step
                 code_lines.append("            if response.status_code != 204:")
                 code_lines.append("                response_json = response.json()")
                 code_lines.append("                assert isinstance(response_json, (dict, list)), \"Ответ должен быть JSON объектом или массивом\"")
+                for assertion in (assertions or {}).get(operation_key(method, path), []):
+                    code_lines.append(f"                {assertion}")
                 
                 code_lines.append("")
                 code_lines.append("")
         
-        return "\n".join(code_lines)
+        code = "\n".join(code_lines)
+        error = check_code(code)
+        if error is not None:
+            if assertions:
+                # Проверки от модели разобраны по одной, но модуль должен компилироваться целиком
+                log.warning("Шаблонный модуль с проверками модели не компилируется, проверки отброшены: %s (строка %s)",
+                            error.msg, error.lineno)
+                return generate_template_tests_from_openapi(openapi_spec, None, profile)
+            raise ValueError(f"Шаблонный модуль не компилируется: {error.msg} (строка {error.lineno})")
+        return code
     except Exception as e:
         error_msg = safe_str(e)
-        print(f"[ERROR] Ошибка при генерации тестов из OpenAPI: {error_msg}", file=sys.stderr)
-        import traceback
-        print(f"[ERROR] Traceback: {traceback.format_exc()}", file=sys.stderr)
+        log.error("Ошибка при шаблонной генерации тестов из OpenAPI: %s", error_msg, exc_info=True)
         raise
 
 
-@app.post("/lime", response_model=GenerateResponse)
+def _parse_assertion_lines(lines: Any) -> List[str]:
+    """Оставляет только однострочные assert, которые являются валидным Python"""
+    valid = []
+    if not isinstance(lines, list):
+        return valid
+    for line in lines:
+        if not isinstance(line, str):
+            continue
+        line = line.strip()
+        try:
+            tree = ast.parse(line)
+        except SyntaxError:
+            continue
+        if len(tree.body) == 1 and isinstance(tree.body[0], ast.Assert):
+            valid.append(line)
+    return valid
+
+
+async def generate_hybrid_tests_from_openapi(openapi_spec: Dict[str, Any], profile: str = "default") -> str:
+    """Гибридный режим: скелет тестов строит шаблон, LLM дописывает только проверки ответов.
+
+    Модель получает компактное описание ответов каждой операции и возвращает JSON
+    {"<METHOD> <path>": ["assert ...", ...]}, поэтому генерируется на порядок меньше токенов,
+    чем при генерации всего модуля.
+    """
+    system_prompt = '''Ты — Senior QA Automation Engineer. Тебе дан список операций REST API с описанием ответов.
+Для каждой операции напиши проверки успешного ответа на Python.
+
+Доступные переменные: response (requests.Response) и response_json (разобранное тело ответа).
+Каждая проверка — одна строка, начинающаяся с assert, с сообщением об ошибке на русском языке.
+Проверяй обязательные поля, типы и значения из схемы ответа. Не больше 6 проверок на операцию.
+
+Верни ТОЛЬКО JSON-объект без markdown: {"<METHOD> <path>": ["assert ...", ...], ...}
+'''
+    operations = []
+    for method, path, operation, shared_params in iter_operations(openapi_spec):
+        if method not in ("get", "post", "put", "delete", "patch"):
+            continue
+        resolved = resolved_operation(openapi_spec, method, path, operation, shared_params)
+        operations.append({
+            "operation": operation_key(method, path),
+            "summary": operation.get("summary", ""),
+            "responses": resolved.get("responses", {}),
+        })
+
+    assertions: Dict[str, List[str]] = {}
+    for batch_start in range(0, len(operations), HYBRID_BATCH_SIZE):
+        batch = operations[batch_start:batch_start + HYBRID_BATCH_SIZE]
+        user_content = json.dumps(batch, ensure_ascii=False, separators=(",", ":"), default=str)
+        try:
+            response = await chat_completion(
+                "hybrid",
+                [
+                    {"role": "system", "content": safe_str(system_prompt)},
+                    {"role": "user", "content": safe_str(user_content)},
+                ],
+                max_tokens=min(8000, 300 * len(batch)),
+                temperature=0.2,
+            )
+        except Exception as api_error:
+            log.error("Ошибка при вызове OpenAI API: %s - %s", type(api_error).__name__, safe_str(api_error))
+            raise
+
+        response_text = (response.choices[0].message.content or "").strip()
+        if response_text.startswith("```"):
+            response_text = response_text.split("\n", 1)[1] if "\n" in response_text else ""
+        if response_text.endswith("```"):
+            response_text = response_text[:-3]
+        try:
+            batch_assertions = json.loads(response_text)
+        except json.JSONDecodeError:
+            # Скелет остается рабочим и без проверок от модели
+            log.warning("Модель вернула не JSON в гибридном режиме, проверки для пакета пропущены", extra=kv(batch_size=len(batch)))
+            continue
+        if isinstance(batch_assertions, dict):
+            for key, lines in batch_assertions.items():
+                assertions[key] = _parse_assertion_lines(lines)
+
+    with stage("template"):
+        return generate_template_tests_from_openapi(openapi_spec, assertions, profile)
+
+
+async def generate_lime_code(openapi_spec: Dict[str, Any], mode: str = "llm",
+                             coverage_rounds: Optional[int] = None, matrix: Optional[CoverageMatrix] = None,
+                             profile: str = "default") -> str:
+    """Генерирует тесты по OpenAPI в выбранном режиме (llm, template, hybrid или auto) и профиле вывода.
+
+    В режимах с LLM непокрытые ячейки матрицы покрытия дозапрашиваются у модели
+    (не больше coverage_rounds раундов); шаблонный режим к модели не обращается.
+    Если передана matrix (построенная по той же спецификации), в ней отмечается покрытие итогового модуля.
+    """
+    if mode == "auto":
+        operations_count = sum(1 for _ in iter_operations(openapi_spec))
+        mode = "template" if operations_count <= LIME_TEMPLATE_MAX_OPERATIONS else "hybrid"
+        log.debug("Автовыбор режима генерации Lime", extra=kv(mode=mode, operations=operations_count))
+    if mode == "template":
+        with stage("template"):
+            code = generate_template_tests_from_openapi(openapi_spec, profile=profile)
+        rounds = 0
+    elif mode == "hybrid":
+        code = await generate_hybrid_tests_from_openapi(openapi_spec, profile)
+        rounds = LIME_COVERAGE_ROUNDS if coverage_rounds is None else coverage_rounds
+    else:
+        code = await ensure_valid_python(await generate_tests_from_openapi(openapi_spec, profile), "lime")
+        rounds = LIME_COVERAGE_ROUNDS if coverage_rounds is None else coverage_rounds
+    if not rounds and matrix is None:
+        return code
+    return await fill_coverage_gaps(openapi_spec, code, rounds, matrix, profile)
+
+
+async def generate_gap_tests(openapi_spec: Dict[str, Any], gaps: Dict[str, List[str]], profile: str = "default") -> str:
+    """Тесты только для непокрытых ячеек матрицы покрытия выбранных операций"""
+    system_prompt = f'''Ты — Senior QA Automation Engineer. Тебе даны операции REST API (OpenAPI) и для каждой — список
+непокрытых тестами ячеек. Напиши тесты ТОЛЬКО для этих ячеек, по одному тесту на ячейку.
+
+Ячейки:
+- status:<код> — тест, который ожидает этот код ответа;
+- param:<имя> — негативный тест: обязательный параметр не передан или невалиден, ожидается ошибка 4xx;
+- param:body — негативный тест без обязательного тела запроса или с невалидным телом;
+- auth:<схема> — успешный запрос с учетными данными этой схемы авторизации;
+- auth:none — запрос без учетных данных, ожидается 401 или 403.
+
+Формат — Allure TestOps as Code, как в остальном модуле: импорты
+import allure
+from pytest import mark
+from allure_commons._allure import step as allure_step
+классы с тестами test_*, шаги with allure_step("Arrange: ...") / ("Act: ...") / ("Assert: ..."), в шаге Assert
+явно указан ожидаемый код ответа. Каждый тест помечай операцией и покрываемой ячейкой:
+@allure.label("operation", "<METHOD> <path>")
+@allure.label("{COVERAGE_LABEL}", "<ячейка>")
+
+Шаги и названия — на русском языке. Верни ТОЛЬКО Python-код без markdown и пояснений.
+'''
+    with stage("serialize"):
+        subset_json = json.dumps(build_subset_spec(openapi_spec, set(gaps)), ensure_ascii=False,
+                                 separators=(",", ":"), default=str)
+    cells = "\n".join(f"{key}: {', '.join(missing)}" for key, missing in gaps.items())
+    user_content = f"Операции:\n{subset_json}\n\nНепокрытые ячейки:\n{cells}"
+    if profile == "xdist":
+        user_content += "\n\n" + XDIST_INSTRUCTIONS
+    response = await chat_completion(
+        "lime",
+        [
+            {"role": "system", "content": safe_str(system_prompt)},
+            {"role": "user", "content": safe_str(user_content)},
+        ],
+        max_tokens=min(8000, 400 * sum(len(missing) for missing in gaps.values()) + 300),
+        temperature=0.3,
+    )
+    return await ensure_valid_python(strip_code_fence(response.choices[0].message.content or ""), "lime")
+
+
+async def fill_coverage_gaps(openapi_spec: Dict[str, Any], code: str, rounds: int,
+                             matrix: Optional[CoverageMatrix] = None, profile: str = "default") -> str:
+    """Дозапрашивает у модели тесты для непокрытых ячеек и вклеивает их в модуль.
+
+    В модель уходят только операции с пробелами и только их непокрытые ячейки; матрица строится один
+    раз, и после каждого раунда по ней разбираются лишь новые тесты.
+    """
+    try:
+        with stage("coverage"):
+            matrix = (matrix or CoverageMatrix(openapi_spec)).apply(code)
+    except SyntaxError:
+        return code
+    for round_number in range(rounds):
+        gaps = matrix.uncovered()
+        if not gaps:
+            break
+        keys = list(gaps)[:LIME_COVERAGE_MAX_OPERATIONS]
+        log.info("Дозапрос тестов для непокрытых ячеек (режим Lime)",
+                 extra=kv(round=round_number + 1, operations=len(keys), cells=sum(len(gaps[key]) for key in keys)))
+        batches = [keys[start:start + LIME_COVERAGE_BATCH] for start in range(0, len(keys), LIME_COVERAGE_BATCH)]
+        results = await asyncio.gather(
+            *(generate_gap_tests(openapi_spec, {key: gaps[key] for key in batch}, profile) for batch in batches),
+            return_exceptions=True,
+        )
+        added = False
+        for new_code in results:
+            if isinstance(new_code, BaseException):
+                if isinstance(new_code, asyncio.CancelledError):
+                    raise new_code
+                # Модуль без дозапрошенных тестов остается рабочим
+                log.warning("Дозапрос покрытия не удался: %s", safe_str(new_code))
+                continue
+            try:
+                with stage("splice"):
+                    code = splice_module(code, new_code)
+                with stage("coverage"):
+                    matrix.apply(new_code)
+                added = True
+            except SyntaxError as e:
+                log.warning("Дозапрошенные тесты не разбираются, пропущены: %s", e)
+        if not added:
+            break
+    return code
+
+
+async def regenerate_incrementally(openapi_spec: Dict[str, Any], fingerprints: Dict[str, str],
+                             previous_code: str, previous_fingerprints: Dict[str, str],
+                             mode: str = "llm", coverage_rounds: Optional[int] = None,
+                             profile: str = "default") -> tuple:
+    """Пересобирает ранее сгенерированный модуль с учетом изменений спецификации.
+
+    В LLM уходят только добавленные и измененные операции, тесты удаленных и измененных
+    операций вырезаются из старого модуля, остальной код переносится без изменений.
+    Возвращает (code, diff).
+    """
+    diff = diff_fingerprints(previous_fingerprints, fingerprints)
+    log.info(
+        "Инкрементальная пересборка тестов (режим Lime)",
+        extra=kv(**{name: len(keys) for name, keys in diff.items()}),
+    )
+
+    known_keys = set(previous_fingerprints) | set(fingerprints)
+    with stage("splice"):
+        code = remove_operations(previous_code, set(diff["removed"]) | set(diff["changed"]), known_keys)
+
+    regenerate = set(diff["added"]) | set(diff["changed"])
+    if regenerate:
+        subset_spec = build_subset_spec(openapi_spec, regenerate)
+        new_code = await generate_lime_code(subset_spec, mode, coverage_rounds, profile=profile)
+        with stage("splice"):
+            code = splice_module(code, new_code)
+    return code, diff
+
+
+@app.post("/lime", response_model=GenerateFromOpenAPIResponse)
 async def generate_tests_from_openapi_endpoint(request: GenerateFromOpenAPIRequest):
     """Генерирует автоматизированные тесты на основе OpenAPI спецификации (режим Lime)"""
+    model_hint_var.set(request.model_hint)
     try:
         if not request.openapi_spec:
             raise HTTPException(status_code=400, detail="OpenAPI спецификация не может быть пустой")
         
-        spec_size = len(request.openapi_spec)
-        print(f"[DEBUG] Начало обработки OpenAPI спецификации (режим Lime), размер: {(spec_size / 1024 / 1024):.2f} MB", file=sys.stderr)
-        print(f"[DEBUG] Тип данных: {type(request.openapi_spec)}, длина строки: {spec_size}", file=sys.stderr)
+        log.debug("Начало обработки OpenAPI спецификации (режим Lime)", extra=kv(spec_length=len(request.openapi_spec)))
         
         # Парсим OpenAPI спецификацию
         try:
-            openapi_spec = parse_openapi_spec(request.openapi_spec)
-            print(f"[DEBUG] OpenAPI спецификация успешно распарсена", file=sys.stderr)
+            with stage("parse", **{"sos.spec_chars": len(request.openapi_spec)}):
+                openapi_spec = parse_openapi_spec(request.openapi_spec)
+                previous_fingerprints = request.previous_fingerprints
+                if previous_fingerprints is None and request.previous_spec:
+                    previous_fingerprints = compute_fingerprints(parse_openapi_spec(request.previous_spec))
         except ValueError as e:
             error_detail = safe_str(e)
-            print(f"[ERROR] Ошибка парсинга: {error_detail}", file=sys.stderr)
+            log.warning("Ошибка парсинга OpenAPI спецификации: %s", error_detail)
             raise HTTPException(status_code=400, detail=f"Ошибка парсинга OpenAPI спецификации: {error_detail}")
         
+        with stage("fingerprint"):
+            fingerprints = compute_fingerprints(openapi_spec)
+        profile = request.profile or LIME_OUTPUT_PROFILE
+        
         # Генерируем тесты
         try:
-            code = generate_tests_from_openapi(openapi_spec)
+            diff = None
+            code = None
+            matrix = None
+            if request.previous_code and previous_fingerprints is not None:
+                try:
+                    code, diff = await regenerate_incrementally(
+                        openapi_spec, fingerprints, request.previous_code, previous_fingerprints, request.mode,
+                        request.coverage_rounds, profile,
+                    )
+                except SyntaxError as e:
+                    # Старый модуль не разбирается — пересобираем полностью
+                    log.warning("Предыдущий модуль тестов не является валидным Python, выполняем полную генерацию: %s", e)
+            if code is None:
+                with stage("coverage"):
+                    matrix = CoverageMatrix(openapi_spec)
+                code = await generate_lime_code(openapi_spec, request.mode, request.coverage_rounds, matrix, profile)
             # Убеждаемся, что код правильно закодирован
             if isinstance(code, bytes):
                 code = code.decode('utf-8', errors='replace')
             code.encode('utf-8')  # Проверка кодировки
         except Exception as gen_error:
             error_msg = safe_str(gen_error)
-            print(f"[ERROR] Ошибка при генерации кода: {error_msg}", file=sys.stderr)
+            log.error("Ошибка при генерации кода: %s", error_msg)
             raise HTTPException(status_code=500, detail=f"Ошибка при генерации кода: {error_msg}")
         
-        return GenerateResponse(code=code)
+        with stage("coverage"):
+            # При инкрементальной пересборке модуль собран из старых и новых тестов — покрытие считается заново
+            coverage = matrix.summary() if matrix is not None else coverage_for(openapi_spec, code)
+        return GenerateFromOpenAPIResponse(code=code, fingerprints=fingerprints, diff=diff, coverage=coverage,
+                                           files=profile_files(openapi_spec, profile))
         
     except HTTPException:
         raise
     except Exception as e:
         error_type = type(e).__name__
         error_msg = safe_str(e)
-        print(f"[ERROR] Неожиданная ошибка в generate_tests_from_openapi_endpoint: {error_type} - {error_msg}", file=sys.stderr)
+        log.error("Неожиданная ошибка в generate_tests_from_openapi_endpoint: %s - %s", error_type, error_msg, exc_info=e)
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {error_msg}")
 
 
-def optimize_test_cases(test_code: str) -> str:
-    """Оптимизирует существующие тест-кейсы: убирает дубликаты, улучшает структуру, повышает покрытие"""
+# Распарсенные спецификации с индексом операций: большие спецификации не загружаются и не парсятся повторно
+spec_index_cache = SpecIndexCache()
+
+
+def get_spec_index(spec_id: str) -> SpecIndex:
+    index = spec_index_cache.get(spec_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Спецификация не найдена в кеше. Загрузите ее повторно через POST /lime/specs")
+    return index
+
+
+@app.post("/lime/specs", response_model=RegisterSpecResponse)
+async def register_openapi_spec(request: RegisterSpecRequest):
+    """Парсит спецификацию один раз и строит индекс операций (режим Lime, большие спецификации)"""
+    spec_id = spec_id_for(request.openapi_spec)
+    index = spec_index_cache.get(spec_id)
+    if index is None:
+        try:
+            with stage("parse", **{"sos.spec_chars": len(request.openapi_spec)}):
+                openapi_spec = parse_openapi_spec(request.openapi_spec)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Ошибка парсинга OpenAPI спецификации: {safe_str(e)}")
+        if not isinstance(openapi_spec, dict):
+            raise HTTPException(status_code=400, detail="OpenAPI спецификация должна быть объектом")
+        with stage("index"):
+            index = SpecIndex(spec_id, openapi_spec, len(request.openapi_spec))
+        spec_index_cache.put(index)
+        log.info("Спецификация проиндексирована", extra=kv(spec_id=spec_id, operations=len(index.operations), **spec_index_cache.stats()))
+    return RegisterSpecResponse(spec_id=spec_id, operations_count=len(index.operations), tags=index.tags())
+
+
+@app.get("/lime/specs/{spec_id}/operations", response_model=OperationsPage)
+async def list_openapi_operations(
+    spec_id: str,
+    tag: Optional[str] = None,
+    path_prefix: Optional[str] = None,
+    method: Optional[str] = None,
+    operation_id: Optional[str] = None,
+    q: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Список операций проиндексированной спецификации с фильтрами и пагинацией"""
+    index = get_spec_index(spec_id)
+    matched = index.filter(tag=tag, path_prefix=path_prefix, method=method, operation_id=operation_id, query=q)
+    return OperationsPage(total=len(matched), offset=offset, limit=limit, items=matched[offset:offset + limit])
+
+
+@app.post("/lime/specs/{spec_id}/generate", response_model=GenerateFromOpenAPIResponse)
+async def generate_for_selected_operations(spec_id: str, request: GenerateFromIndexRequest):
+    """Генерирует тесты только для выбранных операций проиндексированной спецификации"""
+    model_hint_var.set(request.model_hint)
+    index = get_spec_index(spec_id)
+    keys = [key for key in request.operations if key in index.by_key]
+    if request.tag is not None or request.path_prefix is not None or request.method is not None:
+        keys += [info["key"] for info in index.filter(tag=request.tag, path_prefix=request.path_prefix, method=request.method)]
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        raise HTTPException(status_code=400, detail="Не выбрано ни одной операции спецификации")
+    profile = request.profile or LIME_OUTPUT_PROFILE
+
+    try:
+        with stage("subset"):
+            subset_spec = index.subset_spec(keys)
+        with stage("coverage"):
+            matrix = CoverageMatrix(subset_spec)
+        code = await generate_lime_code(subset_spec, request.mode, request.coverage_rounds, matrix, profile)
+    except Exception as gen_error:
+        error_msg = safe_str(gen_error)
+        log.error("Ошибка при генерации кода: %s", error_msg)
+        raise HTTPException(status_code=500, detail=f"Ошибка при генерации кода: {error_msg}")
+
+    # conftest.py строится по полной спецификации: в подмножестве нет components.securitySchemes
+    return GenerateFromOpenAPIResponse(code=code, fingerprints=compute_fingerprints(subset_spec), coverage=matrix.summary(),
+                                       files=profile_files(index.spec, profile))
+
+
+# Входы и результаты Blue/Purple по id: база для запросов с diff и кеш ответов по модулю и по пакету
+result_store = ResultStore()
+
+
+def resolve_code_input(request: CodeRequest) -> str:
+    """Текст запроса Blue/Purple: полный text или базовый текст по base_id с примененным diff"""
+    if not request.base_id:
+        return request.text
+    base = result_store.get(request.base_id)
+    if base is None:
+        raise HTTPException(status_code=404, detail="Базовый результат не найден или вытеснен, отправьте полный текст")
+    if not request.diff:
+        return base
     try:
+        with stage("patch", **{"sos.diff_chars": len(request.diff)}):
+            return apply_unified_diff(base, request.diff)
+    except PatchError as e:
+        raise HTTPException(status_code=409, detail=f"Diff не применяется к базовому тексту: {safe_str(e)}")
+
+
+async def compact_for_prompt(test_code: str, mode: str) -> Optional[CompactModule]:
+    """Компактная форма модуля для промпта Blue/Purple; None — отправлять исходный код"""
+    if not PROMPT_COMPACTION:
+        return None
+    with stage("compact", **{"sos.mode": mode, "sos.code_chars": len(test_code)}) as span:
+        # Разбор и проверка обратимости большого модуля не задерживают цикл событий
+        compact = await asyncio.to_thread(compact_module, test_code)
+        if compact is not None:
+            span.set_attribute("sos.compact_chars", len(compact.render()))
+    if compact is not None:
+        log.debug("Промпт в компактной форме", extra=kv(mode=mode, code_length=len(test_code), compact_length=len(compact.render())))
+    return compact
+
+
+async def optimize_test_cases(test_code: str, partial: bool = False, compaction: bool = True) -> str:
+    """Оптимизирует существующие тест-кейсы: убирает дубликаты, улучшает структуру, повышает покрытие.
+
+    Модуль ручных тестов отправляется в компактной форме, ответ модели в ней же восстанавливается в код;
+    ответ, который не разбирается ни как компактная форма, ни как код, переспрашивается с исходным кодом.
+    """
+    try:
+        compact = await compact_for_prompt(test_code, "blue") if compaction else None
         # Системный промпт для оптимизации тест-кейсов
         system_prompt = '''Ты — Senior QA Automation Engineer и Python-разработчик, эксперт по тест-дизайну, оптимизации тестов и паттерну AAA (Arrange-Act-Assert).
 
@@ -1079,11 +1983,19 @@ def optimize_test_cases(test_code: str) -> str:
 '''
         
         # Формируем сообщения для OpenAI
+        prompt_code = f"```text\n{compact.render()}```" if compact is not None else test_code
         user_content = f'''Проанализируй и оптимизируй следующие тест-кейсы:
 
-{test_code}
+{prompt_code}
 
 Выполни полную оптимизацию: удали дубликаты, улучши структуру, повысь покрытие, убедись в соблюдении стандартов Allure и паттерна AAA.'''
+        if partial:
+            user_content += '''
+
+Это часть большого модуля, остальные части оптимизируются отдельно. Оптимизируй только переданные тесты
+и не добавляй тесты других функциональностей. Импорты и allure_step уже есть в модуле — их можно не повторять.'''
+        if compact is not None:
+            user_content += "\n\n" + BLUE_COMPACT_INSTRUCTIONS
         
         messages = [
             {
@@ -1096,18 +2008,15 @@ def optimize_test_cases(test_code: str) -> str:
             }
         ]
         
-        print(f"[DEBUG] Отправка запроса к OpenAI API для оптимизации тест-кейсов (режим Blue)", file=sys.stderr)
-        print(f"[DEBUG] Размер исходного кода: {len(test_code)} символов", file=sys.stderr)
+        log.debug("Отправка запроса к OpenAI API для оптимизации тест-кейсов", extra=kv(mode="blue", code_length=len(test_code)))
         
         # Вызываем OpenAI API
         try:
-            response = client.chat.completions.create(
-                model="Qwen/Qwen3-235B-A22B-Instruct-2507",
+            response = await chat_completion(
+                "blue",
+                messages,
                 max_tokens=8000,  # Увеличено для больших наборов тестов
                 temperature=0.3,  # Низкая температура для более детерминированной оптимизации
-                presence_penalty=0,
-                top_p=0.95,
-                messages=messages,
             )
             
             # Получаем текст ответа
@@ -1126,61 +2035,118 @@ def optimize_test_cases(test_code: str) -> str:
                 code = code[:-3]  # Убираем закрывающий ```
             code = code.strip()
             
-            print(f"[DEBUG] Получен оптимизированный код, длина: {len(code)} символов", file=sys.stderr)
+            if compact is not None:
+                try:
+                    code = compact.expand(parse_compact(strip_code_fence(response_text), unique=True))
+                except CompactFormError as e:
+                    # Модель могла ответить кодом вопреки формату: валидный код принимается как есть
+                    if check_code(code) is not None:
+                        log.warning("Ответ Blue не в компактной форме, повтор с исходным кодом: %s", safe_str(e))
+                        return await optimize_test_cases(test_code, partial, compaction=False)
+            
+            log.debug("Получен оптимизированный код", extra=kv(code_length=len(code)))
             
             return code
             
         except Exception as api_error:
             error_type = type(api_error).__name__
             error_msg = safe_str(api_error)
-            print(f"[ERROR] Ошибка при вызове OpenAI API: {error_type} - {error_msg}", file=sys.stderr)
+            log.error("Ошибка при вызове OpenAI API: %s - %s", error_type, error_msg)
             raise
         
     except Exception as e:
         error_msg = safe_str(e)
-        print(f"[ERROR] Ошибка при оптимизации тест-кейсов: {error_msg}", file=sys.stderr)
-        import traceback
-        print(f"[ERROR] Traceback: {traceback.format_exc()}", file=sys.stderr)
+        log.error("Ошибка при оптимизации тест-кейсов: %s", error_msg, exc_info=True)
         raise
 
 
-@app.post("/blue", response_model=GenerateResponse)
-async def optimize_test_cases_endpoint(request: GenerateRequest):
+async def optimize_module(test_code: str) -> str:
+    """Оптимизирует модуль целиком или, если он не помещается в один запрос, параллельно по пакетам.
+
+    Модуль делится через ast на классы/тесты, сгруппированные по @allure.feature; пакеты
+    уходят в модель одновременно (не больше BLUE_MAX_PARALLEL), результат собирается в один модуль.
+    """
+    try:
+        module = split_test_module(test_code)
+    except SyntaxError:
+        # Неразбираемый код оптимизируем одним запросом, как раньше
+        return await optimize_test_cases(test_code)
+    batches = make_batches(module.units, CHUNK_TOKEN_BUDGET)
+    if len(batches) <= 1:
+        return await optimize_test_cases(test_code)
+
+    header = module.header()
+    semaphore = asyncio.Semaphore(BLUE_MAX_PARALLEL)
+    log.info("Оптимизация большого модуля по пакетам (режим Blue)", extra=kv(units=len(module.units), batches=len(batches)))
+
+    async def optimize_batch(batch: List[str]) -> str:
+        async with semaphore:
+            # Текст пакета собирается только когда пакет реально отправляется
+            source = "\n\n\n".join(([header] if header else []) + batch)
+            # Неизмененный пакет (например, после правки в другом классе) не отправляется в модель повторно
+            batch_key = f"blue-batch:{result_id_for(source)}"
+            cached = result_store.lookup(batch_key)
+            if cached is not None:
+                return cached
+            try:
+                output = await optimize_test_cases(source, partial=True)
+                result_store.link(batch_key, output)
+                return output
+            except Exception as e:
+                # Сбой одного пакета не роняет весь запрос: пакет остается в исходном виде
+                log.warning("Пакет не оптимизирован, оставлен исходный код: %s", safe_str(e), extra=kv(units=len(batch)))
+                return source
+
+    with stage("chunks"):
+        outputs = await asyncio.gather(*(optimize_batch(batch) for batch in batches))
+    with stage("assemble"):
+        return assemble_module(module, list(outputs))
+
+
+@app.post("/blue", response_model=CodeResponse)
+async def optimize_test_cases_endpoint(request: CodeRequest):
     """Оптимизирует существующие тест-кейсы (режим Blue)"""
+    model_hint_var.set(request.model_hint)
     try:
-        if not request.text:
+        text = resolve_code_input(request)
+        if not text:
             raise HTTPException(status_code=400, detail="Код тест-кейсов не может быть пустым")
         
-        code_size = len(request.text)
-        print(f"[DEBUG] Начало обработки оптимизации тест-кейсов (режим Blue), размер: {(code_size / 1024 / 1024):.2f} MB", file=sys.stderr)
-        print(f"[DEBUG] Тип данных: {type(request.text)}, длина строки: {code_size}", file=sys.stderr)
+        log.debug("Начало обработки оптимизации тест-кейсов (режим Blue)", extra=kv(code_length=len(text)))
+        input_id = result_store.put(text)
+        cached = result_store.lookup(f"blue:{input_id}")
+        if cached is not None:
+            log.info("Результат Blue взят из хранилища результатов", extra=kv(input_id=input_id))
+            return CodeResponse(code=cached, input_id=input_id, result_id=result_id_for(cached))
         
         # Оптимизируем тест-кейсы
         try:
-            optimized_code = optimize_test_cases(request.text)
+            optimized_code = await ensure_valid_python(await optimize_module(text), "blue")
             # Убеждаемся, что код правильно закодирован
             if isinstance(optimized_code, bytes):
                 optimized_code = optimized_code.decode('utf-8', errors='replace')
             optimized_code.encode('utf-8')  # Проверка кодировки
         except Exception as opt_error:
             error_msg = safe_str(opt_error)
-            print(f"[ERROR] Ошибка при оптимизации кода: {error_msg}", file=sys.stderr)
+            log.error("Ошибка при оптимизации кода: %s", error_msg)
             raise HTTPException(status_code=500, detail=f"Ошибка при оптимизации кода: {error_msg}")
         
-        return GenerateResponse(code=optimized_code)
+        result_store.link(f"blue:{input_id}", optimized_code)
+        return CodeResponse(code=optimized_code, input_id=input_id, result_id=result_id_for(optimized_code))
         
     except HTTPException:
         raise
     except Exception as e:
         error_type = type(e).__name__
         error_msg = safe_str(e)
-        print(f"[ERROR] Неожиданная ошибка в optimize_test_cases_endpoint: {error_type} - {error_msg}", file=sys.stderr)
+        log.error("Неожиданная ошибка в optimize_test_cases_endpoint: %s - %s", error_type, error_msg, exc_info=e)
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {error_msg}")
 
 
-def validate_test_cases(test_code: str) -> str:
+async def validate_test_cases(test_code: str) -> str:
     """Проверяет тест-кейсы на соответствие стандартам Allure TestOps и выдает отчет с рекомендациями"""
     try:
+        compact = await compact_for_prompt(test_code, "purple")
         # Системный промпт для проверки тест-кейсов на стандарты
         system_prompt = '''Ты — Senior QA Automation Engineer и Python-разработчик, эксперт по тест-дизайну, стандартам Allure TestOps as Code и паттерну AAA (Arrange-Act-Assert).
 
@@ -1255,11 +2221,14 @@ def validate_test_cases(test_code: str) -> str:
 '''
         
         # Формируем сообщения для OpenAI
+        prompt_code = f"{compact.header}\n\n```text\n{compact.render()}```" if compact is not None else test_code
         user_content = f'''Проверь следующие тест-кейсы на соответствие стандартам Allure TestOps и паттерну AAA:
 
-{test_code}
+{prompt_code}
 
 Выполни полную проверку и выдай детальный отчет с рекомендациями по исправлению всех найденных проблем.'''
+        if compact is not None:
+            user_content += "\n\n" + PURPLE_COMPACT_INSTRUCTIONS
         
         messages = [
             {
@@ -1272,18 +2241,15 @@ def validate_test_cases(test_code: str) -> str:
             }
         ]
         
-        print(f"[DEBUG] Отправка запроса к OpenAI API для проверки тест-кейсов на стандарты (режим Purple)", file=sys.stderr)
-        print(f"[DEBUG] Размер исходного кода: {len(test_code)} символов", file=sys.stderr)
+        log.debug("Отправка запроса к OpenAI API для проверки тест-кейсов на стандарты", extra=kv(mode="purple", code_length=len(test_code)))
         
         # Вызываем OpenAI API
         try:
-            response = client.chat.completions.create(
-                model="Qwen/Qwen3-235B-A22B-Instruct-2507",
+            response = await chat_completion(
+                "purple",
+                messages,
                 max_tokens=6000,  # Достаточно для детального отчета
                 temperature=0.2,  # Низкая температура для более точной проверки
-                presence_penalty=0,
-                top_p=0.95,
-                messages=messages,
             )
             
             # Получаем текст ответа
@@ -1306,63 +2272,339 @@ def validate_test_cases(test_code: str) -> str:
                     report = report[:-3]
                 report = report.strip()
             
-            print(f"[DEBUG] Получен отчет о проверке, длина: {len(report)} символов", file=sys.stderr)
+            log.debug("Получен отчет о проверке", extra=kv(report_length=len(report)))
             
             return report
             
         except Exception as api_error:
             error_type = type(api_error).__name__
             error_msg = safe_str(api_error)
-            print(f"[ERROR] Ошибка при вызове OpenAI API: {error_type} - {error_msg}", file=sys.stderr)
+            log.error("Ошибка при вызове OpenAI API: %s - %s", error_type, error_msg)
             raise
         
     except Exception as e:
         error_msg = safe_str(e)
-        print(f"[ERROR] Ошибка при проверке тест-кейсов: {error_msg}", file=sys.stderr)
-        import traceback
-        print(f"[ERROR] Traceback: {traceback.format_exc()}", file=sys.stderr)
+        log.error("Ошибка при проверке тест-кейсов: %s", error_msg, exc_info=True)
         raise
 
 
-@app.post("/purple", response_model=GenerateResponse)
-async def validate_test_cases_endpoint(request: GenerateRequest):
+@app.post("/purple", response_model=CodeResponse)
+async def validate_test_cases_endpoint(request: CodeRequest):
     """Проверяет тест-кейсы на соответствие стандартам (режим Purple)"""
+    model_hint_var.set(request.model_hint)
     try:
-        if not request.text:
+        text = resolve_code_input(request)
+        if not text:
             raise HTTPException(status_code=400, detail="Код тест-кейсов не может быть пустым")
         
-        code_size = len(request.text)
-        print(f"[DEBUG] Начало обработки проверки тест-кейсов на стандарты (режим Purple), размер: {(code_size / 1024 / 1024):.2f} MB", file=sys.stderr)
-        print(f"[DEBUG] Тип данных: {type(request.text)}, длина строки: {code_size}", file=sys.stderr)
+        log.debug("Начало обработки проверки тест-кейсов на стандарты (режим Purple)", extra=kv(code_length=len(text)))
+        input_id = result_store.put(text)
+        cached = result_store.lookup(f"purple:{input_id}")
+        if cached is not None:
+            log.info("Отчет Purple взят из хранилища результатов", extra=kv(input_id=input_id))
+            return CodeResponse(code=cached, input_id=input_id, result_id=result_id_for(cached))
         
         # Проверяем тест-кейсы
         try:
-            validation_report = validate_test_cases(request.text)
+            validation_report = await validate_test_cases(text)
             # Убеждаемся, что отчет правильно закодирован
             if isinstance(validation_report, bytes):
                 validation_report = validation_report.decode('utf-8', errors='replace')
             validation_report.encode('utf-8')  # Проверка кодировки
         except Exception as val_error:
             error_msg = safe_str(val_error)
-            print(f"[ERROR] Ошибка при проверке кода: {error_msg}", file=sys.stderr)
+            log.error("Ошибка при проверке кода: %s", error_msg)
             raise HTTPException(status_code=500, detail=f"Ошибка при проверке кода: {error_msg}")
         
-        return GenerateResponse(code=validation_report)
+        result_store.link(f"purple:{input_id}", validation_report)
+        return CodeResponse(code=validation_report, input_id=input_id, result_id=result_id_for(validation_report))
         
     except HTTPException:
         raise
     except Exception as e:
         error_type = type(e).__name__
         error_msg = safe_str(e)
-        print(f"[ERROR] Неожиданная ошибка в validate_test_cases_endpoint: {error_type} - {error_msg}", file=sys.stderr)
+        log.error("Неожиданная ошибка в validate_test_cases_endpoint: %s - %s", error_type, error_msg, exc_info=e)
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {error_msg}")
 
 
+class ExportRequest(BaseModel):
+    # Модуль тестов целиком или id ранее полученного результата (input_id/result_id Blue/Purple)
+    text: str = ""
+    result_id: Optional[str] = None
+    group_by: Literal["feature", "story", "suite", "tag"] = Field("feature", description="По какому декоратору делить на файлы")
+
+
+@app.post("/export")
+async def export_archive(request: ExportRequest):
+    """Экспорт сгенерированного модуля в zip-архив: один модуль pytest на группу и manifest.json.
+
+    Архив отдается потоком по мере сборки файлов, поэтому размер набора тестов не влияет на пик памяти
+    ответа и клиенту не нужно загружать в редактор один гигантский модуль.
+    """
+    code = request.text
+    if request.result_id:
+        code = result_store.get(request.result_id)
+        if code is None:
+            raise HTTPException(status_code=404, detail="Результат не найден или вытеснен, отправьте полный text")
+    if not code or code.isspace():
+        raise HTTPException(status_code=400, detail="Код тест-кейсов не может быть пустым")
+    try:
+        with stage("parse", **{"sos.code_chars": len(code)}):
+            plan = await asyncio.to_thread(plan_export, code, request.group_by)
+    except SyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Код не является валидным Python: {e.msg} (строка {e.lineno})")
+    if not plan.groups:
+        raise HTTPException(status_code=400, detail="В коде не найдено ни одного теста")
+    log.info("Экспорт модуля в архив", extra=kv(group_by=request.group_by, files=len(plan.groups), tests=sum(plan.tests.values())))
+    return StreamingResponse(
+        stream_export(plan, request.result_id or result_id_for(code)),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="tests.zip"'},
+    )
+
+
+class SessionMessage(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    # start — новая сессия (первый ход с полными данными); message — уточнение (только новый текст);
+    # resume — продолжение сессии после переподключения; close — удаление сессии
+    type: Literal["start", "message", "resume", "close"]
+    mode: Optional[Literal["green", "lime", "blue", "purple"]] = None
+    text: Optional[str] = None
+    session_id: Optional[str] = None
+    lime_mode: Literal["llm", "template", "hybrid", "auto"] = "llm"
+    model_hint: Optional[Literal["fast", "quality"]] = None
+
+
+_SESSION_RULES = """
+Сохраняй без изменений все, что уточнение не затрагивает. Возвращай ТОЛЬКО полный обновленный Python-код:
+без объяснений, без markdown, без текста вокруг. Код должен оставаться синтаксически валидным Python."""
+
+# Промпты уточнения по режимам: (системный промпт, max_tokens, temperature)
+SESSION_FOLLOWUP = {
+    "green": (
+        "Ты — Senior QA Automation Engineer. Ты дорабатываешь ранее сгенерированные тобой ручные тест-кейсы "
+        "в формате Allure TestOps as Code (паттерн AAA, декораторы allure, @mark.manual) по уточнению пользователя."
+        + _SESSION_RULES,
+        5000, 0.5,
+    ),
+    "lime": (
+        "Ты — Senior QA Automation Engineer. Ты дорабатываешь ранее сгенерированные тобой автотесты API "
+        "на pytest и requests в формате Allure TestOps as Code по уточнению пользователя. Используй тот же HTTP-клиент, "
+        "что и в текущем коде: requests.get/post с полным URL или фикстуру api из conftest.py с относительными путями."
+        + _SESSION_RULES,
+        8000, 0.3,
+    ),
+    "blue": (
+        "Ты — Senior QA Automation Engineer. Ты дорабатываешь оптимизированные тобой тест-кейсы "
+        "в формате Allure TestOps as Code по уточнению пользователя." + _SESSION_RULES,
+        8000, 0.3,
+    ),
+    "purple": (
+        "Ты — Senior QA Automation Engineer. Ты дорабатываешь свой отчет о проверке тест-кейсов на соответствие "
+        "стандартам Allure TestOps as Code по уточнению пользователя. Сохраняй структуру отчета (разделы Markdown) "
+        "и возвращай полный обновленный отчет без обрамления ```.",
+        6000, 0.2,
+    ),
+}
+
+# Диалоговые сессии WebSocket: исходные данные и последний результат хранятся на сервере
+session_store = SessionStore()
+
+
+async def run_session_start(mode: str, text: str, lime_mode: str) -> str:
+    """Первый ход сессии — та же обработка, что и у HTTP эндпоинта режима"""
+    if mode == "green":
+        return (await generate_test_code(GenerateRequest(text=text, model_hint=model_hint_var.get()))).code
+    if mode == "lime":
+        try:
+            with stage("parse", **{"sos.spec_chars": len(text)}):
+                openapi_spec = parse_openapi_spec(text)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Ошибка парсинга OpenAPI спецификации: {safe_str(e)}")
+        return await generate_lime_code(openapi_spec, lime_mode)
+    if mode == "blue":
+        return await ensure_valid_python(await optimize_module(text), "blue")
+    return await validate_test_cases(text)
+
+
+async def run_session_followup(websocket: WebSocket, session: Session, instruction: str) -> tuple:
+    """Ход-уточнение: ответ модели отправляется клиенту фрагментами, код в конце проверяется и чинится.
+
+    Возвращает (итоговый результат, текст, собранный из отправленных фрагментов).
+    """
+    system_prompt, max_tokens, temperature = SESSION_FOLLOWUP[session.mode]
+    with stage("prompt"):
+        messages = session.messages(system_prompt, safe_str(instruction))
+    parts: List[str] = []
+    # Если send_json падает (клиент отключился), генератор закрывается сразу, а не сборщиком мусора:
+    # соединение с upstream обрывается, слот планировщика освобождается и вызов учитывается как cancelled
+    async with contextlib.aclosing(chat_completion_stream(session.mode, messages, max_tokens, temperature)) as stream:
+        async for text in stream:
+            parts.append(text)
+            await websocket.send_json({"type": "delta", "text": text})
+    streamed = "".join(parts)
+    result = strip_code_fence(streamed)
+    if not result:
+        raise HTTPException(status_code=500, detail="Пустой ответ от OpenAI")
+    if session.mode != "purple":
+        result = await ensure_valid_python(result, session.mode)
+    return result, streamed
+
+
+async def run_session_turn(websocket: WebSocket, session: Session, message: SessionMessage) -> tuple:
+    """Ход сессии и фиксация его результата; возвращает (итоговый результат, текст отправленных фрагментов).
+
+    Сессию могут возобновить несколько соединений: второе ждет конца хода под session.lock,
+    иначе оба уточнения строились бы на одном результате и последнее затерло бы первое.
+    """
+    async with session.lock:
+        if message.type == "start":
+            result = await run_session_start(session.mode, message.text, message.lime_mode)
+            session_store.update(session, result)
+            return result, ""
+        result, streamed = await run_session_followup(websocket, session, message.text)
+        session_store.update(session, result, message.text)
+        return result, streamed
+
+
+@app.websocket("/ws/session")
+async def session_socket(websocket: WebSocket):
+    """Диалоговая сессия: первый ход передает данные целиком, уточнения — только новый текст.
+
+    Сообщения клиента — JSON SessionMessage. Сервер отвечает событиями session, delta (фрагмент
+    потокового ответа), done (ход завершен; code — итоговый результат, если он отличается от
+    собранного из delta) и error. Сессия переживает разрыв соединения до истечения SESSION_TTL_SECONDS.
+    """
+    await websocket.accept()
+    session: Optional[Session] = None
+    try:
+        while True:
+            try:
+                message = SessionMessage.model_validate(await websocket.receive_json())
+            except (ValidationError, ValueError) as e:
+                await websocket.send_json({"type": "error", "detail": f"Некорректное сообщение: {safe_str(e)[:500]}"})
+                continue
+
+            if message.type == "close":
+                if session is not None:
+                    session_store.drop(session.id)
+                await websocket.close()
+                return
+            if message.type == "resume":
+                session = session_store.get(message.session_id or "")
+                if session is None:
+                    await websocket.send_json({"type": "error", "detail": "Сессия не найдена или истекла"})
+                else:
+                    await websocket.send_json({"type": "session", "session_id": session.id, "mode": session.mode,
+                                               "turn": session.turn_count, "resumed": True})
+                continue
+            if not message.text:
+                await websocket.send_json({"type": "error", "detail": "Текст сообщения не может быть пустым"})
+                continue
+            if message.type == "start":
+                if message.mode is None:
+                    await websocket.send_json({"type": "error", "detail": "Для новой сессии нужен режим (mode)"})
+                    continue
+                # Исходные требования нужны модели для уточнений; код и спецификация заменяются результатом
+                session = session_store.create(message.mode, message.text if message.mode == "green" else "",
+                                               message.model_hint)
+                await websocket.send_json({"type": "session", "session_id": session.id, "mode": session.mode,
+                                           "turn": 0, "resumed": False})
+            elif session is None or session_store.get(session.id) is None:
+                await websocket.send_json({"type": "error", "detail": "Сессия не найдена или истекла"})
+                continue
+
+            request_id = uuid.uuid4().hex[:16]
+            request_id_var.set(request_id)
+            model_hint_var.set(message.model_hint or session.model_hint)
+            started = time.perf_counter()
+            try:
+                result, streamed = await run_session_turn(websocket, session, message)
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "detail": e.detail, "request_id": request_id})
+                continue
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                log.error("Ошибка хода сессии: %s", safe_str(e), extra=kv(session_id=session.id), exc_info=e)
+                await websocket.send_json({"type": "error", "detail": f"Ошибка при обработке: {safe_str(e)[:500]}",
+                                           "request_id": request_id})
+                continue
+            log.info(
+                "Ход сессии завершен",
+                extra=kv(session_id=session.id, mode=session.mode, turn=session.turn_count, input_chars=len(message.text),
+                         result_chars=len(result), duration_ms=round((time.perf_counter() - started) * 1000, 2)),
+            )
+            done: Dict[str, Any] = {"type": "done", "session_id": session.id, "turn": session.turn_count,
+                                    "request_id": request_id}
+            if result != streamed:
+                done["code"] = result
+            await websocket.send_json(done)
+    except WebSocketDisconnect:
+        log.debug("Соединение сессии закрыто", extra=kv(session_id=session.id if session else None))
+
+
+class UsageSummary(BaseModel):
+    since: float
+    until: float
+    totals: Dict[str, Any]
+    groups: List[Dict[str, Any]]
+    top_requests: List[Dict[str, Any]]
+
+
+_WINDOW_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+@app.get("/usage/summary", response_model=UsageSummary)
+async def usage_summary(
+    window: str = Query("24h", pattern=r"^\d+[mhd]$", description="Окно до until: 15m, 24h, 7d"),
+    since: Optional[float] = Query(None, description="Начало окна, unix time (приоритетнее window)"),
+    until: Optional[float] = Query(None, description="Конец окна, unix time (по умолчанию — сейчас)"),
+    group_by: List[str] = Query(["mode"], description="mode, caller, model, hour, day"),
+    mode: Optional[str] = None,
+    caller: Optional[str] = None,
+    top: int = Query(10, ge=0, le=100),
+):
+    """Расход токенов и стоимость вызовов модели за окно с группировкой и top-N дорогих запросов"""
+    unknown = [name for name in group_by if name not in GROUP_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестная группировка: {', '.join(unknown)}")
+    until = until if until is not None else time.time()
+    if since is None:
+        since = until - int(window[:-1]) * _WINDOW_UNITS[window[-1]]
+    try:
+        result = await asyncio.to_thread(
+            usage_store.summary, since, until, list(dict.fromkeys(group_by)), mode, caller, top
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return UsageSummary(**result)
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Очередь к upstream: занятые слоты, глубина очереди и времена ожидания по режимам и сторонам"""
+    return dict(scheduler.stats(), shared=shared_calls.stats())
+
+
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
+    """Живость: процесс отвечает; upstream не проверяется"""
     return {"status": "ok"}
 
 
+@app.get("/health/ready")
+async def readiness_check():
+    """Готовность: upstream доступен и отвечает быстро (проба кешируется), нагрузка ниже порога; иначе 503"""
+    result = readiness(await upstream_probe.check(), queued=scheduler.stats()["queued"])
+    if result["status"] != "ready":
+        return JSONResponse(status_code=503, content=result, headers={"Retry-After": "5"})
+    return result
+
+
 if __name__ == "__main__":
     import uvicorn
     # Настройки для больших запросов (до 50MB)
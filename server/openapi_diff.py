@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Отпечатки операций OpenAPI и инкрементальная пересборка сгенерированного модуля тестов"""
+import ast
+import copy
+import hashlib
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from chunking import unique_name
+
+HTTP_METHODS = ("get", "post", "put", "delete", "patch", "head", "options", "trace")
+
+# Метка, которой LLM помечает тест операцией: @allure.label("operation", "GET /users/{id}")
+OPERATION_LABEL = "operation"
+_OPERATION_LABEL_RE = re.compile(r'@allure\.label\(\s*["\']operation["\']\s*,\s*["\']([A-Za-z]+)\s+([^"\']+)["\']\s*\)')
+
+
+def operation_key(method: str, path: str) -> str:
+    """Ключ операции вида 'GET /users/{id}'"""
+    return f"{method.upper()} {path}"
+
+
+def resolve_refs(node: Any, spec: Dict[str, Any], _stack: Tuple[str, ...] = ()) -> Any:
+    """Возвращает копию узла с подставленными локальными $ref (циклические ссылки не раскрываются)"""
+    if isinstance(node, dict):
+        ref = node.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/"):
+            if ref in _stack:
+                return {"$ref": ref, "x-cyclic": True}
+            target: Any = spec
+            for part in ref[2:].split("/"):
+                part = part.replace("~1", "/").replace("~0", "~")
+                if not isinstance(target, dict) or part not in target:
+                    return {"$ref": ref, "x-unresolved": True}
+                target = target[part]
+            return resolve_refs(target, spec, _stack + (ref,))
+        return {key: resolve_refs(value, spec, _stack) for key, value in node.items()}
+    if isinstance(node, list):
+        return [resolve_refs(item, spec, _stack) for item in node]
+    return node
+
+
+def deref(node: Any, spec: Dict[str, Any], _depth: int = 0) -> Any:
+    """Узел, на который указывает локальный $ref, без копирования и без раскрытия вложенных ссылок.
+
+    Для чтения полей верхнего уровня (name, in, required) там, где полная копия resolve_refs не нужна;
+    неразрешимая или циклическая ссылка возвращает исходный узел.
+    """
+    ref = node.get("$ref") if isinstance(node, dict) else None
+    if not isinstance(ref, str) or not ref.startswith("#/") or _depth >= 16:
+        return node
+    target: Any = spec
+    for part in ref[2:].split("/"):
+        part = part.replace("~1", "/").replace("~0", "~")
+        if not isinstance(target, dict) or part not in target:
+            return node
+        target = target[part]
+    return deref(target, spec, _depth + 1)
+
+
+def operation_parameters(spec: Dict[str, Any], operation: Dict[str, Any], shared_params: List[Any]) -> List[Dict[str, Any]]:
+    """Параметры операции вместе с параметрами уровня path (операция переопределяет по name и in), без копий схем"""
+    params: Dict[Tuple[Any, Any], Dict[str, Any]] = {}
+    for param in list(shared_params) + list(operation.get("parameters") or []):
+        param = deref(param, spec)
+        if isinstance(param, dict):
+            params[(param.get("name"), param.get("in"))] = param
+    return list(params.values())
+
+
+def iter_operations(spec: Dict[str, Any]) -> Iterator[Tuple[str, str, Dict[str, Any], List[Any]]]:
+    """Перебирает операции спецификации: (method, path, operation, параметры уровня path)"""
+    paths = spec.get("paths") or {}
+    if not isinstance(paths, dict):
+        return
+    for path, path_item in paths.items():
+        if not isinstance(path_item, dict):
+            continue
+        shared_params = path_item.get("parameters") or []
+        for method, operation in path_item.items():
+            if method.lower() not in HTTP_METHODS or not isinstance(operation, dict):
+                continue
+            yield method.lower(), path, operation, shared_params
+
+
+def resolved_operation(spec: Dict[str, Any], method: str, path: str,
+                       operation: Dict[str, Any], shared_params: List[Any]) -> Dict[str, Any]:
+    """Операция с раскрытыми $ref и параметрами уровня path, влитыми в параметры операции"""
+    params: Dict[Tuple[Any, Any], Any] = {}
+    for param in list(shared_params) + list(operation.get("parameters") or []):
+        param = resolve_refs(param, spec)
+        if isinstance(param, dict):
+            params[(param.get("name"), param.get("in"))] = param
+    resolved = resolve_refs({k: v for k, v in operation.items() if k != "parameters"}, spec)
+    if params:
+        resolved["parameters"] = list(params.values())
+    return resolved
+
+
+def fingerprint_operation(method: str, path: str, resolved: Dict[str, Any]) -> str:
+    """SHA-256 по методу, пути, параметрам, телу запроса и схемам ответов операции"""
+    parameters = sorted(
+        resolved.get("parameters") or [],
+        key=lambda p: (str(p.get("in")), str(p.get("name"))) if isinstance(p, dict) else ("", ""),
+    )
+    material = {
+        "method": method.upper(),
+        "path": path,
+        "parameters": parameters,
+        "requestBody": resolved.get("requestBody"),
+        "responses": resolved.get("responses"),
+    }
+    canonical = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def compute_fingerprints(spec: Dict[str, Any]) -> Dict[str, str]:
+    """Отпечатки всех операций спецификации: {'GET /users': sha256, ...}"""
+    fingerprints = {}
+    for method, path, operation, shared_params in iter_operations(spec):
+        resolved = resolved_operation(spec, method, path, operation, shared_params)
+        fingerprints[operation_key(method, path)] = fingerprint_operation(method, path, resolved)
+    return fingerprints
+
+
+def diff_fingerprints(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, List[str]]:
+    """Сравнивает отпечатки: added / changed / removed / unchanged"""
+    return {
+        "added": sorted(key for key in new if key not in old),
+        "changed": sorted(key for key in new if key in old and old[key] != new[key]),
+        "removed": sorted(key for key in old if key not in new),
+        "unchanged": sorted(key for key in new if key in old and old[key] == new[key]),
+    }
+
+
+def build_subset_spec(spec: Dict[str, Any], keys: Set[str]) -> Dict[str, Any]:
+    """Спецификация только с выбранными операциями; $ref раскрыты, components не нужны"""
+    subset: Dict[str, Any] = {k: copy.deepcopy(v) for k, v in spec.items() if k not in ("paths", "components")}
+    paths: Dict[str, Any] = {}
+    for method, path, operation, shared_params in iter_operations(spec):
+        if operation_key(method, path) in keys:
+            paths.setdefault(path, {})[method] = resolved_operation(spec, method, path, operation, shared_params)
+    subset["paths"] = paths
+    return subset
+
+
+# --- Сопоставление тестов с операциями и сборка модуля ---
+
+def _node_start(node: ast.AST) -> int:
+    decorators = getattr(node, "decorator_list", None) or []
+    return min([node.lineno] + [d.lineno for d in decorators])
+
+
+def _operation_of(source: str, keys: Set[str]) -> Optional[str]:
+    """Определяет операцию теста: по метке operation, иначе по строке пути и HTTP-методу"""
+    match = _OPERATION_LABEL_RE.search(source)
+    if match:
+        key = operation_key(match.group(1), match.group(2).strip())
+        return key if key in keys else None
+    candidates = []
+    for key in keys:
+        method, path = key.split(" ", 1)
+        if path in source and (f".{method.lower()}(" in source or method in source):
+            candidates.append(key)
+    # При неоднозначности предпочитаем самый длинный (самый конкретный) путь
+    return max(candidates, key=len) if candidates else None
+
+
+def iter_tests(code: str, keys: Set[str]) -> Iterator[Tuple[ast.AST, str, Optional[str]]]:
+    """Перебирает тесты модуля: (узел test_*, исходный текст с декораторами, ключ операции или None)"""
+    tree = ast.parse(code)
+    lines = code.splitlines()
+
+    def visit(nodes: List[ast.stmt], class_source: str = "") -> Iterator[Tuple[ast.AST, str, Optional[str]]]:
+        for node in nodes:
+            if isinstance(node, ast.ClassDef):
+                header = "\n".join(lines[_node_start(node) - 1:_node_start(node.body[0]) - 1]) if node.body else ""
+                yield from visit(node.body, header)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith("test"):
+                source = "\n".join(lines[_node_start(node) - 1:node.end_lineno])
+                yield node, source, _operation_of(source, keys) or _operation_of(class_source + "\n" + source, keys)
+
+    yield from visit(tree.body)
+
+
+def map_tests_to_operations(code: str, keys: Set[str]) -> Dict[Tuple[int, int], Optional[str]]:
+    """Возвращает {(первая строка, последняя строка) теста: ключ операции или None}"""
+    return {(_node_start(node), node.end_lineno): key for node, _, key in iter_tests(code, keys)}
+
+
+def remove_operations(code: str, drop: Set[str], known_keys: Set[str]) -> str:
+    """Удаляет из модуля тесты, относящиеся к операциям drop; опустевшие классы тоже удаляются"""
+    if not drop:
+        return code
+    mapping = map_tests_to_operations(code, known_keys)
+    doomed = [span for span, key in mapping.items() if key in drop]
+    if not doomed:
+        return code
+
+    tree = ast.parse(code)
+    lines = code.splitlines(keepends=True)
+    removed_lines: Set[int] = set()
+    for start, end in doomed:
+        removed_lines.update(range(start, end + 1))
+
+    # Класс, у которого не осталось методов-тестов и другого содержимого, удаляется целиком
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            remaining = [
+                child for child in node.body
+                if not set(range(_node_start(child), child.end_lineno + 1)) <= removed_lines
+                and not (isinstance(child, ast.Expr) and isinstance(getattr(child, "value", None), ast.Constant))
+            ]
+            if not remaining:
+                removed_lines.update(range(_node_start(node), node.end_lineno + 1))
+
+    kept = "".join(line for number, line in enumerate(lines, start=1) if number not in removed_lines)
+    kept = re.sub(r"(^class [^\n]*:\n)\n+", r"\1", kept, flags=re.MULTILINE)
+    return re.sub(r"\n{4,}", "\n\n\n", kept)
+
+
+def _split_header(code: str) -> Tuple[List[str], str]:
+    """Отделяет импорты нового фрагмента от его тела"""
+    tree = ast.parse(code)
+    lines = code.splitlines()
+    import_lines: Set[int] = set()
+    imports = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            import_lines.update(range(node.lineno, node.end_lineno + 1))
+            imports.append("\n".join(lines[node.lineno - 1:node.end_lineno]))
+    body = "\n".join(line for number, line in enumerate(lines, start=1) if number not in import_lines)
+    return imports, body.strip("\n")
+
+
+def _rename_def(lines: List[str], node: ast.AST, name: str) -> None:
+    """Переименовывает функцию в строке ее def (lines — строки фрагмента, нумерация ast с 1)"""
+    index, column = node.lineno - 1, node.col_offset
+    lines[index] = lines[index][:column] + re.sub(
+        rf"\bdef\s+{re.escape(node.name)}\b", f"def {name}", lines[index][column:], count=1)
+
+
+def splice_module(previous_code: str, new_code: str) -> str:
+    """Добавляет в предыдущий модуль тесты из нового фрагмента.
+
+    Недостающие импорты поднимаются в начало, общие хелперы (например allure_step)
+    не дублируются, а методы классов, которые уже есть в модуле, дописываются в эти классы.
+    Тесты, имена которых совпадают с уже существующими, переименовываются (test_x_2), чтобы
+    не перекрывать прежние.
+    """
+    if not new_code.strip():
+        return previous_code
+    imports, body = _split_header(new_code)
+    existing = set(line.strip() for line in previous_code.splitlines())
+    missing_imports = [imp for imp in imports if imp.strip() not in existing]
+
+    prev_tree = ast.parse(previous_code)
+    prev_functions = {node.name for node in prev_tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    prev_classes = {node.name: node for node in prev_tree.body if isinstance(node, ast.ClassDef)}
+
+    # Разбираем новый фрагмент: дубли хелперов отбрасываем, методы существующих классов откладываем
+    merges: Dict[str, List[str]] = {}
+    # Имена методов существующих классов, включая уже дописанные из этого фрагмента
+    class_methods: Dict[str, Set[str]] = {}
+    if body:
+        body_lines = body.splitlines()
+        drop_lines: Set[int] = set()
+        for node in ast.parse(body).body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name in prev_functions:
+                if node.name.startswith("test"):
+                    _rename_def(body_lines, node, unique_name(node.name, prev_functions))
+                else:
+                    drop_lines.update(range(_node_start(node), node.end_lineno + 1))
+            elif isinstance(node, ast.ClassDef) and node.name in prev_classes:
+                members = [
+                    child for child in node.body
+                    if not (isinstance(child, ast.Expr) and isinstance(getattr(child, "value", None), ast.Constant))
+                ]
+                used = class_methods.setdefault(node.name, {
+                    child.name for child in prev_classes[node.name].body
+                    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))
+                })
+                for child in members:
+                    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        name = unique_name(child.name, used)
+                        if name != child.name:
+                            _rename_def(body_lines, child, name)
+                if members:
+                    merges.setdefault(node.name, []).append(
+                        "\n".join(body_lines[_node_start(members[0]) - 1:node.end_lineno])
+                    )
+                drop_lines.update(range(_node_start(node), node.end_lineno + 1))
+        body = "\n".join(line for number, line in enumerate(body_lines, start=1) if number not in drop_lines)
+        body = re.sub(r"\n{4,}", "\n\n\n", body).strip("\n")
+
+    prev_lines = previous_code.rstrip("\n").splitlines()
+    # Вставляем снизу вверх, чтобы номера строк оставались корректными
+    for name in sorted(merges, key=lambda n: prev_classes[n].end_lineno, reverse=True):
+        insert_at = prev_classes[name].end_lineno
+        prev_lines[insert_at:insert_at] = [""] + "\n\n".join(merges[name]).splitlines()
+    if missing_imports:
+        last_import = max(
+            (node.end_lineno for node in prev_tree.body if isinstance(node, (ast.Import, ast.ImportFrom))),
+            default=0,
+        )
+        prev_lines[last_import:last_import] = missing_imports
+
+    result = "\n".join(prev_lines)
+    if body:
+        result += "\n\n\n" + body
+    return result + "\n"
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Индекс операций OpenAPI спецификации и ограниченный кеш распарсенных спецификаций"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from openapi_diff import iter_operations, operation_key
+
+# Ограничения кеша индексов: число спецификаций и суммарный размер исходного текста
+SPEC_CACHE_MAX_ENTRIES = int(os.getenv("LIME_SPEC_CACHE_SIZE", "16"))
+SPEC_CACHE_MAX_BYTES = int(os.getenv("LIME_SPEC_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def spec_id_for(spec_text: str) -> str:
+    """Идентификатор спецификации — хеш ее текста (повторная загрузка дает тот же id)"""
+    return hashlib.sha256(spec_text.encode("utf-8", errors="replace")).hexdigest()[:32]
+
+
+class SchemaTable:
+    """Таблица схем с раскрытыми $ref; каждая ссылка раскрывается один раз и переиспользуется.
+
+    Возвращаемые объекты разделяются между операциями — изменять их нельзя.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.spec = spec
+        self._resolved: Dict[str, Any] = {}
+        self._in_progress: Set[str] = set()
+        self._lock = threading.RLock()
+
+    def resolve_ref(self, ref: str) -> Any:
+        with self._lock:
+            if ref in self._resolved:
+                return self._resolved[ref]
+            if ref in self._in_progress:
+                return {"$ref": ref, "x-cyclic": True}
+            target: Any = self.spec
+            for part in ref[2:].split("/"):
+                part = part.replace("~1", "/").replace("~0", "~")
+                if not isinstance(target, dict) or part not in target:
+                    return {"$ref": ref, "x-unresolved": True}
+                target = target[part]
+            self._in_progress.add(ref)
+            try:
+                value = self.resolve(target)
+            finally:
+                self._in_progress.discard(ref)
+            self._resolved[ref] = value
+            return value
+
+    def resolve(self, node: Any) -> Any:
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if isinstance(ref, str) and ref.startswith("#/"):
+                return self.resolve_ref(ref)
+            return {key: self.resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [self.resolve(item) for item in node]
+        return node
+
+    def __len__(self) -> int:
+        return len(self._resolved)
+
+
+class SpecIndex:
+    """Индекс операций спецификации по тегу, префиксу пути, методу и operationId"""
+
+    def __init__(self, spec_id: str, spec: Dict[str, Any], source_size: int):
+        self.spec_id = spec_id
+        self.spec = spec
+        self.source_size = source_size
+        self.schemas = SchemaTable(spec)
+        self.operations: List[Dict[str, Any]] = []
+        self.by_key: Dict[str, int] = {}
+        self.by_tag: Dict[str, List[int]] = {}
+        self.by_method: Dict[str, List[int]] = {}
+        self.by_operation_id: Dict[str, int] = {}
+        self._raw: Dict[str, tuple] = {}
+
+        for method, path, operation, shared_params in iter_operations(spec):
+            key = operation_key(method, path)
+            tags = [str(tag) for tag in (operation.get("tags") or ["API"])]
+            info = {
+                "key": key,
+                "method": method.upper(),
+                "path": path,
+                "operation_id": operation.get("operationId"),
+                "summary": operation.get("summary", ""),
+                "tags": tags,
+                "deprecated": bool(operation.get("deprecated", False)),
+            }
+            position = len(self.operations)
+            self.operations.append(info)
+            self.by_key[key] = position
+            self._raw[key] = (operation, shared_params)
+            for tag in tags:
+                self.by_tag.setdefault(tag, []).append(position)
+            self.by_method.setdefault(info["method"], []).append(position)
+            if info["operation_id"]:
+                self.by_operation_id[str(info["operation_id"])] = position
+
+    def tags(self) -> Dict[str, int]:
+        return {tag: len(positions) for tag, positions in self.by_tag.items()}
+
+    def filter(self, tag: Optional[str] = None, path_prefix: Optional[str] = None,
+               method: Optional[str] = None, operation_id: Optional[str] = None,
+               query: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Операции, подходящие под все заданные фильтры, в порядке спецификации"""
+        if operation_id is not None:
+            position = self.by_operation_id.get(operation_id)
+            candidates: Iterable[int] = [] if position is None else [position]
+        elif tag is not None:
+            candidates = self.by_tag.get(tag, [])
+        elif method is not None:
+            candidates = self.by_method.get(method.upper(), [])
+        else:
+            candidates = range(len(self.operations))
+
+        needle = query.lower() if query else None
+        result = []
+        for position in candidates:
+            info = self.operations[position]
+            if tag is not None and tag not in info["tags"]:
+                continue
+            if method is not None and info["method"] != method.upper():
+                continue
+            if path_prefix is not None and not info["path"].startswith(path_prefix):
+                continue
+            if needle and needle not in info["key"].lower() and needle not in str(info["summary"]).lower() \
+                    and needle not in str(info["operation_id"] or "").lower():
+                continue
+            result.append(info)
+        return result
+
+    def resolved_operation(self, key: str) -> Dict[str, Any]:
+        """Операция с раскрытыми через таблицу схем $ref и влитыми параметрами уровня path"""
+        operation, shared_params = self._raw[key]
+        params: Dict[tuple, Any] = {}
+        for param in list(shared_params) + list(operation.get("parameters") or []):
+            param = self.schemas.resolve(param)
+            if isinstance(param, dict):
+                params[(param.get("name"), param.get("in"))] = param
+        resolved = self.schemas.resolve({k: v for k, v in operation.items() if k != "parameters"})
+        if params:
+            resolved["parameters"] = list(params.values())
+        return resolved
+
+    def subset_spec(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Спецификация только с выбранными операциями, без components"""
+        subset: Dict[str, Any] = {k: v for k, v in self.spec.items() if k not in ("paths", "components")}
+        paths: Dict[str, Any] = {}
+        for key in keys:
+            if key not in self.by_key:
+                continue
+            info = self.operations[self.by_key[key]]
+            paths.setdefault(info["path"], {})[info["method"].lower()] = self.resolved_operation(key)
+        subset["paths"] = paths
+        return subset
+
+
+class SpecIndexCache:
+    """LRU-кеш индексов спецификаций, ограниченный числом записей и суммарным размером"""
+
+    def __init__(self, max_entries: int = SPEC_CACHE_MAX_ENTRIES, max_bytes: int = SPEC_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, SpecIndex]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, spec_id: str) -> Optional[SpecIndex]:
+        with self._lock:
+            index = self._items.get(spec_id)
+            if index is not None:
+                self._items.move_to_end(spec_id)
+            return index
+
+    def put(self, index: SpecIndex) -> None:
+        with self._lock:
+            previous = self._items.pop(index.spec_id, None)
+            if previous is not None:
+                self._bytes -= previous.source_size
+            self._items[index.spec_id] = index
+            self._bytes += index.source_size
+            while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+                if len(self._items) == 1:
+                    break
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.source_size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes}
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Хранилище результатов по id и восстановление входа из unified diff относительно сохраненного результата"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Ограничения хранилища: число текстов и их суммарный размер в символах
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_SIZE", "256"))
+RESULT_STORE_MAX_CHARS = int(os.getenv("RESULT_STORE_MAX_CHARS", str(256 * 1024 * 1024)))
+
+_HUNK_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchError(ValueError):
+    """Diff не применяется к базовому тексту"""
+
+
+def result_id_for(text: str) -> str:
+    """Id результата — хеш текста: одинаковый текст всегда получает один и тот же id"""
+    return hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()[:32]
+
+
+class ResultStore:
+    """LRU-хранилище текстов (входы и результаты Blue/Purple) и связей «вход режима → результат».
+
+    Связи позволяют не обращаться к модели повторно за тем же входом (весь модуль или отдельный пакет).
+    """
+
+    def __init__(self, max_entries: int = RESULT_STORE_MAX_ENTRIES, max_chars: int = RESULT_STORE_MAX_CHARS):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._links: "OrderedDict[str, str]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def put(self, text: str) -> str:
+        result_id = result_id_for(text)
+        with self._lock:
+            if result_id in self._texts:
+                self._texts.move_to_end(result_id)
+                return result_id
+            self._texts[result_id] = text
+            self._chars += len(text)
+            while len(self._texts) > 1 and (len(self._texts) > self.max_entries or self._chars > self.max_chars):
+                _, evicted = self._texts.popitem(last=False)
+                self._chars -= len(evicted)
+        return result_id
+
+    def get(self, result_id: str) -> Optional[str]:
+        with self._lock:
+            text = self._texts.get(result_id)
+            if text is not None:
+                self._texts.move_to_end(result_id)
+            return text
+
+    def link(self, key: str, text: str) -> None:
+        """Запоминает результат обработки входа key (например, "blue:<id входа>")"""
+        result_id = self.put(text)
+        with self._lock:
+            self._links[key] = result_id
+            self._links.move_to_end(key)
+            while len(self._links) > self.max_entries * 4:
+                self._links.popitem(last=False)
+
+    def lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            result_id = self._links.get(key)
+        return self.get(result_id) if result_id is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._texts), "chars": self._chars, "links": len(self._links)}
+
+
+def apply_unified_diff(base: str, diff: str) -> str:
+    """Применяет unified diff (diff -u, git diff) к base.
+
+    Строки контекста и удаляемые строки сверяются с base; если hunk сдвинут относительно
+    указанной позиции, он ищется дальше по тексту. Несовпадение — PatchError.
+    """
+    lines = base.splitlines(keepends=True)
+    diff_lines = diff.splitlines(keepends=True)
+    result: List[str] = []
+    position = 0
+    hunks = 0
+    i = 0
+    while i < len(diff_lines):
+        match = _HUNK_RE.match(diff_lines[i])
+        i += 1
+        if not match:
+            continue  # заголовки ---/+++, diff --git, index ...
+        hunks += 1
+        old_start = int(match.group(1))
+        old_count = int(match.group(2) or 1)
+        new_count = int(match.group(4) or 1)
+        old: List[str] = []
+        new: List[str] = []
+        # Конец hunk определяется счетчиками из заголовка, как в patch
+        while i < len(diff_lines) and (len(old) < old_count or len(new) < new_count):
+            line = diff_lines[i]
+            i += 1
+            tag, text = line[:1], line[1:]
+            if tag == "\\":
+                continue
+            if tag in (" ", "\n", "\r"):
+                text = text if tag == " " else line
+                old.append(text)
+                new.append(text)
+            elif tag == "-":
+                old.append(text)
+            elif tag == "+":
+                new.append(text)
+            else:
+                raise PatchError(f"Hunk #{hunks}: неожиданная строка diff: {line[:80]!r}")
+            # "\ No newline at end of file" относится к только что прочитанной строке
+            if i < len(diff_lines) and diff_lines[i].startswith("\\"):
+                i += 1
+                for block in ((old, new) if tag not in ("-", "+") else (old,) if tag == "-" else (new,)):
+                    block[-1] = block[-1].rstrip("\r\n")
+        if len(old) != old_count or len(new) != new_count:
+            raise PatchError(f"Hunk #{hunks} обрезан: ожидалось -{old_count} +{new_count} строк")
+
+        start = old_start - 1 if old_count else old_start
+        found = _find_block(lines, old, start, position)
+        if found is None:
+            raise PatchError(f"Hunk #{hunks} (строка {old_start}) не совпадает с базовым текстом")
+        result.extend(lines[position:found])
+        result.extend(new)
+        position = found + len(old)
+    if not hunks:
+        raise PatchError("Diff не содержит ни одного hunk")
+    result.extend(lines[position:])
+    return "".join(result)
+
+
+def _find_block(lines: List[str], block: List[str], start: int, position: int) -> Optional[int]:
+    stripped = [line.rstrip("\r\n") for line in block]
+
+    def matches(at: int) -> bool:
+        # Сравнение без учета перевода строки: CRLF и "No newline at end of file" не мешают применению
+        return all(lines[at + k].rstrip("\r\n") == stripped[k] for k in range(len(block)))
+
+    if start >= position and start + len(block) <= len(lines) and matches(start):
+        return start
+    if not block:
+        return min(max(start, position), len(lines))
+    for at in range(position, len(lines) - len(block) + 1):
+        if matches(at):
+            return at
+    return None
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Выбор модели для вызова: по режиму, размеру входа и подсказке клиента, с эскалацией на большую модель"""
+import contextvars
+import json
+import os
+from typing import Any, Callable, Dict, Optional
+
+from code_repair import check_code
+from compaction import is_compact_form
+
+# Большая модель — по умолчанию для всех режимов и цель эскалации
+LLM_MODEL = os.getenv("LLM_MODEL", "Qwen/Qwen3-235B-A22B-Instruct-2507")
+# Малая быстрая модель; пока не задана, все вызовы идут в LLM_MODEL
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "").strip()
+
+# До какого размера промпта (в символах, вместе с системным) вызов режима уходит в малую модель; 0 — никогда
+ROUTING_SMALL_MAX_CHARS: Dict[str, int] = {
+    "green": 8000,
+    "lime": 8000,
+    "hybrid": 16000,
+    "blue": 12000,
+    "purple": 24000,
+    "repair": 12000,
+}
+ROUTING_SMALL_MAX_CHARS.update({
+    mode: int(limit) for mode, limit in json.loads(os.getenv("MODEL_ROUTING", "{}") or "{}").items()
+})
+
+# Подсказка клиента для текущего запроса: fast — малая модель, quality — большая
+model_hint_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("model_hint", default=None)
+
+
+def choose_model(mode: str, input_chars: int, hint: Optional[str] = None) -> str:
+    """Модель для вызова режима mode с промптом размером input_chars"""
+    if not LLM_SMALL_MODEL or hint == "quality":
+        return LLM_MODEL
+    if hint == "fast":
+        return LLM_SMALL_MODEL
+    limit = ROUTING_SMALL_MAX_CHARS.get(mode, 0)
+    return LLM_SMALL_MODEL if 0 < limit and input_chars <= limit else LLM_MODEL
+
+
+def strip_code_fence(text: str) -> str:
+    """Убирает обрамление ```python ... ``` из ответа модели"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def _valid_python(text: str) -> bool:
+    return bool(text) and check_code(text) is None
+
+
+def _valid_json_object(text: str) -> bool:
+    try:
+        return isinstance(json.loads(text), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+def _valid_code_or_json(text: str) -> bool:
+    return _valid_json_object(text) or _valid_python(text)
+
+
+def _valid_code_or_compact(text: str) -> bool:
+    return is_compact_form(text) or _valid_python(text)
+
+
+def _valid_report(text: str) -> bool:
+    return "##" in text and len(text) > 200
+
+
+# Структурная проверка ответа по режиму: не прошедший проверку ответ малой модели переспрашивается у большой
+VALIDATORS: Dict[str, Callable[[str], bool]] = {
+    "green": _valid_code_or_json,
+    "lime": _valid_python,
+    "hybrid": _valid_json_object,
+    # Blue отвечает кодом или, для модулей ручных тестов, компактной формой (compaction.py)
+    "blue": _valid_code_or_compact,
+    "purple": _valid_report,
+    "repair": _valid_python,
+}
+
+
+def response_is_valid(mode: str, response: Any) -> bool:
+    """Ответ не обрезан по max_tokens и проходит структурную проверку режима"""
+    choices = getattr(response, "choices", None) or []
+    if not choices:
+        return False
+    if getattr(choices[0], "finish_reason", None) == "length":
+        return False
+    validator = VALIDATORS.get(mode)
+    if validator is None:
+        return True
+    return validator(strip_code_fence(choices[0].message.content or ""))
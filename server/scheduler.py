@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Планировщик допуска вызовов модели: общий лимит и слоты по режимам, честная очередь по
+вызывающим сторонам и приоритет коротких заданий со старением.
+
+Когда освобождается слот, из ожидающих вызовов, для режима которых есть свободный слот,
+выбирается вызов с наименьшей эффективной стоимостью:
+
+    оценка токенов * (1 + вызовов этой стороны в работе) / (1 + ожидание / SCHEDULER_AGING_SECONDS)
+
+Короткие вызовы проходят раньше длинных, сторона, уже занявшая много слотов, уступает остальным,
+а длинный вызов со временем все равно получает слот. Слоты пакетных режимов (lime, blue)
+меньше общего лимита, поэтому часть слотов всегда остается интерактивным запросам.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# Сколько вызовов модели выполняется одновременно
+SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", "16"))
+# Слоты по режимам в JSON; режим без записи ограничен только общим лимитом
+SCHEDULER_MODE_SLOTS: Dict[str, int] = {"lime": 6, "hybrid": 6, "blue": 6}
+SCHEDULER_MODE_SLOTS.update(json.loads(os.getenv("SCHEDULER_MODE_SLOTS", "{}") or "{}"))
+# За сколько секунд ожидания эффективная стоимость вызова уменьшается вдвое
+SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "10"))
+
+# Сколько последних ожиданий учитывается в статистике
+_WAIT_WINDOW = 1000
+
+
+def estimate_completion_tokens(input_chars: int, max_tokens: int) -> int:
+    """Ожидаемая длина ответа: не длиннее промпта (~3 символа на токен) и не больше max_tokens"""
+    return min(max_tokens, input_chars // 3 + 1)
+
+
+def estimate_call_tokens(input_chars: int, max_tokens: int) -> int:
+    """Оценка размера вызова: токены промпта и ожидаемого ответа"""
+    return input_chars // 3 + 1 + estimate_completion_tokens(input_chars, max_tokens)
+
+
+class _Ticket:
+    __slots__ = ("mode", "caller", "tokens", "enqueued", "future")
+
+    def __init__(self, mode: str, caller: str, tokens: int):
+        self.mode = mode
+        self.caller = caller
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class FairScheduler:
+    """Очередь допуска к upstream: ticket = await acquire(...), вызов, release(ticket)"""
+
+    def __init__(self, max_concurrent: int = SCHEDULER_MAX_CONCURRENT,
+                 mode_slots: Optional[Dict[str, int]] = None, aging_seconds: float = SCHEDULER_AGING_SECONDS):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.mode_slots = dict(SCHEDULER_MODE_SLOTS if mode_slots is None else mode_slots)
+        self.aging_seconds = aging_seconds
+        self.running = 0
+        self._running_by_mode: Dict[str, int] = {}
+        self._running_by_caller: Dict[str, int] = {}
+        self._waiting: List[_Ticket] = []
+        self._waits: Dict[str, Deque[float]] = {}
+        self.admitted = 0
+
+    def _mode_free(self, mode: str) -> bool:
+        limit = self.mode_slots.get(mode, self.max_concurrent)
+        return self._running_by_mode.get(mode, 0) < max(limit, 1)
+
+    def _cost(self, ticket: _Ticket, now: float) -> float:
+        waited = now - ticket.enqueued
+        share = 1 + self._running_by_caller.get(ticket.caller, 0)
+        return ticket.tokens * share / (1 + waited / self.aging_seconds)
+
+    def _start(self, ticket: _Ticket) -> None:
+        self.running += 1
+        self._running_by_mode[ticket.mode] = self._running_by_mode.get(ticket.mode, 0) + 1
+        self._running_by_caller[ticket.caller] = self._running_by_caller.get(ticket.caller, 0) + 1
+        self.admitted += 1
+        waits = self._waits.setdefault(ticket.mode, deque(maxlen=_WAIT_WINDOW))
+        waits.append(time.monotonic() - ticket.enqueued)
+
+    def _finish(self, ticket: _Ticket) -> None:
+        self.running -= 1
+        self._running_by_mode[ticket.mode] -= 1
+        self._running_by_caller[ticket.caller] -= 1
+        if not self._running_by_caller[ticket.caller]:
+            del self._running_by_caller[ticket.caller]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self.running < self.max_concurrent:
+            candidates = [ticket for ticket in self._waiting if self._mode_free(ticket.mode)]
+            if not candidates:
+                return
+            ticket = min(candidates, key=lambda candidate: self._cost(candidate, now))
+            self._waiting.remove(ticket)
+            if ticket.future.done():
+                # Ожидание отменено в том же такте цикла событий: слот достается следующему
+                continue
+            self._start(ticket)
+            ticket.future.set_result(None)
+
+    async def acquire(self, mode: str, caller: str, tokens: int) -> _Ticket:
+        """Ждет слот для вызова; слот возвращается через release(ticket)"""
+        ticket = _Ticket(mode, caller, tokens)
+        if not self._waiting and self.running < self.max_concurrent and self._mode_free(mode):
+            self._start(ticket)
+            return ticket
+        self._waiting.append(ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            # Клиент ушел, пока вызов ждал в очереди: слот либо не выдан, либо сразу возвращается
+            if ticket.future.done() and not ticket.future.cancelled():
+                self._finish(ticket)
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket) -> None:
+        self._finish(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, занятые слоты и времена ожидания по режимам"""
+        now = time.monotonic()
+        modes: Dict[str, Dict[str, Any]] = {}
+        for mode in set(self._running_by_mode) | set(self._waits) | {ticket.mode for ticket in self._waiting}:
+            queued = [now - ticket.enqueued for ticket in self._waiting if ticket.mode == mode]
+            waits = sorted(self._waits.get(mode, ()))
+            modes[mode] = {
+                "running": self._running_by_mode.get(mode, 0),
+                "slots": min(self.mode_slots.get(mode, self.max_concurrent), self.max_concurrent),
+                "queued": len(queued),
+                "oldest_wait_ms": round(max(queued) * 1000, 1) if queued else 0.0,
+                "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+            }
+        callers: Dict[str, int] = {}
+        for ticket in self._waiting:
+            callers[ticket.caller] = callers.get(ticket.caller, 0) + 1
+        return {
+            "running": self.running,
+            "max_concurrent": self.max_concurrent,
+            "queued": len(self._waiting),
+            "admitted": self.admitted,
+            "modes": modes,
+            "queued_by_caller": callers,
+        }
@@ -1,8 +1,9 @@
+import gc
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import List, Optional, Union
 
-from pydantic import BaseModel, field_validator, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 
 
 class PriorityEnum(str, Enum):
@@ -13,6 +14,8 @@ class PriorityEnum(str, Enum):
 
 # Основная схема для описания теста
 class AllureTest(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     # Общие атрибуты теста
     owner: str
     feature: str
@@ -21,41 +24,47 @@ class AllureTest(BaseModel):
     manual_mark: bool = True
     title: Optional[str]
     priority: PriorityEnum
-    tags: List[str]  # Преобразуем в обычный список
+    # Минимальная длина проверяется ограничением схемы в pydantic-core, без Python-валидатора
+    tags: List[str] = Field(min_length=1)
     labels: dict = Field(default_factory=dict)
 
-    # Валидатор для проверки минимальной длины списка tags
-    @field_validator('tags')
-    def validate_tags(cls, v):
-        if len(v) < 1:
-            raise ValueError('tags must contain at least one item')
-        return v
-
-    class ConfigDict:
-        from_attributes = True
-
 
 # Схема для описания шага с вложениями
 class AllureStep(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     step_name: str
     step_action: str
     attachments: Optional[List[str]] = []
 
-    class ConfigDict:
-        from_attributes = True
-
 
 # Схема для теста с шагами
 class TestCase(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     test: AllureTest
     steps: List[AllureStep]
 
-    class ConfigDict:
-        from_attributes = True
-
 
 class AllureTestOpsReport(BaseModel):
     testCases: List[TestCase]
 
     def to_json(self):
         return self.model_dump_json(indent=4)
+
+
+# Адаптер строится один раз: разбор JSON и валидация выполняются за один проход в pydantic-core
+REPORT_ADAPTER: TypeAdapter[AllureTestOpsReport] = TypeAdapter(AllureTestOpsReport)
+
+
+def parse_report_json(raw: Union[str, bytes]) -> AllureTestOpsReport:
+    """Отчет из сырого JSON ответа модели без промежуточного dict; ValidationError при несоответствии схеме"""
+    # Создаваемые модели не образуют циклов, а проходы gc по растущей куче на больших отчетах
+    # занимают до трети времени разбора, поэтому на время валидации сборщик выключается
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return REPORT_ADAPTER.validate_json(raw)
+    finally:
+        if gc_enabled:
+            gc.enable()
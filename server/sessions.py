@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Состояние диалоговых сессий (WebSocket /ws/session): исходные данные, текущий результат и последние уточнения.
+
+Сессии хранятся в памяти процесса с ограничениями по числу, суммарному размеру и времени простоя;
+при превышении вытесняются давно не использовавшиеся.
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+# Сколько сессий хранится одновременно
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "500"))
+# Суммарный размер исходных данных и результатов всех сессий, символов
+SESSION_MAX_TOTAL_CHARS = int(os.getenv("SESSION_MAX_TOTAL_CHARS", str(200 * 1024 * 1024)))
+# Через сколько секунд простоя сессия удаляется
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+# Сколько последних уточнений пользователя попадает в промпт
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+
+
+class Session:
+    """Одна сессия: режим, исходные данные первого хода, последний результат и окно уточнений"""
+
+    def __init__(self, mode: str, source: str, model_hint: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.source = source
+        self.result = ""
+        self.model_hint = model_hint
+        self.turns: Deque[str] = deque(maxlen=SESSION_MAX_TURNS)
+        self.turn_count = 0
+        self.touched = time.monotonic()
+        # Ходы одной сессии выполняются по очереди, даже если ее возобновили несколько соединений
+        self.lock = asyncio.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.source) + len(self.result) + sum(len(turn) for turn in self.turns)
+
+    def messages(self, system_prompt: str, instruction: str) -> List[Dict[str, str]]:
+        """Промпт уточнения: исходные данные, текущий результат, недавние уточнения и новое.
+
+        Размер промпта не зависит от длины диалога: в него попадает только последний результат
+        и не больше SESSION_MAX_TURNS предыдущих уточнений.
+        """
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.source:
+            messages.append({"role": "user", "content": self.source})
+            messages.append({"role": "assistant", "content": self.result})
+        else:
+            # Исходник (код, спецификация) целиком заменен результатом и в промпт не попадает
+            messages.append({"role": "user", "content": f"Текущий результат:\n{self.result}"})
+        if self.turns:
+            history = "\n".join(f"- {turn}" for turn in self.turns)
+            messages.append({"role": "user", "content": f"Уже выполненные уточнения (результат выше их учитывает):\n{history}"})
+        messages.append({"role": "user", "content": instruction})
+        return messages
+
+
+class SessionStore:
+    """LRU-хранилище сессий с TTL простоя и ограничением суммарного размера"""
+
+    def __init__(self, max_count: int = SESSION_MAX_COUNT, max_total_chars: int = SESSION_MAX_TOTAL_CHARS,
+                 ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_count = max_count
+        self.max_total_chars = max_total_chars
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, mode: str, source: str, model_hint: Optional[str] = None) -> Session:
+        session = Session(mode, source, model_hint)
+        self._sessions[session.id] = session
+        self._evict()
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.touched = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def update(self, session: Session, result: str, instruction: Optional[str] = None) -> None:
+        """Фиксирует результат хода; вызывается только после успешного ответа модели"""
+        session.result = result
+        if instruction is not None:
+            session.turns.append(instruction)
+        session.turn_count += 1
+        session.touched = time.monotonic()
+        if session.id in self._sessions:
+            self._sessions.move_to_end(session.id)
+            self._evict()
+
+    def drop(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl_seconds
+        # Порядок OrderedDict — порядок последнего обращения, поэтому устаревшие сессии в начале
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.touched >= deadline:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def _evict(self) -> None:
+        self._expire()
+        total = sum(session.size for session in self._sessions.values())
+        # Последняя (текущая) сессия не вытесняется, даже если одна превышает лимит
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_count or total > self.max_total_chars):
+            _, session = self._sessions.popitem(last=False)
+            total -= session.size
+            self.evicted += 1
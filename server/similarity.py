@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Кеш генераций Green по нормализованному отпечатку требований с поиском почти совпадающих текстов.
+
+Тексты требований, вставленные в Green повторно, часто отличаются только пробелами, нумерацией,
+регистром, пунктуацией, припиской в конце или значениями owner/feature/story/suite. Перед сравнением
+текст нормализуется: значения метаданных выносятся в параметры, нумерация и пунктуация убираются,
+пробелы схлопываются. Совпадение нормализованного отпечатка позволяет вернуть прошлый результат с
+подставленными метаданными без обращения к модели; почти совпадающий текст (доля общих шинглов —
+последовательностей из SHINGLE_SIZE слов — не ниже порога) находится по инвертированному индексу
+шинглов, и его результат передается модели только как основа: даже при сходстве 0.99 в длинном тексте
+может поменяться ожидаемый код ответа или граничное значение, поэтому без модели возвращается только
+точное совпадение нормализованного текста.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# Сколько результатов Green хранится в кеше
+GREEN_CACHE_SIZE = int(os.getenv("GREEN_CACHE_SIZE", "512"))
+# Суммарный размер хранимых результатов в символах
+GREEN_CACHE_MAX_CHARS = int(os.getenv("GREEN_CACHE_MAX_CHARS", str(64 * 1024 * 1024)))
+# Доля общих шинглов, начиная с которой прошлый результат передается модели как основа (0 — не искать похожие)
+GREEN_SIMILAR_THRESHOLD = float(os.getenv("GREEN_SIMILAR_THRESHOLD", "0.6"))
+
+# Шингл — последовательность из стольких слов нормализованного текста
+SHINGLE_SIZE = 3
+# Шинглы, встречающиеся в стольких записях, не участвуют в поиске кандидатов (общие фразы шаблона)
+_COMMON_SHINGLE_ENTRIES = 64
+
+# Метаданные Allure, которые меняются между запросами и подставляются в готовый результат
+_FIELD_ALIASES = {
+    "owner": ("owner", "владелец", "автор", "ответственный"),
+    "feature": ("feature", "фича", "функциональность"),
+    "story": ("story", "история", "user story"),
+    "suite": ("suite", "сьют", "набор"),
+}
+# "Owner: ivanov", "- feature — Авторизация", "story = Вход по паролю" в начале строки
+_METADATA_RE = {
+    field: re.compile(
+        r"^[ \t\-*•\d.)]*(?:" + "|".join(re.escape(alias) for alias in aliases) + r")[ \t]*[:=—–-][ \t]*(?P<value>[^\n]+?)[ \t]*$",
+        re.IGNORECASE | re.MULTILINE,
+    )
+    for field, aliases in _FIELD_ALIASES.items()
+}
+# Нумерация пунктов: "1.", "2)", "1.2.", "a)", маркеры списков. Число без точки или скобки в конце —
+# часть текста ("404 ответ вернуть"), а не номер пункта
+_NUMBERING_RE = re.compile(r"^[ \t]*(?:[-*•]+|\d+(?:\.\d+)*[.)]|[a-zа-я][.)])[ \t]+", re.IGNORECASE | re.MULTILINE)
+# Разделители (,.;:, кавычки, скобки) убираются; операторы сравнения и арифметики меняют смысл требования
+# ("сумма > 100" и "сумма < 100"), поэтому остаются отдельными словами; "!=" сводится к "≠",
+# а одиночный "!" — восклицательный знак
+_OPERATORS = "<>=+\\-*/%≤≥≠"
+_PUNCTUATION_RE = re.compile(rf"[^\w\s{{}}{_OPERATORS}]+")
+_OPERATOR_RE = re.compile(rf"[{_OPERATORS}]+")
+_SPACES_RE = re.compile(r"\s+")
+# Декораторы с метаданными в сгенерированном коде
+_DECORATOR_RE = {
+    "owner": re.compile(r'(@allure\.label\(\s*["\']owner["\']\s*,\s*)(["\'])(.*?)\2'),
+    "feature": re.compile(r'(@allure\.feature\(\s*)(["\'])(.*?)\2'),
+    "story": re.compile(r'(@allure\.story\(\s*)(["\'])(.*?)\2'),
+    "suite": re.compile(r'(@allure\.suite\(\s*)(["\'])(.*?)\2'),
+}
+
+
+def normalize_requirements(text: str) -> Tuple[str, Dict[str, str]]:
+    """Нормализованный текст требований и вынесенные из него значения метаданных"""
+    metadata: Dict[str, str] = {}
+    for field, pattern in _METADATA_RE.items():
+        match = pattern.search(text)
+        if match:
+            metadata[field] = match.group("value").strip().strip("\"'«»")
+            text = pattern.sub("{" + field + "}", text)
+    text = _NUMBERING_RE.sub("", text).lower()
+    text = _PUNCTUATION_RE.sub(" ", text.replace("!=", "≠"))
+    text = _OPERATOR_RE.sub(lambda match: f" {match.group(0)} ", text)
+    return _SPACES_RE.sub(" ", text).strip(), metadata
+
+
+def shingles(normalized: str, size: int = SHINGLE_SIZE) -> FrozenSet[int]:
+    """Хеши шинглов нормализованного текста (для коротких текстов — весь текст одним шинглом)"""
+    words = normalized.split()
+    if len(words) <= size:
+        return frozenset([hash(" ".join(words))])
+    return frozenset(hash(" ".join(words[i:i + size])) for i in range(len(words) - size + 1))
+
+
+def substitute_metadata(code: str, metadata: Dict[str, str]) -> str:
+    """Подставляет значения метаданных запроса в декораторы Allure прошлого результата"""
+    for field, value in metadata.items():
+        pattern = _DECORATOR_RE.get(field)
+        if pattern is not None:
+            code = pattern.sub(lambda match, value=value: _quoted(match, value), code)
+    return code
+
+
+def _quoted(match: "re.Match[str]", value: str) -> str:
+    quote = match.group(2)
+    return match.group(1) + quote + value.replace("\\", "\\\\").replace(quote, "\\" + quote) + quote
+
+
+class _Entry:
+    __slots__ = ("key", "scope", "shingles", "code")
+
+    def __init__(self, key: str, scope: str, shingle_set: FrozenSet[int], code: str):
+        self.key = key
+        self.scope = scope
+        self.shingles = shingle_set
+        self.code = code
+
+
+class CacheMatch:
+    """Найденный прошлый результат: exact — совпал нормализованный отпечаток (только его можно вернуть без модели)"""
+
+    __slots__ = ("code", "similarity", "exact")
+
+    def __init__(self, code: str, similarity: float, exact: bool):
+        self.code = code
+        self.similarity = similarity
+        self.exact = exact
+
+
+class SimilarityCache:
+    """LRU-кеш результатов по нормализованному отпечатку с инвертированным индексом шинглов.
+
+    scope разделяет записи, которые нельзя подставлять друг другу (например, разные подсказки модели).
+    """
+
+    def __init__(self, max_entries: int = GREEN_CACHE_SIZE, max_chars: int = GREEN_CACHE_MAX_CHARS,
+                 similar_threshold: float = GREEN_SIMILAR_THRESHOLD):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.similar_threshold = similar_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._index: Dict[int, List[str]] = {}
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(scope: str, normalized: str) -> str:
+        return hashlib.sha256(f"{scope}\x00{normalized}".encode("utf-8", errors="replace")).hexdigest()
+
+    def lookup(self, text: str, scope: str = "") -> Optional[CacheMatch]:
+        """Прошлый результат для текста с подставленными метаданными: точный или ближайший похожий (основа для модели)"""
+        normalized, metadata = normalize_requirements(text)
+        key = self._key(scope, normalized)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return CacheMatch(substitute_metadata(entry.code, metadata), 1.0, True)
+            best, similarity = self._nearest(shingles(normalized), scope) if self.similar_threshold else (None, 0.0)
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best.key)
+            self.similar += 1
+            code = substitute_metadata(best.code, metadata)
+        return CacheMatch(code, round(similarity, 4), False)
+
+    def _nearest(self, shingle_set: FrozenSet[int], scope: str) -> Tuple[Optional[_Entry], float]:
+        # Число общих шинглов с каждой записью по спискам индекса; частые шинглы пропускаются
+        shared: Dict[str, int] = {}
+        for shingle in shingle_set:
+            keys = self._index.get(shingle)
+            if keys and len(keys) <= _COMMON_SHINGLE_ENTRIES:
+                for key in keys:
+                    shared[key] = shared.get(key, 0) + 1
+        best, best_similarity = None, 0.0
+        for key, count in shared.items():
+            entry = self._entries[key]
+            if entry.scope != scope:
+                continue
+            # Частые шинглы не посчитаны, поэтому точное значение считается по множествам
+            if count / len(shingle_set) < self.similar_threshold / 2:
+                continue
+            common = len(shingle_set & entry.shingles)
+            similarity = common / (len(shingle_set) + len(entry.shingles) - common)
+            if similarity > best_similarity:
+                best, best_similarity = entry, similarity
+        if best_similarity < self.similar_threshold:
+            return None, 0.0
+        return best, best_similarity
+
+    def put(self, text: str, code: str, scope: str = "") -> None:
+        normalized, _ = normalize_requirements(text)
+        key = self._key(scope, normalized)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._drop(previous)
+            entry = _Entry(key, scope, shingles(normalized), code)
+            self._entries[key] = entry
+            self._chars += len(code)
+            for shingle in entry.shingles:
+                self._index.setdefault(shingle, []).append(key)
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._chars > self.max_chars):
+                _, evicted = self._entries.popitem(last=False)
+                self._drop(evicted)
+
+    def _drop(self, entry: _Entry) -> None:
+        self._chars -= len(entry.code)
+        for shingle in entry.shingles:
+            keys = self._index.get(shingle)
+            if keys is not None:
+                keys.remove(entry.key)
+                if not keys:
+                    del self._index[shingle]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "chars": self._chars,
+                "shingles": len(self._index),
+                "hits": self.hits,
+                "similar": self.similar,
+                "misses": self.misses,
+            }
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""Общая настройка тестов сервера: модули server и benchmarks импортируются без установки пакета"""
+import os
+import sys
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.join(SERVER_DIR, "benchmarks"))
+
+# main создает клиент OpenAI при импорте; в тестах модель не вызывается
+os.environ.setdefault("OPENAI_API_KEY", "sk-tests-00000000000000")
+os.environ.setdefault("OPENAI_BASE_URL", "http://127.0.0.1:9/v1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("USAGE_DB", os.path.join(tempfile.gettempdir(), "sos-tests-usage.db"))
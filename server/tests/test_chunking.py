@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Сборка модуля из ответов по пакетам (chunking.assemble_module): одноименные классы пакетов не перекрывают друг друга"""
+import ast
+
+from chunking import assemble_module, make_batches, split_test_module
+from code_repair import check_code
+
+ORIGINAL = '''import allure
+
+
+def allure_step(text):
+    return allure.step(text)
+
+
+@allure.feature("Auth")
+class TestLogin:
+    def test_login(self):
+        pass
+
+
+@allure.feature("Auth")
+class TestLogout:
+    def test_logout(self):
+        pass
+'''
+
+
+def _batch_output(test_name):
+    return f'''import allure
+from pytest import mark
+
+
+def allure_step(text):
+    return allure.step(text)
+
+
+@allure.feature("Auth")
+class TestAuth:
+    def {test_name}(self):
+        pass
+
+
+def test_smoke():
+    pass
+'''
+
+
+def test_same_class_names_from_different_batches_are_kept():
+    original = split_test_module(ORIGINAL)
+    assert len(make_batches(original.units, budget=30)) == 2
+    code = assemble_module(original, [_batch_output("test_login"), _batch_output("test_logout")])
+    assert check_code(code) is None
+    tree = ast.parse(code)
+    names = [node.name for node in tree.body if isinstance(node, (ast.ClassDef, ast.FunctionDef))]
+    assert names == ["allure_step", "TestAuth", "test_smoke", "TestAuth_2", "test_smoke_2"]
+    classes = {node.name: [child.name for child in node.body] for node in tree.body if isinstance(node, ast.ClassDef)}
+    assert classes == {"TestAuth": ["test_login"], "TestAuth_2": ["test_logout"]}
+    assert code.count("from pytest import mark") == 1
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Пакетная генерация (cli.py): имена результатов не пересекаются, conftest.py профиля xdist — свой у каждой спецификации"""
+import cli
+
+
+def _outputs(tmp_path, names, profile="default"):
+    for name in names:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("{}", encoding="utf-8")
+    return {job.source: (job.output, job.report) for job in cli.find_jobs(str(tmp_path), profile)}
+
+
+def test_unique_names_keep_plain_output(tmp_path):
+    assert _outputs(tmp_path, ["api.yaml", "sub/login.txt"]) == {
+        "api.yaml": ("test_api.py", "test_api.validation.txt"),
+        "sub/login.txt": ("sub/test_login.py", "sub/test_login.validation.txt"),
+    }
+
+
+def test_same_stem_keeps_suffix(tmp_path):
+    outputs = _outputs(tmp_path, ["api.json", "api.yaml", "req.md", "req.txt", "req_txt.md", "other/api.yaml"])
+    assert {source: output for source, (output, _) in outputs.items()} == {
+        "api.json": "test_api_json.py",
+        "api.yaml": "test_api_yaml.py",
+        "req.md": "test_req_md.py",
+        "req.txt": "test_req_txt.py",
+        "req_txt.md": "test_req_txt_2.py",
+        "other/api.yaml": "other/test_api.py",
+    }
+    assert len({path for pair in outputs.values() for path in pair}) == 2 * len(outputs)
+
+
+def test_xdist_specs_of_one_directory_get_own_conftest(tmp_path):
+    outputs = _outputs(tmp_path, ["billing.yaml", "users.json", "login.txt", "single/api.yaml"], profile="xdist")
+    assert {source: output for source, (output, _) in outputs.items()} == {
+        "billing.yaml": "test_billing/test_billing.py",
+        "login.txt": "test_login.py",
+        "users.json": "test_users/test_users.py",
+        "single/api.yaml": "single/test_api.py",
+    }
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Распаковка тел запросов: лимит MAX_DECOMPRESSED_BODY соблюдается без распаковки бомбы целиком"""
+import asyncio
+import gzip
+import tracemalloc
+
+import pytest
+
+from compression import BodyTooLargeError, CompressionMiddleware, DecompressionError, decompress_body
+
+PAYLOAD = ("Проверка входа по паролю " * 20000).encode("utf-8")
+LIMIT = 4 * 1024 * 1024
+
+
+def _bomb_peak(body: bytes, encoding: str) -> int:
+    """Пик памяти Python во время отказа в распаковке"""
+    tracemalloc.start()
+    try:
+        with pytest.raises(BodyTooLargeError):
+            decompress_body(body, encoding, max_size=LIMIT)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_gzip_round_trip_and_bomb():
+    assert decompress_body(gzip.compress(PAYLOAD), "gzip") == PAYLOAD
+    assert _bomb_peak(gzip.compress(b"\0" * (256 * 1024 * 1024)), "gzip") < 4 * LIMIT
+
+
+def test_unknown_encoding():
+    with pytest.raises(DecompressionError):
+        decompress_body(b"data", "lzma")
+
+
+def test_brotli_round_trip_and_bomb():
+    brotli = pytest.importorskip("brotli")
+    assert decompress_body(brotli.compress(PAYLOAD), "br") == PAYLOAD
+    # ~1 KB сжатого тела разворачивается в 1 GB; превышение лимита до отказа — не больше порции вывода
+    assert _bomb_peak(brotli.compress(b"\0" * (1 << 30), quality=5), "br") < 4 * LIMIT + 32 * 1024 * 1024
+
+
+def test_brotli_truncated_body():
+    brotli = pytest.importorskip("brotli")
+    with pytest.raises(DecompressionError):
+        decompress_body(brotli.compress(PAYLOAD)[:-8], "br")
+
+
+@pytest.mark.parametrize("write_content_size", [True, False])
+def test_zstd_round_trip_and_bomb(write_content_size):
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor(write_content_size=write_content_size)
+    assert decompress_body(compressor.compress(PAYLOAD), "zstd") == PAYLOAD
+    # Превышение лимита — 413, а не ошибка формата; с размером в заголовке кадра буфер на 1 GB не выделяется
+    assert _bomb_peak(compressor.compress(b"\0" * (1 << 30)), "zstd") < 4 * LIMIT + 32 * 1024 * 1024
+
+
+def test_zstd_truncated_body():
+    zstandard = pytest.importorskip("zstandard")
+    with pytest.raises(DecompressionError):
+        decompress_body(zstandard.ZstdCompressor().compress(PAYLOAD)[:-8], "zstd")
+
+
+def _compressed_headers(response_headers):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": response_headers})
+        await send({"type": "http.response.body", "body": PAYLOAD})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app, minimum_size=1)(scope, None, send))
+    return [(k.lower(), v) for k, v in messages[0]["headers"]]
+
+
+def test_vary_merged_into_existing_header():
+    headers = _compressed_headers([(b"content-type", b"text/plain"), (b"Vary", b"Origin")])
+    assert [v for k, v in headers if k == b"vary"] == [b"Origin, Accept-Encoding"]
+    assert (b"content-encoding", b"gzip") in headers
+
+    headers = _compressed_headers([(b"content-type", b"text/plain"), (b"vary", b"accept-encoding")])
+    assert [v for k, v in headers if k == b"vary"] == [b"accept-encoding"]
+
+    headers = _compressed_headers([(b"content-type", b"text/plain")])
+    assert [v for k, v in headers if k == b"vary"] == [b"Accept-Encoding"]
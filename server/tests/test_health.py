@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Учет нагрузки для /health/ready: простаивающие WebSocket-сессии не делают экземпляр неготовым"""
+import asyncio
+
+from health import InFlightCounter, InFlightMiddleware, readiness
+
+UPSTREAM = {"ok": True, "latency_ms": 1.0, "error": None, "age_s": 0.0}
+
+
+def test_websocket_sessions_do_not_count_as_load(monkeypatch):
+    monkeypatch.setattr("health.READINESS_MAX_INFLIGHT", 2)
+    counter = InFlightCounter()
+    observed = {}
+
+    async def run():
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await release.wait()
+
+        middleware = InFlightMiddleware(app, counter)
+        sockets = [asyncio.create_task(middleware({"type": "websocket", "path": "/ws/session"}, None, None))
+                   for _ in range(5)]
+        request = asyncio.create_task(middleware({"type": "http", "path": "/generate"}, None, None))
+        await asyncio.sleep(0)
+        observed["snapshot"] = counter.snapshot()
+        observed["ready"] = readiness(UPSTREAM, counter=counter)["status"]
+        release.set()
+        await asyncio.gather(*sockets, request)
+
+    asyncio.run(run())
+    assert observed["snapshot"] == {"in_flight": 1, "peak": 1, "websockets": 5}
+    assert observed["ready"] == "ready"
+    assert counter.snapshot() == {"in_flight": 0, "peak": 1, "websockets": 0}
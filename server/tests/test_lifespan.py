@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Старт приложения через lifespan: фоновые задачи запускаются без устаревшего on_event"""
+import warnings
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_lifespan_starts_background_work(monkeypatch):
+    async def warm_up():
+        return {"ok": False, "latency_ms": None, "error": "upstream отключен в тестах", "age_s": 0.0}
+
+    monkeypatch.setattr(main.upstream_probe, "warm_up", warm_up)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        with TestClient(main.app) as client:
+            assert client.get("/health").status_code == 200
+            assert main.event_loop_lag._task is not None and not main.event_loop_lag._task.done()
+            assert main.usage_store._thread is not None and main.usage_store._thread.is_alive()
+    assert not main.app.router.on_startup
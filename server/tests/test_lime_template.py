@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Шаблонный и гибридный вывод /lime: модуль компилируется при любых тегах, operationId и path параметрах"""
+import ast
+import asyncio
+import types
+
+import pytest
+
+import main
+from code_repair import check_code
+
+
+def _spec(paths, **components):
+    return {"openapi": "3.0.0", "info": {"title": "API", "version": "1"}, "paths": paths, "components": components}
+
+
+def _module(spec, **kwargs):
+    code = main.generate_template_tests_from_openapi(spec, **kwargs)
+    assert check_code(code) is None
+    return ast.parse(code)
+
+
+def _classes(tree):
+    return {node.name: [item.name for item in node.body if isinstance(item, ast.FunctionDef)]
+            for node in tree.body if isinstance(node, ast.ClassDef)}
+
+
+def _urls(tree):
+    """Значения присваиваний url: в модуле это обычные строки, не f-string"""
+    urls = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "url" for target in node.targets):
+            assert isinstance(node.value, ast.Constant), ast.dump(node.value)
+            urls.append(node.value.value)
+    return urls
+
+
+@pytest.mark.parametrize("profile", ["default", "xdist"])
+def test_tags_become_unique_class_names(profile):
+    spec = _spec({
+        "/a": {"get": {"tags": ["2fa"], "responses": {"200": {}}}},
+        "/b": {"get": {"tags": ["v1.users"], "responses": {"200": {}}}},
+        "/c": {"post": {"tags": ["2-fa"], "responses": {"201": {}}}},
+    })
+    names = list(_classes(_module(spec, profile=profile)))
+    assert names == ["Tag2faTests", "v1_usersTests", "Tag2faTests_2"]
+
+
+def test_operation_ids_do_not_shadow_each_other():
+    spec = _spec({"/users/{id}": {
+        "get": {"operationId": "get-user", "tags": ["users"], "responses": {"200": {}}},
+        "delete": {"operationId": "get_user", "tags": ["users"], "responses": {"204": {}}},
+    }})
+    assert _classes(_module(spec)) == {"usersTests": ["test_get_user", "test_get_user_2"]}
+
+
+def test_path_params_are_substituted_with_sample_values():
+    spec = _spec(
+        {
+            # Параметр уровня path через $ref, схема операции переопределяет тип
+            "/users/{id}": {"parameters": [{"$ref": "#/components/parameters/Id"}],
+                            "get": {"responses": {"200": {}}}},
+            "/orders/{orderId}/items/{sku}": {"get": {"parameters": [
+                {"name": "orderId", "in": "path", "required": True, "schema": {"type": "string", "format": "uuid"}},
+                {"name": "sku", "in": "path", "required": True, "schema": {"type": "string", "enum": ["A 1", "B"]}},
+            ], "responses": {"200": {}}}},
+            # Не объявленный параметр — иначе f-string подставил бы встроенный id
+            "/files/{id}": {"get": {"responses": {"200": {}}}},
+            "/tags/{name}": {"get": {"parameters": [
+                {"name": "name", "in": "path", "required": True, "schema": {"type": "string"}, "example": "qa"},
+            ], "responses": {"200": {}}}},
+        },
+        parameters={"Id": {"name": "id", "in": "path", "required": True, "schema": {"type": "integer"}}},
+    )
+    assert _urls(_module(spec)) == [
+        "https://api.example.com/users/1",
+        "https://api.example.com/orders/00000000-0000-0000-0000-000000000001/items/A%201",
+        "https://api.example.com/files/1",
+        "https://api.example.com/tags/qa",
+    ]
+    assert _urls(_module(spec, profile="xdist"))[0] == "/users/1"
+
+
+def test_hybrid_assertions_that_break_the_module_are_dropped():
+    spec = _spec({"/users": {"get": {"responses": {"200": {}}}}})
+    code = main.generate_template_tests_from_openapi(spec, {"GET /users": ["assert (response_json"]})
+    assert check_code(code) is None
+    assert "assert (response_json" not in code
+
+
+def test_hybrid_output_compiles(monkeypatch):
+    spec = _spec({"/v1/{slug}": {"get": {"operationId": "get-slug", "tags": ["v1.items"], "responses": {"200": {}}}}})
+
+    async def fake_completion(mode, messages, **kwargs):
+        message = types.SimpleNamespace(content='{"GET /v1/{slug}": ["assert response_json[\\"id\\"] > 0, \\"нет id\\""]}')
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+    monkeypatch.setattr(main, "chat_completion", fake_completion)
+    code = asyncio.run(main.generate_hybrid_tests_from_openapi(spec))
+    assert check_code(code) is None
+    assert 'assert response_json["id"] > 0' in code
+    assert _urls(ast.parse(code)) == ["https://api.example.com/v1/1"]
+
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Регрессия пикового потребления памяти /lime, /blue, /purple, /export на большом входе.
+
+Замер тот же, что в benchmarks/memory_bench.py: каждый эндпоинт обрабатывает вход в отдельном
+процессе, прирост VmHWM сравнивается с MAX_MULTIPLE. Размер входа — MEMORY_TEST_SIZE_MB (по умолчанию 20).
+"""
+import os
+
+import pytest
+
+import memory_bench
+
+pytestmark = [
+    pytest.mark.slow,
+    pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="VmHWM доступен только в Linux"),
+]
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("memory"))
+    return directory, memory_bench.write_inputs(directory, float(os.getenv("MEMORY_TEST_SIZE_MB", "20")))
+
+
+@pytest.mark.parametrize("endpoint", memory_bench.ENDPOINTS)
+def test_peak_memory_within_limit(inputs, endpoint):
+    directory, paths = inputs
+    result = memory_bench.measure(endpoint, paths, directory)
+    assert result["status"] == 200
+    assert result["multiple"] <= memory_bench.MAX_MULTIPLE[endpoint], (
+        f"{endpoint}: пик {result['peak_delta'] / 1048576:.1f} MB = {result['multiple']:.1f}x входа"
+    )
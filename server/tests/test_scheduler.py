@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""FairScheduler: отмена ожидания в том же такте, в котором release() выдает слот"""
+import asyncio
+
+import pytest
+
+from scheduler import FairScheduler
+
+
+def test_cancel_and_release_in_same_tick():
+    async def run():
+        scheduler = FairScheduler(max_concurrent=1, mode_slots={})
+        first = await scheduler.acquire("green", "a", 10)
+        waiter = asyncio.create_task(scheduler.acquire("green", "b", 10))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 1
+        # Отмена и освобождение слота без переключения на ожидающую задачу
+        waiter.cancel()
+        scheduler.release(first)
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        stats = scheduler.stats()
+        assert (stats["running"], stats["queued"]) == (0, 0)
+        # Слот не потерян: следующий вызов проходит сразу
+        ticket = await asyncio.wait_for(scheduler.acquire("green", "c", 10), 1)
+        scheduler.release(ticket)
+
+    asyncio.run(run())
+
+
+def test_cancel_after_slot_granted_returns_it():
+    async def run():
+        scheduler = FairScheduler(max_concurrent=1, mode_slots={})
+        first = await scheduler.acquire("green", "a", 10)
+        waiter = asyncio.create_task(scheduler.acquire("green", "b", 10))
+        await asyncio.sleep(0)
+        # Слот выдан, но задача отменена раньше, чем успела продолжиться
+        scheduler.release(first)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["running"] == 0
+
+    asyncio.run(run())
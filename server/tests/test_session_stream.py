@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Уточнение в диалоговой сессии: поток модели закрывается сразу, если клиент перестал принимать фрагменты"""
+import asyncio
+
+import pytest
+
+import main
+from sessions import Session
+
+
+class _DisconnectedSocket:
+    """WebSocket, который принимает первый фрагмент и падает на втором (клиент отключился)"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, payload):
+        if self.sent:
+            raise RuntimeError("websocket закрыт")
+        self.sent.append(payload)
+
+
+def test_followup_closes_stream_when_client_disconnects(monkeypatch):
+    events = []
+
+    async def fake_stream(mode, messages, max_tokens, temperature):
+        try:
+            for text in ("import allure\n", "class TestA:\n", "    pass\n"):
+                yield text
+            events.append("finished")
+        finally:
+            events.append("closed")
+
+    async def run():
+        socket = _DisconnectedSocket()
+        with pytest.raises(RuntimeError):
+            await main.run_session_followup(socket, Session("blue", "код"), "добавь тест")
+        # Генератор закрыт до выхода из run_session_followup, без участия сборщика мусора
+        assert events == ["closed"]
+        assert socket.sent == [{"type": "delta", "text": "import allure\n"}]
+
+    monkeypatch.setattr(main, "chat_completion_stream", fake_stream)
+    asyncio.run(run())
+
+
+class _Socket:
+    async def send_json(self, payload):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_turns_of_one_session_run_in_order(monkeypatch):
+    active = []
+    prompts = []
+
+    async def fake_stream(mode, messages, max_tokens, temperature):
+        active.append(1)
+        assert len(active) == 1, "два хода одной сессии выполняются одновременно"
+        prompts.append("\n".join(message["content"] for message in messages))
+        await asyncio.sleep(0.01)
+        yield f"class TestTurn{len(prompts)}:\n    def test_ok(self):\n        pass\n"
+        active.pop()
+
+    async def run():
+        session = main.session_store.create("blue", "", None)
+        turns = [main.SessionMessage(type="message", text=f"уточнение {number}") for number in (1, 2)]
+        await asyncio.gather(*(main.run_session_turn(_Socket(), session, turn) for turn in turns))
+        return session
+
+    monkeypatch.setattr(main, "chat_completion_stream", fake_stream)
+    session = asyncio.run(run())
+    assert session.turn_count == 2
+    # Второе уточнение видит результат первого
+    assert "TestTurn1" in prompts[1]
+    assert "TestTurn2" in session.result
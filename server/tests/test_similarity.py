@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Нормализация требований Green и повторное использование прошлых результатов из SimilarityCache"""
+import pytest
+
+from similarity import SimilarityCache, normalize_requirements
+
+CODE = '''import allure
+
+
+@allure.feature("Авторизация")
+@allure.label("owner", "ivanov")
+class TestLogin:
+    def test_login(self):
+        pass
+'''
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1. Шаг\n404 ответ вернуть", "шаг 404 ответ вернуть"),
+    ("2) Открыть форму\n1.2. Ввести логин", "открыть форму ввести логин"),
+    ("- пункт\n* пункт\n• пункт\na) пункт", "пункт пункт пункт пункт"),
+    ("200 OK при валидном запросе", "200 ok при валидном запросе"),
+    ("  Проверить   ответ,  СТАТУС 201!  ", "проверить ответ статус 201"),
+    ("Сумма>100; скидка -5%", "сумма > 100 скидка - 5 %"),
+    ("статус != 200", "статус ≠ 200"),
+])
+def test_normalize_requirements(text, expected):
+    assert normalize_requirements(text)[0] == expected
+
+
+def test_metadata_is_extracted():
+    normalized, metadata = normalize_requirements("Owner: ivanov\nFeature — Авторизация\nПроверить вход")
+    assert metadata == {"owner": "ivanov", "feature": "Авторизация"}
+    assert normalized == "{owner} {feature} проверить вход"
+
+
+def _requirements(status: int) -> str:
+    steps = [f"Шаг {i}: пользователь отправляет запрос номер {i} с корректными данными и получает ответ" for i in range(30)]
+    steps.insert(15, f"Сервис возвращает код {status} для удаленного пользователя")
+    return "\n".join(steps)
+
+
+def test_exact_match_is_reused_with_new_metadata():
+    cache = SimilarityCache()
+    cache.put("Owner: ivanov\n1. Войти по паролю\n2. Проверить профиль", CODE)
+    match = cache.lookup("owner: petrov\n1) войти по паролю!\n2) проверить   профиль")
+    assert match is not None and match.exact
+    assert '@allure.label("owner", "petrov")' in match.code
+
+
+def test_near_match_only_seeds_the_model():
+    cache = SimilarityCache()
+    cache.put(_requirements(200), CODE)
+    match = cache.lookup(_requirements(404))
+    assert match is not None
+    assert match.similarity > 0.9
+    assert not match.exact
+    assert cache.stats()["hits"] == 0 and cache.stats()["similar"] == 1
+
+
+def test_leading_number_is_part_of_requirement():
+    cache = SimilarityCache()
+    cache.put("404 ответ вернуть при удаленном пользователе", CODE)
+    match = cache.lookup("500 ответ вернуть при удаленном пользователе")
+    assert match is None or not match.exact
+
+
+def test_unrelated_text_is_a_miss():
+    cache = SimilarityCache()
+    cache.put(_requirements(200), CODE)
+    assert cache.lookup("Совсем другие требования к экспорту отчетов в PDF") is None
+
+
+def test_requirements_differing_by_operator_are_not_exact():
+    cache = SimilarityCache()
+    cache.put("Owner: ivanov\nЕсли сумма заказа > 100, применить скидку 5%", CODE)
+    match = cache.lookup("Owner: ivanov\nЕсли сумма заказа < 100, применить скидку 5%")
+    assert match is None or not match.exact
+    assert cache.lookup("Owner: petrov\nЕсли сумма заказа >100 применить скидку 5 %").exact
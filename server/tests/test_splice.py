@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Вклейка дозапрошенных тестов (openapi_diff.splice_module): прежние тесты не перекрываются новыми"""
+import ast
+
+from code_repair import check_code
+from openapi_diff import splice_module
+
+PREVIOUS = '''import allure
+import requests
+
+
+def allure_step(text):
+    return allure.step(text)
+
+
+class TestUsers:
+    @allure.label("operation", "GET /users/{id}")
+    def test_get_user(self):
+        assert requests.get("/users/1").status_code == 200
+
+
+def test_health():
+    assert requests.get("/health").status_code == 200
+'''
+
+NEW = '''import allure
+import pytest
+import requests
+
+
+def allure_step(text):
+    return allure.step(text)
+
+
+class TestUsers:
+    """Дозапрошенные тесты"""
+
+    @allure.label("operation", "GET /users/{id}")
+    @allure.label("coverage", "status:404")
+    def test_get_user(self):
+        assert requests.get("/users/0").status_code == 404
+
+    def test_get_user_2(self):
+        assert requests.get("/users/x").status_code == 400
+
+    def test_get_user(self):
+        assert requests.get("/users/-1").status_code == 404
+
+
+class TestOrders:
+    def test_list(self):
+        assert requests.get("/orders").status_code == 200
+
+
+def test_health():
+    assert requests.get("/health").status_code in (200, 503)
+'''
+
+
+def _tests(code):
+    tree = ast.parse(code)
+    functions = [node.name for node in tree.body if isinstance(node, ast.FunctionDef)]
+    classes = {node.name: [child.name for child in node.body if isinstance(child, ast.FunctionDef)]
+               for node in tree.body if isinstance(node, ast.ClassDef)}
+    return functions, classes
+
+
+def test_merged_methods_do_not_shadow_existing():
+    code = splice_module(PREVIOUS, NEW)
+    assert check_code(code) is None
+    functions, classes = _tests(code)
+    assert classes == {
+        "TestUsers": ["test_get_user", "test_get_user_2", "test_get_user_2_2", "test_get_user_3"],
+        "TestOrders": ["test_list"],
+    }
+    # Хелпер не дублируется, тест верхнего уровня с тем же именем переименован
+    assert functions == ["allure_step", "test_health", "test_health_2"]
+    assert code.count("import pytest") == 1
+    assert '"/users/1"' in code and '"/users/0"' in code and '"/users/-1"' in code
+
+
+def test_splice_is_stable_for_repeated_rounds():
+    code = splice_module(splice_module(PREVIOUS, NEW), NEW)
+    assert check_code(code) is None
+    _, classes = _tests(code)
+    assert len(classes["TestUsers"]) == len(set(classes["TestUsers"])) == 7
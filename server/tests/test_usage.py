@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""UsageStore: первая запись не ждет создания базы в цикле событий"""
+import time
+
+from usage import UsageStore
+
+
+class _SlowStore(UsageStore):
+    """База, открытие которой занимает заметное время (большой файл, медленный диск, чистка по retention)"""
+
+    def _connect(self):
+        time.sleep(0.5)
+        return super()._connect()
+
+
+def test_record_does_not_wait_for_database(tmp_path):
+    store = _SlowStore(str(tmp_path / "usage.db"))
+    started = time.perf_counter()
+    store.record(request_id="r1", mode="green", model="m", caller="test", status="ok", input_chars=10,
+                 latency_ms=1.0, prompt_tokens=5, completion_tokens=7, cached_tokens=0)
+    assert time.perf_counter() - started < 0.2
+    # Запись, поставленная до готовности базы, сохраняется, когда поток записи ее создаст
+    summary = store.summary(0, time.time() + 1, ["mode"])
+    assert summary["totals"]["calls"] == 1
+    store.close()
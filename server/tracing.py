@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""Трассировка этапов обработки запроса в формате OpenTelemetry (OTLP/JSON) без внешних зависимостей.
+
+Контекст трассы принимается и передается в заголовке W3C traceparent; спаны пишутся
+фоновым потоком в локальный файл (JSON Lines) или отправляются в OTLP/HTTP коллектор.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# none — трассировка выключена; file — запись в TRACE_FILE; otlp — отправка в TRACE_OTLP_ENDPOINT
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").strip().lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "sos-server")
+# Доля трасс, которые записываются, если клиент не передал решение о семплировании
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_STATUS_OK, _STATUS_ERROR = 1, 2
+_SPAN_KIND_INTERNAL, _SPAN_KIND_SERVER = 1, 2
+
+_logger = logging.getLogger("sos.tracing")
+
+
+class Span:
+    """Завершенный или активный спан; сериализуется в OTLP/JSON"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "kind",
+                 "start_ns", "end_ns", "attributes", "status_code", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, kind: int = _SPAN_KIND_INTERNAL):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+        self.status_code = 0
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def set_error(self, error: BaseException) -> None:
+        self.status_code = _STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"[:500]
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": self.status_code or _STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class _NoopSpan:
+    """Заглушка для выключенной трассировки: вызовы ничего не стоят"""
+
+    trace_id = None
+    sampled = False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def set_error(self, error: BaseException) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """Разбирает W3C traceparent: (trace_id, parent_span_id, sampled) или None"""
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if not match or match.group(1) == "ff" or set(match.group(2)) == {"0"} or set(match.group(3)) == {"0"}:
+        return None
+    return match.group(2), match.group(3), bool(int(match.group(4), 16) & 1)
+
+
+def tracing_enabled() -> bool:
+    return TRACE_EXPORTER in ("file", "otlp")
+
+
+def current_span():
+    """Активный спан текущего контекста (или заглушка)"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+@contextmanager
+def start_span(name: str, traceparent: Optional[str] = None, kind: int = _SPAN_KIND_INTERNAL, **attributes):
+    """Открывает дочерний спан текущего контекста (или корневой, продолжающий traceparent)"""
+    if not tracing_enabled():
+        yield NOOP_SPAN
+        return
+    parent = _current_span.get()
+    if parent is not None:
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    else:
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+        else:
+            trace_id, parent_id = "%032x" % random.getrandbits(128), None
+            sampled = random.random() < TRACE_SAMPLE_RATE
+    span = Span(name, trace_id, parent_id, sampled, kind)
+    span.set_attributes(attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if span.sampled:
+            _get_exporter().export(span)
+
+
+class _Exporter:
+    """Фоновый экспорт спанов пакетами: запись в файл или POST в OTLP/HTTP коллектор"""
+
+    def __init__(self, kind: str, batch_size: int = 256, flush_interval: float = 1.0):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        batch: List[Span] = []
+        deadline: Optional[float] = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                span = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # Истек интервал — сбрасываем накопленное
+                self._write(batch)
+                batch, deadline = [], None
+                continue
+            if span is None:
+                self._write(batch)
+                return
+            batch.append(span)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch, deadline = [], None
+
+    def _payload(self, batch: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "sos"}, "spans": [span.to_otlp() for span in batch]}],
+        }]}
+
+    def _write(self, batch: List[Span]) -> None:
+        if not batch:
+            return
+        try:
+            payload = json.dumps(self._payload(batch), ensure_ascii=False, separators=(",", ":"))
+            if self.kind == "file":
+                with open(TRACE_FILE, "a", encoding="utf-8") as trace_file:
+                    trace_file.write(payload + "\n")
+            else:
+                import httpx
+                httpx.post(TRACE_OTLP_ENDPOINT, content=payload.encode("utf-8"),
+                           headers={"Content-Type": "application/json"}, timeout=5.0)
+        except Exception as e:
+            # Трассировка не должна влиять на обработку запросов
+            _logger.warning("Не удалось экспортировать спаны: %s", e)
+
+
+_exporter: Optional[_Exporter] = None
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter() -> _Exporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = _Exporter(TRACE_EXPORTER)
+    return _exporter
+
+
+class TracingMiddleware:
+    """ASGI middleware: корневой спан запроса, продолжающий трассу из заголовка traceparent"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracing_enabled():
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1")
+        request_size = headers.get(b"content-length", b"").decode("latin-1")
+        with start_span(
+            f"{scope.get('method')} {scope.get('path')}",
+            traceparent=traceparent,
+            kind=_SPAN_KIND_SERVER,
+            **{
+                "http.request.method": scope.get("method"),
+                "url.path": scope.get("path"),
+                "http.request.body.size": int(request_size) if request_size.isdigit() else None,
+                "http.request.header.content_encoding": headers.get(b"content-encoding", b"").decode("latin-1") or None,
+            },
+        ) as span:
+            response_size = 0
+
+            async def send_with_trace(message):
+                nonlocal response_size
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    message["headers"] = list(message.get("headers", [])) + [(b"traceparent", span.traceparent().encode("latin-1"))]
+                elif message["type"] == "http.response.body":
+                    response_size += len(message.get("body", b""))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                span.set_attribute("http.response.body.size", response_size)
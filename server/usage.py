@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Учет токенов и стоимости вызовов модели в локальной SQLite базе и агрегаты по ней"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Файл базы учета; запись выполняет фоновый поток, обработчики запросов не ждут диск
+USAGE_DB = os.getenv("USAGE_DB", "usage.db")
+# Сколько дней хранятся записи
+USAGE_RETENTION_DAYS = float(os.getenv("USAGE_RETENTION_DAYS", "90"))
+# Цены за 1M токенов по моделям: {"<model>": {"input": 0.0, "output": 0.0, "cached_input": 0.0}}
+USAGE_MODEL_PRICES: Dict[str, Dict[str, float]] = json.loads(os.getenv("USAGE_MODEL_PRICES", "{}") or "{}")
+
+# Идентификатор вызывающей стороны (команда, сервис) из заголовка X-Caller-ID
+caller_var: contextvars.ContextVar[str] = contextvars.ContextVar("caller", default="anonymous")
+
+GROUP_COLUMNS = {
+    "mode": "mode",
+    "caller": "caller",
+    "model": "model",
+    "hour": "strftime('%Y-%m-%dT%H:00', ts, 'unixepoch')",
+    "day": "strftime('%Y-%m-%d', ts, 'unixepoch')",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    request_id TEXT,
+    caller TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    model TEXT NOT NULL,
+    status TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    input_chars INTEGER NOT NULL DEFAULT 0,
+    latency_ms REAL NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    saved_tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS llm_calls_ts ON llm_calls (ts);
+CREATE INDEX IF NOT EXISTS llm_calls_request ON llm_calls (request_id);
+"""
+
+_INSERT = """
+INSERT INTO llm_calls (ts, request_id, caller, mode, model, status, prompt_tokens, completion_tokens,
+                       cached_tokens, input_chars, latency_ms, cost, saved_tokens)
+VALUES (:ts, :request_id, :caller, :mode, :model, :status, :prompt_tokens, :completion_tokens,
+        :cached_tokens, :input_chars, :latency_ms, :cost, :saved_tokens)
+"""
+
+_AGGREGATES = """
+COUNT(*) AS calls,
+COUNT(DISTINCT request_id) AS requests,
+SUM(status NOT IN ('ok', 'cancelled', 'cached')) AS errors,
+SUM(status = 'cancelled') AS cancelled,
+SUM(status = 'cached') AS cache_hits,
+COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+COALESCE(SUM(cached_tokens), 0) AS cached_tokens,
+COALESCE(SUM(input_chars), 0) AS input_chars,
+ROUND(COALESCE(AVG(latency_ms), 0), 1) AS avg_latency_ms,
+ROUND(COALESCE(MAX(latency_ms), 0), 1) AS max_latency_ms,
+ROUND(COALESCE(SUM(cost), 0), 6) AS cost,
+COALESCE(SUM(saved_tokens), 0) AS saved_tokens
+"""
+
+_logger = logging.getLogger("sos.usage")
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    """Стоимость вызова по таблице цен USAGE_MODEL_PRICES (0, если цена модели не задана)"""
+    prices = USAGE_MODEL_PRICES.get(model) or USAGE_MODEL_PRICES.get("*")
+    if not prices:
+        return 0.0
+    cached_price = prices.get("cached_input", prices.get("input", 0.0))
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * prices.get("input", 0.0) + cached_tokens * cached_price
+            + completion_tokens * prices.get("output", 0.0)) / 1_000_000
+
+
+def usage_tokens(usage: Any) -> Dict[str, int]:
+    """Токены из response.usage OpenAI-совместимого ответа (поля могут отсутствовать)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+        "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+        "cached_tokens": int(getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+    }
+
+
+class UsageStore:
+    """Хранилище учета: запись пакетами в фоновом потоке, чтение отдельными соединениями"""
+
+    def __init__(self, path: str = USAGE_DB, retention_days: float = USAGE_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._queue: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self._ready = threading.Event()
+        self._disabled = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def start(self) -> None:
+        """Запускает поток записи, не дожидаясь создания базы; записи до готовности ждут в очереди"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _start(self) -> None:
+        """Запуск с ожиданием готовности базы — только для чтения (вызывается вне цикла событий)"""
+        self.start()
+        self._ready.wait(timeout=10)
+
+    def record(self, **entry: Any) -> None:
+        """Ставит запись в очередь; не блокирует вызывающий поток (создание базы идет в потоке записи)"""
+        if self._thread is None:
+            self.start()
+        if self._disabled:
+            return
+        entry.setdefault("ts", time.time())
+        entry.setdefault("saved_tokens", 0)
+        entry["cost"] = call_cost(entry["model"], entry["prompt_tokens"], entry["completion_tokens"], entry["cached_tokens"])
+        self._queue.put(entry)
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def flush(self) -> None:
+        """Дожидается записи всего, что уже поставлено в очередь"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put({"_flush": done})
+        done.wait(timeout=10)
+
+    def _run(self) -> None:
+        try:
+            connection = self._connect()
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+            # Базы, созданные до учета отмененных вызовов, получают недостающую колонку
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(llm_calls)")}
+            if "saved_tokens" not in columns:
+                connection.execute("ALTER TABLE llm_calls ADD COLUMN saved_tokens INTEGER NOT NULL DEFAULT 0")
+            connection.execute("DELETE FROM llm_calls WHERE ts < ?", (time.time() - self.retention_days * 86400,))
+            connection.commit()
+        except sqlite3.Error as e:
+            # Учет не должен мешать обработке запросов: без базы записи просто не сохраняются
+            _logger.error("База учета токенов недоступна (%s): %s", self.path, e)
+            self._disabled = True
+            self._ready.set()
+            return
+        self._ready.set()
+        while True:
+            entry = self._queue.get()
+            batch = [entry]
+            # Забираем все, что успело накопиться, и пишем одной транзакцией
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in batch if item is not None and "_flush" not in item]
+            try:
+                if rows:
+                    with connection:
+                        connection.executemany(_INSERT, rows)
+            except sqlite3.Error as e:
+                _logger.warning("Не удалось записать учет токенов: %s", e)
+            for item in batch:
+                if item is not None and "_flush" in item:
+                    item["_flush"].set()
+            if any(item is None for item in batch):
+                connection.close()
+                return
+
+    def summary(self, since: float, until: float, group_by: List[str], mode: Optional[str] = None,
+                caller: Optional[str] = None, top: int = 10) -> Dict[str, Any]:
+        """Агрегаты за окно [since, until): итоги, группы и top-N самых дорогих запросов"""
+        if self._thread is None:
+            self._start()
+        if self._disabled:
+            raise RuntimeError(f"База учета токенов недоступна: {self.path}")
+        self.flush()
+        where = ["ts >= :since", "ts < :until"]
+        params: Dict[str, Any] = {"since": since, "until": until, "top": top}
+        if mode is not None:
+            where.append("mode = :mode")
+            params["mode"] = mode
+        if caller is not None:
+            where.append("caller = :caller")
+            params["caller"] = caller
+        condition = " AND ".join(where)
+
+        connection = self._connect()
+        try:
+            totals = dict(connection.execute(f"SELECT {_AGGREGATES} FROM llm_calls WHERE {condition}", params).fetchone())
+            groups: List[Dict[str, Any]] = []
+            if group_by:
+                keys = ", ".join(f"{GROUP_COLUMNS[name]} AS {name}" for name in group_by)
+                rows = connection.execute(
+                    f"SELECT {keys}, {_AGGREGATES} FROM llm_calls WHERE {condition} "
+                    f"GROUP BY {', '.join(group_by)} ORDER BY cost DESC, prompt_tokens + completion_tokens DESC",
+                    params,
+                )
+                groups = [dict(row) for row in rows]
+            top_requests = [dict(row) for row in connection.execute(
+                f"""SELECT request_id, MIN(ts) AS ts, caller, GROUP_CONCAT(DISTINCT mode) AS modes,
+                           COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens,
+                           SUM(completion_tokens) AS completion_tokens, SUM(cached_tokens) AS cached_tokens,
+                           ROUND(SUM(latency_ms), 1) AS latency_ms, ROUND(SUM(cost), 6) AS cost
+                    FROM llm_calls WHERE {condition}
+                    GROUP BY request_id ORDER BY cost DESC, prompt_tokens + completion_tokens DESC LIMIT :top""",
+                params,
+            )]
+        finally:
+            connection.close()
+        return {"since": since, "until": until, "totals": totals, "groups": groups, "top_requests": top_requests}
+
+
+class CallerMiddleware:
+    """ASGI middleware: идентификатор вызывающей стороны из заголовка X-Caller-ID для учета токенов (HTTP и WebSocket)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        caller = ""
+        for header_name, header_value in scope.get("headers", []):
+            if header_name == b"x-caller-id":
+                caller = header_value.decode("latin-1").strip()[:64]
+                break
+        token = caller_var.set(caller or "anonymous")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            caller_var.reset(token)